@@ -0,0 +1,101 @@
+"""Поток событий для админ панели (Server-Sent Events).
+
+send_message и start_chat публикуют события в один брокер процесса.
+Брокер не рассылает каждое событие сразу: события копятся и раз в
+interval секунд уходят одним сообщением вместе со снимком счетчиков.
+Сообщение сериализуется один раз и кладется в очереди всех подписчиков,
+поэтому всплеск ответов и число открытых админок не умножают работу сервера.
+"""
+import asyncio
+import json
+from typing import Any, Callable, Dict, List, Optional, Set
+
+
+# сколько событий передается в одной пачке; остальные только подсчитываются
+MAX_EVENTS_PER_FLUSH = 200
+# сколько сообщений может ждать медленный подписчик
+SUBSCRIBER_QUEUE_SIZE = 32
+
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, message: str):
+        if self.queue.full():
+            # подписчик не успевает: выбрасываем накопленное и просим перечитать состояние
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(format_sse("resync", {}))
+            return
+        self.queue.put_nowait(message)
+
+
+class EventBroadcaster:
+    def __init__(self, snapshot: Callable[[], Dict[str, Any]], interval: float = 0.5):
+        # snapshot() - текущие счетчики, отправляются в каждой пачке
+        self.snapshot = snapshot
+        self.interval = interval
+        self._subscribers: Set[Subscription] = set()
+        self._pending: List[Dict[str, Any]] = []
+        self._dropped = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event_type: str, data: Dict[str, Any]):
+        """O(1): событие уйдет со следующей пачкой; без подписчиков ничего не копится"""
+        if not self._subscribers:
+            return
+        if len(self._pending) < MAX_EVENTS_PER_FLUSH:
+            self._pending.append({"type": event_type, **data})
+        else:
+            self._dropped += 1
+        self._wakeup.set()
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription()
+        subscription.offer(format_sse("stats", self.snapshot()))
+        self._subscribers.add(subscription)
+        self._ensure_running()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._subscribers:
+            await self._wakeup.wait()
+            # все, что придет за interval, уйдет одной пачкой
+            await asyncio.sleep(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        events, dropped = self._pending, self._dropped
+        self._pending, self._dropped = [], 0
+        if not events or not self._subscribers:
+            return
+        message = format_sse("batch", {"events": events, "dropped": dropped, "stats": self.snapshot()})
+        for subscription in list(self._subscribers):
+            subscription.offer(message)
+
+    async def close(self):
+        self._subscribers.clear()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
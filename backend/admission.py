@@ -0,0 +1,194 @@
+"""Допуск запросов чата при перегрузке.
+
+Одновременно обрабатывается не больше max_concurrent запросов чата,
+остальные ждут в очереди. Ходы уже начатых опросов (turn) идут раньше
+новых сессий (start), а reserved_turn_slots мест новые сессии не занимают
+вовсе, поэтому всплеск новых респондентов не увеличивает задержку тем,
+кто уже отвечает.
+
+У каждого класса свой бюджет ожидания в очереди. Если по текущей очереди и
+среднему времени обработки запрос не успеет в бюджет (или не дождался
+места), он отклоняется сразу: 503 с Retry-After. Новые респонденты получают
+ответ "комнаты ожидания" и повторяют запрос через Retry-After.
+
+AdmissionMiddleware держит место до конца ответа, включая потоковое тело.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from metrics import Counter, Histogram
+
+
+TURN = "turn"
+START = "start"
+
+ADMISSION_QUEUE_WAIT = Histogram(
+    "survey_admission_queue_seconds", "Time chat requests waited for an admission slot", ("kind",)
+)
+ADMISSION_REJECTED = Counter(
+    "survey_admission_rejected_total", "Chat requests shed with 503 (estimate over budget, timeout, queue full)",
+    ("kind", "reason")
+)
+
+
+class Overloaded(Exception):
+    def __init__(self, kind: str, reason: str, retry_after: float):
+        super().__init__(f"Overloaded: {kind} {reason}")
+        self.kind = kind
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent: int = 64,
+        reserved_turn_slots: int = 8,
+        turn_budget: float = 2.0,
+        start_budget: float = 0.5,
+        max_queue: int = 500,
+        initial_service_time: float = 1.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.reserved_turn_slots = min(reserved_turn_slots, max(max_concurrent - 1, 0))
+        self.budgets = {TURN: turn_budget, START: start_budget}
+        self.max_queue = max_queue
+        self.active = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {TURN: deque(), START: deque()}
+        # скользящее среднее времени обработки одного запроса, секунды
+        self.service_time = initial_service_time
+        self.admitted = {TURN: 0, START: 0}
+        self.rejected = {TURN: 0, START: 0}
+
+    def queue_depth(self, kind: str) -> int:
+        return sum(1 for waiter in self._queues[kind] if not waiter.done())
+
+    def _limit(self, kind: str) -> int:
+        return self.max_concurrent if kind == TURN else self.max_concurrent - self.reserved_turn_slots
+
+    def estimated_wait(self, kind: str) -> float:
+        """Ожидание места по длине очереди впереди и среднему времени обработки"""
+        ahead = self.queue_depth(TURN) + (self.queue_depth(START) if kind == START else 0)
+        slots = max(self._limit(kind), 1)
+        return (ahead + 1) * self.service_time / slots
+
+    def _retry_after(self, kind: str) -> float:
+        return max(1.0, math.ceil(self.estimated_wait(kind)))
+
+    async def acquire(self, kind: str) -> float:
+        """Занять место; возвращает время начала обработки. Не успевает в бюджет - Overloaded"""
+        started = time.monotonic()
+        if self.active < self._limit(kind) and not self.queue_depth(TURN) and (kind == TURN or not self.queue_depth(START)):
+            self._grant(kind)
+            ADMISSION_QUEUE_WAIT.observe(0.0, kind=kind)
+            return started
+
+        budget = self.budgets[kind]
+        if self.queue_depth(TURN) + self.queue_depth(START) >= self.max_queue:
+            raise self._reject(kind, "queue_full")
+        if self.estimated_wait(kind) > budget:
+            raise self._reject(kind, "over_budget")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[kind].append(waiter)
+        try:
+            await asyncio.wait({waiter}, timeout=budget)
+        except BaseException:
+            # клиент отключился: место, выданное в этот момент, возвращаем
+            if waiter.done() and not waiter.cancelled():
+                self.release(started)
+            else:
+                waiter.cancel()
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            raise self._reject(kind, "timeout")
+        ADMISSION_QUEUE_WAIT.observe(time.monotonic() - started, kind=kind)
+        return time.monotonic()
+
+    def release(self, started: float):
+        elapsed = time.monotonic() - started
+        self.service_time += 0.1 * (elapsed - self.service_time)
+        self.active -= 1
+        self._dispatch()
+
+    def _grant(self, kind: str):
+        self.active += 1
+        self.admitted[kind] += 1
+
+    def _dispatch(self):
+        # место освободилось: сначала ходы начатых опросов, затем новые сессии
+        for kind in (TURN, START):
+            queue = self._queues[kind]
+            while queue and self.active < self._limit(kind):
+                waiter = queue.popleft()
+                if waiter.done():
+                    continue
+                self._grant(kind)
+                waiter.set_result(None)
+
+    def _reject(self, kind: str, reason: str) -> Overloaded:
+        self.rejected[kind] += 1
+        ADMISSION_REJECTED.inc(kind=kind, reason=reason)
+        return Overloaded(kind, reason, self._retry_after(kind))
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "reserved_turn_slots": self.reserved_turn_slots,
+            "service_time": round(self.service_time, 3),
+            "queues": {kind: self.queue_depth(kind) for kind in (TURN, START)},
+            "budgets": self.budgets,
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware: classify(scope) -> TURN, START или None (без ограничений)"""
+
+    def __init__(self, app, controller: AdmissionController, classify: Callable[[dict], Awaitable[Optional[str]]]):
+        self.app = app
+        self.controller = controller
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.controller.max_concurrent <= 0:
+            await self.app(scope, receive, send)
+            return
+        kind = await self.classify(scope)
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            started = await self.controller.acquire(kind)
+        except Overloaded as e:
+            await self._overloaded(send, e)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(started)
+
+    @staticmethod
+    async def _overloaded(send, error: Overloaded):
+        retry_after = int(error.retry_after)
+        body = {"detail": "Server is busy, please retry", "retry_after": retry_after}
+        if error.kind == START:
+            body["waiting_room"] = True
+        payload = json.dumps(body).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode("ascii")),
+                (b"retry-after", str(retry_after).encode("ascii")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,359 @@
+"""Аналитика по сохраненным результатам: распределения, кросс-таблицы, воронка.
+
+Результаты версии опроса хранятся в памяти колонками NumPy. Для каждого
+вопроса это пары (номер респондента, код категории), где код категории -
+целый индекс варианта (сначала варианты опроса по порядку, затем
+неизвестные опросу коды по мере появления). Множественный выбор - несколько
+пар на респондента. Частоты - bincount, кросс-таблица - соединение пар двух
+вопросов по номеру респондента, сегмент - булева маска по респондентам.
+
+Колонки догружаются инкрементально: метка данных - id последнего
+прочитанного результата, при новых результатах из хранилища читаются только
+строки с большим id. Готовые ответы кешируются по (версия, метка, запрос).
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from answer_record import AnswerRecord
+
+
+@dataclass(frozen=True)
+class Segment:
+    """Фильтр респондентов: время результата [since, until) и выбранные варианты.
+
+    where - пары (question_id, коды): респондент выбрал хотя бы один из кодов
+    в каждом из перечисленных вопросов.
+    """
+    since: Optional[str] = None
+    until: Optional[str] = None
+    where: Tuple[Tuple[str, Tuple[str, ...]], ...] = ()
+
+
+def parse_segment(since: Optional[str], until: Optional[str], filters: Optional[Sequence[str]]) -> Segment:
+    """Сегмент из параметров запроса; фильтр - "question_id:code1,code2". При ошибке - ValueError"""
+    where = []
+    for item in filters or ():
+        question_id, sep, codes = item.partition(":")
+        codes = tuple(code.strip() for code in codes.split(",") if code.strip())
+        if not sep or not question_id.strip() or not codes:
+            raise ValueError(f"Invalid filter: {item}")
+        where.append((question_id.strip(), codes))
+    return Segment(since=since or None, until=until or None, where=tuple(sorted(where)))
+
+
+class QuestionColumn:
+    """Ответы на один вопрос: массивы rows (int32) и cats (int16) одной длины"""
+
+    def __init__(self, codes: Sequence[str]):
+        self.categories: List[str] = list(codes)
+        self._index: Dict[str, int] = {code: i for i, code in enumerate(self.categories)}
+        self.rows = np.empty(0, dtype=np.int32)
+        self.cats = np.empty(0, dtype=np.int16)
+
+    def category(self, code: str) -> int:
+        index = self._index.get(code)
+        if index is None:
+            index = self._index[code] = len(self.categories)
+            self.categories.append(code)
+        return index
+
+    def lookup(self, codes: Iterable[str]) -> List[int]:
+        return [self._index[code] for code in codes if code in self._index]
+
+    def extend(self, rows: List[int], cats: List[int]):
+        self.rows = np.concatenate([self.rows, np.asarray(rows, dtype=np.int32)])
+        self.cats = np.concatenate([self.cats, np.asarray(cats, dtype=np.int16)])
+
+
+class ResultFrame:
+    """Колонки результатов одной версии опроса"""
+
+    def __init__(self, survey, completed: bool = True):
+        self.version = survey.version
+        self.completed = completed
+        self.question_ids: List[str] = [str(q.id) for q in survey.questions]
+        self.columns: Dict[str, QuestionColumn] = {
+            str(q.id): QuestionColumn(q.codes) for q in survey.questions
+        }
+        self.timestamps = np.empty(0, dtype=str)
+        self.watermark = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.timestamps)
+
+    def extend(self, rows: Iterable[Tuple[int, str, str, str]]) -> int:
+        """Дописать строки (result_id, timestamp, question_id, answer_codes), упорядоченные по result_id"""
+        timestamps: List[str] = []
+        pending: Dict[str, Tuple[List[int], List[int]]] = {}
+        last_id = None
+        for result_id, timestamp, question_id, answer_codes in rows:
+            if result_id != last_id:
+                last_id = result_id
+                timestamps.append(timestamp)
+            column = self.columns.get(question_id)
+            if column is None or not answer_codes:
+                continue
+            row = self.size + len(timestamps) - 1
+            column_rows, column_cats = pending.setdefault(question_id, ([], []))
+            for code in answer_codes.split(","):
+                column_rows.append(row)
+                column_cats.append(column.category(code))
+        for question_id, (column_rows, column_cats) in pending.items():
+            self.columns[question_id].extend(column_rows, column_cats)
+        if timestamps:
+            self.timestamps = np.concatenate([self.timestamps, np.asarray(timestamps, dtype=str)])
+            self.watermark = max(self.watermark, last_id)
+        return len(timestamps)
+
+    @classmethod
+    def from_answers(cls, survey, answer_lists: Iterable[Tuple[str, List[AnswerRecord]]], completed: bool = False):
+        """Кадр из ответов сессий: пары (timestamp, answers) в формате Session.answers"""
+        frame = cls(survey, completed=completed)
+        frame.extend(
+            (row, timestamp, str(answer.question_id), ",".join(answer.codes))
+            for row, (timestamp, answers) in enumerate(answer_lists, start=1)
+            for answer in answers
+        )
+        frame.watermark = 0
+        return frame
+
+    def mask(self, segment: Segment) -> np.ndarray:
+        """Булева маска респондентов сегмента"""
+        mask = np.ones(self.size, dtype=bool)
+        if segment.since:
+            mask &= self.timestamps >= segment.since
+        if segment.until:
+            mask &= self.timestamps < segment.until
+        for question_id, codes in segment.where:
+            column = self.columns.get(question_id)
+            selected = np.zeros(self.size, dtype=bool)
+            if column is not None:
+                selected[column.rows[np.isin(column.cats, column.lookup(codes))]] = True
+            mask &= selected
+        return mask
+
+    def frequencies(self, question_id: str, mask: np.ndarray) -> Tuple[np.ndarray, int]:
+        """(число выборов по категориям, число ответивших респондентов)"""
+        column = self.columns[question_id]
+        keep = mask[column.rows]
+        counts = np.bincount(column.cats[keep], minlength=len(column.categories))
+        return counts, int(np.count_nonzero(np.bincount(column.rows[keep], minlength=self.size)))
+
+    def crosstab(self, row_question: str, column_question: str, mask: np.ndarray) -> Tuple[np.ndarray, int]:
+        """(таблица выборов категорий row x column, число ответивших на оба вопроса)"""
+        a, b = self.columns[row_question], self.columns[column_question]
+        keep = mask[b.rows]
+        b_rows, b_cats = b.rows[keep], b.cats[keep]
+
+        # пары a идут по возрастанию номера респондента: для каждой пары b
+        # берем все пары a того же респондента (ragged repeat без цикла)
+        a_counts = np.bincount(a.rows, minlength=self.size)
+        a_starts = np.cumsum(a_counts) - a_counts
+        repeat = a_counts[b_rows]
+        b_index = np.repeat(np.arange(len(b_rows)), repeat)
+        offsets = np.arange(len(b_index)) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+        a_cats = a.cats[a_starts[b_rows[b_index]] + offsets]
+
+        width = len(b.categories)
+        table = np.bincount(
+            a_cats.astype(np.int64) * width + b_cats[b_index], minlength=len(a.categories) * width
+        ).reshape(len(a.categories), width)
+        both = (a_counts > 0) & (np.bincount(b_rows, minlength=self.size) > 0)
+        return table, int(np.count_nonzero(both))
+
+    def funnel_counts(self, mask: np.ndarray) -> Dict[str, Any]:
+        """Ответившие на каждый вопрос и остановившиеся после него (для незавершенных)"""
+        answered = []
+        last = np.full(self.size, -1, dtype=np.int32)
+        for index, question_id in enumerate(self.question_ids):
+            rows = self.columns[question_id].rows
+            seen = np.zeros(self.size, dtype=bool)
+            seen[rows] = True
+            seen &= mask
+            answered.append(int(np.count_nonzero(seen)))
+            last[seen] = index
+        started = mask & (last >= 0)
+        if self.completed:
+            dropped = np.zeros(len(self.question_ids), dtype=np.int64)
+        else:
+            dropped = np.bincount(last[started], minlength=len(self.question_ids))
+        return {
+            "started": int(np.count_nonzero(started)),
+            "completed": int(np.count_nonzero(started)) if self.completed else 0,
+            "answered": np.asarray(answered, dtype=np.int64),
+            "dropped": dropped,
+        }
+
+
+class AnalyticsEngine:
+    """Кадры результатов по версиям и кеш готовых ответов"""
+
+    def __init__(self, store, cache_size: int = 256):
+        self.store = store
+        self.cache_size = cache_size
+        # кадры меняются при догрузке, поэтому и вычисления идут под блокировкой
+        self._lock = threading.RLock()
+        self._frames: Dict[str, ResultFrame] = {}
+        self._cache: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def refresh(self, survey) -> ResultFrame:
+        """Кадр версии с догрузкой результатов, сохраненных после метки"""
+        with self._lock:
+            frame = self._frames.get(survey.version)
+            if frame is None:
+                frame = self._frames[survey.version] = ResultFrame(survey)
+            latest = self.store.max_result_id()
+            if latest > frame.watermark:
+                frame.extend(self.store.iter_answer_codes(survey.version, after_id=frame.watermark, up_to_id=latest))
+                # результатов версии могло не быть: метка все равно двигается
+                frame.watermark = latest
+            return frame
+
+    def _cached(self, frame: ResultFrame, key: Tuple, compute) -> Dict[str, Any]:
+        key = (frame.version, frame.watermark) + key
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+            result = compute()
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def distribution(self, survey, segment: Segment = Segment(), question_id: Optional[str] = None) -> Dict[str, Any]:
+        """Частоты вариантов по вопросам версии"""
+        frame = self.refresh(survey)
+        questions = [_question(survey, question_id)] if question_id is not None else survey.questions
+
+        def compute():
+            mask = frame.mask(segment)
+            result = []
+            for question in questions:
+                counts, respondents = frame.frequencies(str(question.id), mask)
+                result.append({
+                    "question_id": question.id,
+                    "question": question.question,
+                    "respondents": respondents,
+                    "total": int(counts.sum()),
+                    "options": _options(question, frame.columns[str(question.id)], counts, respondents),
+                })
+            return {
+                "survey_version": frame.version,
+                "watermark": frame.watermark,
+                "respondents": int(np.count_nonzero(mask)),
+                "questions": result,
+            }
+
+        return self._cached(frame, ("distribution", segment, question_id), compute)
+
+    def crosstab(self, survey, row_question: str, column_question: str, segment: Segment = Segment()) -> Dict[str, Any]:
+        """Кросс-таблица выборов двух вопросов"""
+        frame = self.refresh(survey)
+        row_q, column_q = _question(survey, row_question), _question(survey, column_question)
+
+        def compute():
+            mask = frame.mask(segment)
+            table, respondents = frame.crosstab(str(row_q.id), str(column_q.id), mask)
+            row_column, column_column = frame.columns[str(row_q.id)], frame.columns[str(column_q.id)]
+            return {
+                "survey_version": frame.version,
+                "watermark": frame.watermark,
+                "respondents": respondents,
+                "row_question": {"question_id": row_q.id, "question": row_q.question},
+                "column_question": {"question_id": column_q.id, "question": column_q.question},
+                "columns": [
+                    {"code": code, "text": _option_text(column_q, code), "total": int(total)}
+                    for code, total in zip(column_column.categories, table.sum(axis=0))
+                ],
+                "rows": [
+                    {
+                        "code": code,
+                        "text": _option_text(row_q, code),
+                        "total": int(counts.sum()),
+                        "counts": counts.tolist(),
+                    }
+                    for code, counts in zip(row_column.categories, table)
+                ],
+            }
+
+        return self._cached(frame, ("crosstab", segment, row_question, column_question), compute)
+
+    def funnel(self, survey, segment: Segment = Segment(), in_progress: Optional[ResultFrame] = None) -> Dict[str, Any]:
+        """Воронка по вопросам: сохраненные результаты (из кеша) плюс незавершенные сессии"""
+        frame = self.refresh(survey)
+
+        def compute():
+            counts = frame.funnel_counts(frame.mask(segment))
+            counts["watermark"] = frame.watermark
+            return counts
+
+        counts = dict(self._cached(frame, ("funnel", segment), compute))
+        if in_progress is not None and in_progress.size:
+            extra = in_progress.funnel_counts(in_progress.mask(segment))
+            for name in ("started", "completed", "answered", "dropped"):
+                counts[name] = counts[name] + extra[name]
+
+        started = counts["started"]
+        questions = []
+        for question, answered, dropped in zip(survey.questions, counts["answered"], counts["dropped"]):
+            questions.append({
+                "question_id": question.id,
+                "question": question.question,
+                "answered": int(answered),
+                "dropped": int(dropped),
+                "answer_rate": _share(answered, started),
+            })
+        return {
+            "survey_version": frame.version,
+            "watermark": counts["watermark"],
+            "started": started,
+            "completed": counts["completed"],
+            "completion_rate": _share(counts["completed"], started),
+            "questions": questions,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "frames": {
+                    version: {"respondents": frame.size, "watermark": frame.watermark}
+                    for version, frame in self._frames.items()
+                },
+                "cache_entries": len(self._cache),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def _question(survey, question_id: str):
+    for question in survey.questions:
+        if str(question.id) == question_id:
+            return question
+    raise KeyError(question_id)
+
+
+def _option_text(question, code: str) -> str:
+    option = question.options_by_code.get(code)
+    return option.text if option else code
+
+
+def _options(question, column: QuestionColumn, counts: np.ndarray, respondents: int) -> List[Dict[str, Any]]:
+    return [
+        {"code": code, "text": _option_text(question, code), "count": int(count), "share": _share(count, respondents)}
+        for code, count in zip(column.categories, counts)
+    ]
+
+
+def _share(part, whole) -> float:
+    return round(float(part) / whole, 4) if whole else 0.0
@@ -0,0 +1,306 @@
+"""Разбор ответов с номерами вариантов по правилам, без LLM.
+
+Ответ разбивается на токены одним заранее скомпилированным регулярным
+выражением, каждый токен классифицируется поиском в словаре (порядковые
+числительные во всех формах, служебные слова грамматики). Для каждого
+вопроса один раз строится свой словарь: однословные варианты ("Python",
+"Go"), варианты-диапазоны чисел ("18-24", "Меньше 18", "45 и старше") и
+вариант "ничего/нет".
+
+Грамматика: номера и порядковые ("2", "второе", "последний"), диапазоны
+("1-3", "с 1 по 3"), "все", исключения ("все кроме второго", "кроме 1 и 2"),
+"ни одного". Число с единицей ("2 года", "27 лет") - количество, а не номер:
+оно сопоставляется только с вариантами-диапазонами.
+
+Уверенность - доля слов ответа, объясненных грамматикой; ответы с
+посторонними словами, противоречиями или неоднозначностью остаются
+следующим уровням (локальное сопоставление, LLM).
+"""
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from local_matcher import stem, tokenize
+from survey_registry import CompiledQuestion
+
+
+_TOKEN_RE = re.compile(r"(?P<num>\d+)|(?P<word>[^\W\d_]+[#+]*)|(?P<dash>[-–—])|(?P<sep>[,;/&+])")
+
+_ORDINAL_STEMS = ("перв", "втор", "трет", "четверт", "пят", "шест", "седьм", "восьм", "девят", "десят")
+_ORDINAL_ENDINGS = (
+    "ое", "ый", "ая", "ой", "ого", "ую", "ом", "ые", "ых", "ому", "ыми",
+    "ье", "ий", "ья", "ьего", "ью", "ьей", "ьим", "ьи", "ьих",
+)
+
+_CARDINALS = {"два": 2, "две": 2, "три": 3, "четыре": 4, "пять": 5, "шесть": 6, "семь": 7, "восемь": 8, "девять": 9, "десять": 10}
+
+ORD, CARD, ALL, NONE, NI, EXCEPT, NEG, RANGE, AND, FILLER = (
+    "ord", "card", "all", "none", "ni", "except", "neg", "range", "and", "filler"
+)
+
+
+def _build_lexicon() -> Dict[str, Tuple[str, int]]:
+    lexicon: Dict[str, Tuple[str, int]] = {}
+    for number, word_stem in enumerate(_ORDINAL_STEMS, start=1):
+        for ending in _ORDINAL_ENDINGS:
+            lexicon[word_stem + ending] = (ORD, number)
+    for word, number in _CARDINALS.items():
+        lexicon[word] = (CARD, number)
+    for ending in ("ее", "ий", "яя", "юю", "его", "ие", "их", "ей"):
+        lexicon["последн" + ending] = (ORD, -1)
+        lexicon["предпоследн" + ending] = (ORD, -2)
+    groups = {
+        ALL: "все всех оба обе обоих любые",
+        NONE: "ничего никакой никакие никакого никаких никакая никакое",
+        NI: "ни",
+        EXCEPT: "кроме исключением без",
+        NEG: "не",
+        RANGE: "до по",
+        AND: "и или а также плюс еще",
+        FILLER: (
+            "я мне меня мой моя мое мои это мой выбираю выберу выбрал выбрала выбираем выбор "
+            "вариант варианта варианты вариантов варианте пункт пункта пункты номер номера ответ "
+            "наверное наверно пожалуй думаю скорее всего точно наверняка от с за один одного одна одной одно "
+            "то другое другой"
+        ),
+    }
+    for kind, words in groups.items():
+        for word in words.split():
+            lexicon.setdefault(word, (kind, 0))
+    return lexicon
+
+
+LEXICON = _build_lexicon()
+
+_INTERVAL_PATTERNS = (
+    (re.compile(r"^\s*(\d+)\s*[-–—]\s*(\d+)"), lambda a, b: (int(a), int(b))),
+    (re.compile(r"(?:меньше|менее|младше|до)\s+(\d+)"), lambda a: (float("-inf"), int(a) - 1)),
+    (re.compile(r"(\d+)\s*(?:\+|и\s+(?:старше|более|больше))"), lambda a: (int(a), float("inf"))),
+    (re.compile(r"(?:более|больше|старше|свыше)\s+(\d+)"), lambda a: (int(a) + 1, float("inf"))),
+)
+# одинаковые единицы с разными основами ("2 года", "25 лет")
+_UNIT_SYNONYMS = {"лет": "год", "годик": "год"}
+_NONE_OPTION_RE = re.compile(r"^\s*(?:ничего|нет|никак|ни\s+одного|никакие|не\s+изучаю|не\s+знаю)\b")
+
+
+@dataclass(frozen=True)
+class ParseResult:
+    codes: List[str]
+    confidence: float
+
+
+@dataclass
+class _Symbol:
+    kind: str
+    value: int = 0
+    # основа единицы измерения ("2 года"): число - количество, а не номер
+    unit: Optional[str] = None
+    # вариант назван словом ("python"), а не номером
+    by_word: bool = False
+
+    @property
+    def quantity(self) -> bool:
+        return self.unit is not None
+
+
+class QuestionParser:
+    """Словарь вопроса: варианты-слова, диапазоны чисел, вариант "ничего" """
+
+    def __init__(self, question: CompiledQuestion):
+        self.question = question
+        self.codes: Tuple[str, ...] = question.codes
+        self.multiple = question.type == "multiple_choice"
+        self.words: Dict[str, int] = {}
+        intervals: List[Tuple[float, float, int]] = []
+        self.none_options: Tuple[int, ...] = ()
+        none_options = []
+        for index, option in enumerate(question.options):
+            text = option.text.lower().replace("ё", "е")
+            tokens = tokenize(text)
+            if len(tokens) == 1 and tokens[0] not in LEXICON:
+                self.words.setdefault(stem(tokens[0]), index)
+            if _NONE_OPTION_RE.search(text):
+                none_options.append(index)
+            for pattern, build in _INTERVAL_PATTERNS:
+                match = pattern.search(text)
+                if match:
+                    low, high = build(*match.groups())
+                    intervals.append((low, high, index))
+                    break
+        self.none_options = tuple(none_options)
+        # единицы, которые встречаются в тексте вопроса и вариантов ("лет", "часов")
+        self.units = frozenset(
+            _unit(token) for token in tokenize(" ".join([question.question, *question.texts_for(list(self.codes))]).lower())
+        )
+        # диапазоны учитываются, только если так устроены несколько вариантов вопроса
+        self.intervals = tuple(intervals) if len(intervals) >= 2 else ()
+
+    def parse(self, answer: str) -> Optional[ParseResult]:
+        symbols, explained, total = self._symbols(answer.lower().replace("ё", "е"))
+        if not symbols or not total:
+            return None
+        indexes, quantity = self._resolve(symbols)
+        if not indexes or (quantity and explained < total):
+            # количество с посторонними словами ("2 часа в день") не угадываем
+            return None
+        return ParseResult(codes=[self.codes[i] for i in indexes], confidence=round(explained / total, 3))
+
+    def _symbols(self, text: str) -> Tuple[List[_Symbol], int, int]:
+        tokens = [(m.lastgroup, m.group()) for m in _TOKEN_RE.finditer(text)]
+        symbols: List[_Symbol] = []
+        explained = total = 0
+        i = 0
+        while i < len(tokens):
+            kind, value = tokens[i]
+            i += 1
+            entry = LEXICON.get(value) if kind == "word" else None
+            if kind == "num" or (entry is not None and entry[0] == CARD):
+                total += 1
+                explained += 1
+                symbol = _Symbol("ref", int(value) if kind == "num" else entry[1])
+                # слово после числа, не относящееся к грамматике, - единица ("2 года")
+                if i < len(tokens) and tokens[i][0] == "word":
+                    word = tokens[i][1]
+                    if word not in LEXICON and stem(word) not in self.words:
+                        symbol.unit = _unit(word)
+                        total += 1
+                        explained += 1
+                        i += 1
+                symbols.append(symbol)
+            elif kind == "word":
+                total += 1
+                if entry is not None:
+                    explained += 1
+                    if entry[0] == ORD:
+                        symbols.append(_Symbol("ref", entry[1] if entry[1] > 0 else len(self.codes) + 1 + entry[1]))
+                    elif entry[0] != FILLER:
+                        symbols.append(_Symbol(entry[0]))
+                elif stem(value) in self.words:
+                    explained += 1
+                    symbols.append(_Symbol("ref", self.words[stem(value)] + 1, by_word=True))
+            elif kind == "dash":
+                symbols.append(_Symbol(RANGE))
+            else:
+                symbols.append(_Symbol(AND))
+        return symbols, explained, total
+
+    def _resolve(self, symbols: List[_Symbol]) -> Tuple[Optional[List[int]], bool]:
+        """(номера вариантов или None, ответ - количество)"""
+        count = len(self.codes)
+        quantities = [s.value for s in symbols if s.kind == "ref" and (s.quantity or s.value > count)]
+        if quantities:
+            # количество не смешивается с номерами вариантов
+            if len(quantities) != 1 or sum(1 for s in symbols if s.kind == "ref") != 1:
+                return None, True
+            unit = next(s.unit for s in symbols if s.kind == "ref")
+            if unit is not None and unit not in self.units:
+                # "2 часа" в ответ на вопрос о возрасте - не про этот вопрос
+                return None, True
+            return self._interval(quantities[0]), True
+        refs = [s for s in symbols if s.kind == "ref"]
+        if any(s.by_word for s in refs) and not all(s.by_word for s in refs):
+            # "python 2" - скорее версия, чем два варианта
+            return None, False
+        return self._select(symbols, count), False
+
+    def _select(self, symbols: List[_Symbol], count: int) -> Optional[List[int]]:
+        selected: List[int] = []
+        excluded: List[int] = []
+        select_all = select_none = excepting = False
+        negate = False
+        i = 0
+        while i < len(symbols):
+            symbol = symbols[i]
+            if symbol.kind == "ref":
+                indexes = [symbol.value - 1]
+                # диапазон: "1-3", "с 1 по 3", "от 2 до 4"
+                if i + 2 < len(symbols) and symbols[i + 1].kind == RANGE and symbols[i + 2].kind == "ref":
+                    end = symbols[i + 2].value
+                    if end < symbol.value:
+                        return None
+                    indexes = list(range(symbol.value - 1, end))
+                    i += 2
+                if min(indexes) < 0 or max(indexes) >= count:
+                    return None
+                (excluded if excepting or negate else selected).extend(indexes)
+                negate = False
+            elif symbol.kind == ALL:
+                select_all = True
+            elif symbol.kind == NONE:
+                select_none = True
+            elif symbol.kind == NI:
+                # "ни одного", "ни то ни другое"; "ни второе" - отрицание номера
+                if i + 1 < len(symbols) and symbols[i + 1].kind == "ref":
+                    negate = True
+                else:
+                    select_none = True
+            elif symbol.kind == EXCEPT:
+                excepting = True
+            elif symbol.kind == NEG:
+                negate = True
+            elif symbol.kind == RANGE:
+                # "до"/"по" без диапазона - посторонний предлог
+                pass
+            i += 1
+
+        if negate:
+            # отрицание без номера ("не уверен") - решает LLM
+            return None
+        if select_none:
+            if selected or select_all or excluded or len(self.none_options) != 1:
+                return None
+            return list(self.none_options)
+        if excluded and not (excepting or select_all):
+            # "не первое" без "кроме"/"все" неоднозначно
+            return None
+
+        if select_all or (excepting and not selected):
+            base = [i for i in range(count) if i not in self.none_options]
+        else:
+            base = selected
+        result = sorted(set(base) - set(excluded))
+        if not result:
+            return None
+        if not self.multiple and len(result) != 1:
+            return None
+        return result
+
+    def _interval(self, value: int) -> Optional[List[int]]:
+        matches = [index for low, high, index in self.intervals if low <= value <= high]
+        # на границе ("5" при "0-5" и "5-10") решение неоднозначно
+        return matches if len(matches) == 1 else None
+
+
+def _unit(word: str) -> str:
+    word_stem = stem(word)
+    return _UNIT_SYNONYMS.get(word_stem, word_stem)
+
+
+class AnswerParser:
+    """Скомпилированные разборщики по (версия опроса, номер вопроса)"""
+
+    def __init__(self, min_confidence: float = 0.5):
+        self.min_confidence = min_confidence
+        self._parsers: Dict[Tuple[str, int], QuestionParser] = {}
+        self._lock = threading.Lock()
+
+    def parser_for(self, question: CompiledQuestion, survey_version: str) -> QuestionParser:
+        key = (survey_version, question.index)
+        parser = self._parsers.get(key)
+        if parser is None:
+            with self._lock:
+                parser = self._parsers.setdefault(key, QuestionParser(question))
+        return parser
+
+    def warm(self, survey):
+        for question in survey.questions:
+            self.parser_for(question, survey.version)
+
+    def parse(self, answer: str, question: CompiledQuestion, survey_version: str) -> Optional[ParseResult]:
+        """Уверенный разбор или None"""
+        result = self.parser_for(question, survey_version).parse(answer)
+        if result is None or result.confidence < self.min_confidence:
+            return None
+        return result
+
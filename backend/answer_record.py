@@ -0,0 +1,128 @@
+"""Компактная запись ответа респондента.
+
+В сессии и в сохраненном результате ответ - это id вопроса, коды выбранных
+вариантов и исходный текст респондента. Тексты вопроса и вариантов в запись
+не копируются: они есть в версии опроса, на которую ссылается сессия или
+результат, и подставляются только при выдаче в админку и экспорте
+(expand_answers). Коды интернируются, а одинаковые наборы кодов - один и тот
+же кортеж, поэтому у тысяч респондентов они не занимают память заново.
+
+Упакованная форма (pack) - [question_id, [codes], original_answer]; список
+ответов результата пишется в msgpack, если он установлен, иначе компактным
+JSON. unpack понимает и прежние полные dict-записи: их тексты сохраняются
+(stored_texts) и при выдаче важнее текстов опроса - у перенесенных старых
+результатов версии может не быть, и текущий опрос их не описывает.
+"""
+import json
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# общие кортежи кодов; число разных наборов ограничено вариантами опросов
+_CODE_TUPLES: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+MAX_SHARED_CODE_TUPLES = 65536
+
+
+def intern_codes(codes: Iterable[Any]) -> Tuple[str, ...]:
+    key = tuple(sys.intern(str(code)) for code in codes)
+    shared = _CODE_TUPLES.get(key)
+    if shared is not None:
+        return shared
+    if len(_CODE_TUPLES) < MAX_SHARED_CODE_TUPLES:
+        _CODE_TUPLES[key] = key
+    return key
+
+
+class AnswerRecord:
+    """Ответ на один вопрос без текстов опроса"""
+
+    __slots__ = ("question_id", "codes", "original_answer", "stored_texts")
+
+    def __init__(
+        self,
+        question_id: Any,
+        codes: Iterable[Any],
+        original_answer: Optional[str],
+        stored_texts: Optional[Tuple[Optional[str], List[str]]] = None,
+    ):
+        self.question_id = sys.intern(question_id) if isinstance(question_id, str) else question_id
+        self.codes = intern_codes(codes)
+        self.original_answer = original_answer
+        # (question, answer_texts) из прежней полной записи; у новых записей None
+        self.stored_texts = stored_texts
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, AnswerRecord):
+            return NotImplemented
+        return self.pack() == other.pack()
+
+    def __repr__(self) -> str:
+        return f"AnswerRecord({self.question_id!r}, {self.codes!r}, {self.original_answer!r}, {self.stored_texts!r})"
+
+    def pack(self) -> List[Any]:
+        packed = [self.question_id, list(self.codes), self.original_answer]
+        if self.stored_texts is not None:
+            packed.extend([self.stored_texts[0], list(self.stored_texts[1])])
+        return packed
+
+    @classmethod
+    def unpack(cls, data: Union["AnswerRecord", List[Any], Dict[str, Any]]) -> "AnswerRecord":
+        """Упакованная форма, прежняя полная dict-запись или уже готовая запись"""
+        if isinstance(data, AnswerRecord):
+            return data
+        if isinstance(data, dict):
+            return cls(
+                data["question_id"],
+                data.get("answer_codes") or [],
+                data.get("original_answer"),
+                (data.get("question"), list(data.get("answer_texts") or [])),
+            )
+        if len(data) == 5:
+            question_id, codes, original_answer, question, answer_texts = data
+            return cls(question_id, codes, original_answer, (question, answer_texts))
+        question_id, codes, original_answer = data
+        return cls(question_id, codes, original_answer)
+
+    def expand(self, survey) -> Dict[str, Any]:
+        """Полная запись: сохраненные тексты, иначе тексты из версии опроса (None - версия неизвестна)"""
+        if self.stored_texts is not None:
+            question_text, answer_texts = self.stored_texts[0], list(self.stored_texts[1])
+        else:
+            question = survey.question_for(self.question_id) if survey is not None else None
+            question_text = question.question if question else None
+            answer_texts = question.texts_for(self.codes) if question else []
+        return {
+            "question_id": self.question_id,
+            "question": question_text,
+            "answer_codes": list(self.codes),
+            "answer_texts": answer_texts,
+            "original_answer": self.original_answer,
+        }
+
+
+def expand_answers(answers: Iterable[AnswerRecord], survey) -> List[Dict[str, Any]]:
+    return [answer.expand(survey) for answer in answers]
+
+
+def dump_answers(answers: Iterable[AnswerRecord]) -> Union[bytes, str]:
+    """Список ответов результата для хранения: msgpack (bytes) или компактный JSON (str)"""
+    packed = [AnswerRecord.unpack(answer).pack() for answer in answers]
+    if msgpack is not None:
+        return msgpack.packb(packed, use_bin_type=True)
+    return json.dumps(packed, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_answers(raw: Union[bytes, str]) -> List[AnswerRecord]:
+    """Обратное к dump_answers; понимает и прежние JSON документы с полными записями"""
+    if isinstance(raw, bytes):
+        if msgpack is None:
+            raise RuntimeError("Stored results are msgpack-encoded: pip install msgpack")
+        data = msgpack.unpackb(raw, raw=False)
+    else:
+        data = json.loads(raw)
+    return [AnswerRecord.unpack(item) for item in data]
@@ -0,0 +1,145 @@
+"""Полнотекстовый поиск по исходным ответам респондентов (original_answer).
+
+Текст нормализуется так же, как в локальном сопоставлении: нижний регистр,
+ё -> е и основы слов упрощенного русского стеммера. Сохраненные результаты
+индексирует ResultsStore (таблица FTS5 answers_fts в той же базе, запись в
+транзакции результата). Ответы незавершенных сессий лежат в LiveAnswerIndex
+в памяти и убираются оттуда, когда результат записан в базу.
+
+Запрос: слова через пробел (все должны встретиться), "фраза в кавычках",
+префикс - слово со звездочкой в конце (кош*).
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from answer_record import AnswerRecord
+from local_matcher import stem, tokenize
+
+
+# термин запроса: основы слов подряд и признак префикса у последней
+Term = Tuple[Tuple[str, ...], bool]
+
+_QUERY_RE = re.compile(r'"([^"]*)"(\*?)|(\S+)')
+
+
+def index_text(text: Optional[str]) -> str:
+    """Текст для индекса: основы слов через пробел"""
+    return " ".join(stem(token) for token in tokenize(text or ""))
+
+
+def parse_query(query: str) -> List[Term]:
+    """Разбор запроса на термины; пустой запрос - ValueError"""
+    terms = []
+    for match in _QUERY_RE.finditer(query):
+        phrase, phrase_prefix, word = match.groups()
+        text, prefix = (phrase, bool(phrase_prefix)) if word is None else (word.rstrip("*"), word.endswith("*"))
+        stems = tuple(stem(token) for token in tokenize(text))
+        if stems:
+            terms.append((stems, prefix))
+    if not terms:
+        raise ValueError("Empty search query")
+    return terms
+
+
+def fts_query(terms: List[Term]) -> str:
+    """Выражение MATCH для FTS5: каждый термин - строка в кавычках, без операторов пользователя"""
+    return " ".join(f'"{" ".join(stems)}"' + ("*" if prefix else "") for stems, prefix in terms)
+
+
+def match_score(tokens: List[str], terms: List[Term]) -> int:
+    """Число вхождений терминов в тексте; 0, если хотя бы один термин не найден"""
+    score = 0
+    for stems, prefix in terms:
+        width = len(stems)
+        found = 0
+        for start in range(len(tokens) - width + 1):
+            window = tokens[start:start + width]
+            if window[:-1] != list(stems[:-1]):
+                continue
+            last = window[-1]
+            if last == stems[-1] or (prefix and last.startswith(stems[-1])):
+                found += 1
+        if not found:
+            return 0
+        score += found
+    return score
+
+
+class LiveAnswerIndex:
+    """Ответы незавершенных сессий в памяти.
+
+    Их число ограничено TTL сессий, поэтому поиск - проход по всем ответам
+    с уже разобранными основами. Сессии без новых ответов дольше ttl_seconds
+    (истекшие в хранилище сессий) вытесняются при добавлении.
+    """
+
+    def __init__(self, ttl_seconds: float = 72 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # session_id -> (время последнего ответа, [(position, timestamp, survey_version, answer, tokens)])
+        self._sessions: "OrderedDict[str, Tuple[float, List[Tuple[int, str, Optional[str], AnswerRecord, List[str]]]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(entries) for _, entries in self._sessions.values())
+
+    def add(self, session_id: str, position: int, timestamp: str, survey_version: Optional[str], answer: AnswerRecord):
+        tokens = index_text(answer.original_answer).split()
+        now = time.time()
+        with self._lock:
+            _, entries = self._sessions.pop(session_id, (now, []))
+            entries.append((position, timestamp, survey_version, answer, tokens))
+            self._sessions[session_id] = (now, entries)
+            while self._sessions:
+                oldest_id, (touched, _) = next(iter(self._sessions.items()))
+                if now - touched <= self.ttl_seconds:
+                    break
+                del self._sessions[oldest_id]
+
+    def discard(self, session_ids):
+        """Убрать сессии, результаты которых уже в базе"""
+        with self._lock:
+            for session_id in session_ids:
+                self._sessions.pop(session_id, None)
+
+    def search(
+        self,
+        terms: List[Term],
+        limit: int = 50,
+        question_id: Optional[str] = None,
+        answer_code: Optional[str] = None,
+        survey_version: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        with self._lock:
+            sessions = [(session_id, list(entries)) for session_id, (_, entries) in self._sessions.items()]
+        hits = []
+        for session_id, entries in sessions:
+            for position, timestamp, version, answer, tokens in entries:
+                if question_id is not None and str(answer.question_id) != question_id:
+                    continue
+                if answer_code is not None and answer_code not in answer.codes:
+                    continue
+                if survey_version and version != survey_version:
+                    continue
+                score = match_score(tokens, terms)
+                if score:
+                    hits.append((score, timestamp, session_id, position, version, answer))
+        hits.sort(key=lambda hit: (-hit[0], hit[1], hit[2], hit[3]))
+        return [
+            {
+                "session_id": session_id,
+                "timestamp": timestamp,
+                "position": position,
+                "question_id": answer.question_id,
+                "question": answer.stored_texts[0] if answer.stored_texts else None,
+                "answer_codes": list(answer.codes),
+                "original_answer": answer.original_answer,
+                "survey_version": version,
+                "score": float(score),
+                "status": "in_progress",
+            }
+            for score, timestamp, session_id, position, version, answer in hits[:limit]
+        ]
@@ -0,0 +1,8 @@
+"""Бенчмарки и нагрузочное тестирование.
+
+Запуск из каталога backend:
+    python -m benchmarks.fake_openai          - локальный OpenAI-совместимый сервер
+    python -m benchmarks.micro                - микробенчмарки
+    python -m benchmarks.load                 - нагрузка на /chat/start и /chat/message
+    python -m benchmarks.compare old new      - сравнение двух отчетов
+"""
@@ -0,0 +1,59 @@
+"""Сравнение двух отчетов бенчмарков одного вида.
+
+Сравниваются все p50/p95/p99 (рост - регрессия) и *_per_sec (падение -
+регрессия). Код возврата 1, если хоть одна метрика хуже порога.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.10
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Iterator, Tuple
+
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def flatten(metrics: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and (key in LATENCY_KEYS or key.endswith("_per_sec")):
+            yield name, float(value)
+
+
+def compare(baseline: Dict[str, Any], candidate: Dict[str, Any], threshold: float):
+    old = dict(flatten(baseline["metrics"]))
+    new = dict(flatten(candidate["metrics"]))
+    rows, regressions = [], 0
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name], new[name]
+        change = (after - before) / before if before else 0.0
+        higher_is_better = name.endswith("_per_sec")
+        regressed = (-change if higher_is_better else change) > threshold
+        regressions += regressed
+        rows.append((name, before, after, change, regressed))
+    return rows, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение отчетов бенчмарков")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+    if baseline.get("kind") != candidate.get("kind"):
+        sys.exit(f"Reports are of different kinds: {baseline.get('kind')} vs {candidate.get('kind')}")
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    for name, before, after, change, regressed in rows:
+        mark = "REGRESSION" if regressed else ""
+        print(f"{name:60} {before:12.3f} {after:12.3f} {change:+8.1%} {mark}")
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,162 @@
+"""Локальный OpenAI-совместимый сервер для бенчмарков без сети.
+
+Отвечает на POST /v1/chat/completions (обычный и stream=True) с настраиваемой
+задержкой, разбросом и долей ошибок. Ответ правдоподобен для промптов
+бэкенда: для сопоставления - JSON по схеме с кодом варианта, чей текст
+встречается в ответе пользователя (иначе первый), для пакетной
+классификации - JSON results, для остального - короткая благодарность.
+
+    python -m benchmarks.fake_openai --port 8001 --latency-ms 300 --jitter-ms 100 --error-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake uvicorn main:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+OPTION_LINE = re.compile(r"^\d+\) (\S+): (.+)$", re.M)
+BATCH_LINE = re.compile(r"^(\d+)\. (\".*\")$", re.M)
+
+ACKNOWLEDGEMENT = "Спасибо, ваш ответ очень ценен для исследования."
+
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = 300.0
+    jitter_ms: float = 100.0
+    error_rate: float = 0.0
+    # пауза между фрагментами в режиме stream
+    token_interval_ms: float = 20.0
+    seed: int = 0
+
+
+def pick_code(answer: str, options: List[Tuple[str, str]]) -> str:
+    lowered = answer.lower()
+    for code, text in options:
+        if text.lower() in lowered or lowered in text.lower():
+            return code
+    return options[0][0]
+
+
+def completion_text(messages: List[Dict[str, Any]], response_format: Dict[str, Any]) -> str:
+    prompt = "\n".join(str(m.get("content", "")) for m in messages)
+    options = OPTION_LINE.findall(prompt)
+    if not options:
+        return ACKNOWLEDGEMENT
+    if response_format.get("type") == "json_object":
+        results = [
+            {"n": int(n), "codes": [pick_code(json.loads(answer), options)]}
+            for n, answer in BATCH_LINE.findall(prompt)
+        ]
+        return json.dumps({"results": results}, ensure_ascii=False)
+    # сопоставление: ответ пользователя - последнее сообщение
+    code = pick_code(str(messages[-1].get("content", "")), options)
+    properties = response_format.get("json_schema", {}).get("schema", {}).get("properties", {})
+    if "codes" in properties:
+        return json.dumps({"codes": [code]})
+    return json.dumps({"code": code})
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+    rng = random.Random(config.seed)
+    app.state.requests = 0
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        delay = max(0.0, config.latency_ms + rng.uniform(-config.jitter_ms, config.jitter_ms))
+        await asyncio.sleep(delay / 1000)
+
+        if rng.random() < config.error_rate:
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "injected failure", "type": "server_error"}},
+            )
+
+        text = completion_text(body.get("messages", []), body.get("response_format") or {})
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = body.get("model", "fake")
+
+        if body.get("stream"):
+            return StreamingResponse(
+                stream_chunks(text, completion_id, created, model, config.token_interval_ms),
+                media_type="text/event-stream",
+            )
+
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        completion_tokens = max(1, len(text) // 4)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+async def stream_chunks(text: str, completion_id: str, created: int, model: str, interval_ms: float):
+    def chunk(delta: Dict[str, Any], finish_reason=None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    # фрагменты примерно по слову, как токены модели
+    for piece in re.findall(r"\S+\s*", text):
+        await asyncio.sleep(interval_ms / 1000)
+        yield chunk({"content": piece})
+    yield chunk({}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI-совместимый сервер-заглушка")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--token-interval-ms", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = FakeConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        token_interval_ms=args.token_interval_ms,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,159 @@
+"""Нагрузочный генератор: полные прохождения опроса через HTTP API.
+
+Каждый виртуальный респондент вызывает /chat/start и отвечает на все
+вопросы через /chat/message (или /chat/message/stream с --stream), выбирая
+случайный вариант из current_question. Одновременно работают --concurrency
+респондентов, всего --surveys прохождений.
+
+    python -m benchmarks.fake_openai --latency-ms 300 &
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake uvicorn main:app --port 8000 &
+    python -m benchmarks.load --base-url http://127.0.0.1:8000 --concurrency 50 --surveys 500 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.report import summarize, write_report
+
+
+ANSWER_STYLES = ("text", "number", "lower")
+
+
+class LoadStats:
+    def __init__(self):
+        self.start_ms: List[float] = []
+        self.turn_ms: List[float] = []
+        # время до первого события потока (только --stream)
+        self.first_event_ms: List[float] = []
+        self.surveys_completed = 0
+        self.unclear_turns = 0
+        self.errors: Counter = Counter()
+
+
+def choose_answer(question: Dict[str, Any], rng: random.Random) -> str:
+    """Ответ так, как его мог бы дать человек: текст варианта, номер или текст в нижнем регистре"""
+    options = question.get("options") or []
+    if not options:
+        return "не знаю"
+    index = rng.randrange(len(options))
+    style = rng.choice(ANSWER_STYLES)
+    if style == "number":
+        return str(index + 1)
+    text = options[index]["text"]
+    return text.lower() if style == "lower" else text
+
+
+async def send_turn(client: httpx.AsyncClient, session_id: str, answer: str, stream: bool) -> Dict[str, Any]:
+    payload = {"session_id": session_id, "message": answer}
+    if not stream:
+        response = await client.post("/chat/message", json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    started = time.perf_counter()
+    result: Dict[str, Any] = {"current_question": None, "is_completed": False}
+    async with client.stream("POST", "/chat/message/stream", json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            if "first_event_ms" not in result:
+                result["first_event_ms"] = (time.perf_counter() - started) * 1000
+            event = json.loads(line)
+            if event["type"] in ("question", "unclear"):
+                result["current_question"] = event["current_question"]
+                result["unclear"] = event["type"] == "unclear"
+            elif event["type"] == "completed":
+                result["is_completed"] = True
+    return result
+
+
+async def run_survey(client: httpx.AsyncClient, rng: random.Random, stream: bool, max_turns: int, stats: LoadStats):
+    started = time.perf_counter()
+    response = await client.post("/chat/start")
+    response.raise_for_status()
+    stats.start_ms.append((time.perf_counter() - started) * 1000)
+    data = response.json()
+    session_id = data["session_id"]
+    question: Optional[Dict[str, Any]] = data.get("current_question")
+
+    for _ in range(max_turns):
+        if question is None:
+            break
+        answer = choose_answer(question, rng)
+        started = time.perf_counter()
+        result = await send_turn(client, session_id, answer, stream)
+        stats.turn_ms.append((time.perf_counter() - started) * 1000)
+        if "first_event_ms" in result:
+            stats.first_event_ms.append(result["first_event_ms"])
+        if result.get("unclear") or result.get("message", "").startswith("Ваш ответ не понятен"):
+            stats.unclear_turns += 1
+        if result.get("is_completed"):
+            stats.surveys_completed += 1
+            return
+        question = result.get("current_question")
+
+
+async def run(args) -> Dict[str, Any]:
+    stats = LoadStats()
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for n in range(args.surveys):
+        queue.put_nowait(n)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        async def worker(worker_id: int):
+            rng = random.Random(args.seed * 100003 + worker_id)
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await run_survey(client, rng, args.stream, args.max_turns, stats)
+                except httpx.HTTPStatusError as e:
+                    stats.errors[f"http_{e.response.status_code}"] += 1
+                except httpx.HTTPError as e:
+                    stats.errors[type(e).__name__] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    metrics = {
+        "elapsed_s": round(elapsed, 3),
+        "surveys_completed": stats.surveys_completed,
+        "surveys_per_sec": round(stats.surveys_completed / elapsed, 2) if elapsed else 0.0,
+        "turns": len(stats.turn_ms),
+        "turns_per_sec": round(len(stats.turn_ms) / elapsed, 2) if elapsed else 0.0,
+        "unclear_turns": stats.unclear_turns,
+        "errors": dict(stats.errors),
+        "chat_start": summarize(stats.start_ms, elapsed),
+        "chat_message": summarize(stats.turn_ms, elapsed),
+    }
+    if args.stream:
+        metrics["first_event"] = summarize(stats.first_event_ms, elapsed)
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест чата опроса")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--surveys", type=int, default=500, help="сколько прохождений выполнить")
+    parser.add_argument("--max-turns", type=int, default=50, help="ограничение ходов на одно прохождение")
+    parser.add_argument("--stream", action="store_true", help="использовать /chat/message/stream")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="файл для JSON отчета")
+    args = parser.parse_args()
+
+    metrics = asyncio.run(run(args))
+    params = {key: value for key, value in vars(args).items() if key != "output"}
+    write_report(args.output, "load", params, metrics)
@@ -0,0 +1,161 @@
+"""Микробенчмарки горячих функций бэкенда.
+
+check_numeric_answer и get_current_question - на наборе типичных ответов;
+save_survey_result и админские агрегаты - при 1k/10k/100k сессиях.
+Хранилища временные: основная база результатов не затрагивается.
+
+    python -m benchmarks.micro --sizes 1000,10000,100000 --output micro.json
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from answer_record import AnswerRecord
+from benchmarks.report import summarize, write_report
+
+
+SAMPLE_ANSWERS = [
+    "2", "мне 23 года", "1 и 3", "python и go", "первое", "не знаю",
+    "около 10 часов в неделю", "джун", "интересно решать сложные задачи", "все кроме java",
+]
+
+
+def prepare_environment(workdir: str):
+    """Переменные окружения до импорта main: временные хранилища, без дискового кеша"""
+    os.environ["RESULTS_DB"] = os.path.join(workdir, "results.sqlite3")
+    os.environ["SURVEY_VERSIONS_DIR"] = os.path.join(workdir, "survey_versions")
+    os.environ["SESSION_STORE"] = "memory"
+    os.environ.pop("MATCH_CACHE_DB", None)
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+
+def time_sync(fn: Callable[[], Any], iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def time_async(fn: Callable[[], Awaitable[Any]], iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def make_answers(survey, rng: random.Random) -> List[AnswerRecord]:
+    answers = []
+    for question in survey.questions:
+        count = 1 if question.type == "single_choice" else rng.randint(1, 3)
+        codes = [option.code for option in rng.sample(list(question.options), count)]
+        answers.append(AnswerRecord(question.id, codes, rng.choice(SAMPLE_ANSWERS)))
+    return answers
+
+
+async def populate(main, start: int, stop: int, rng: random.Random):
+    """Сессии с номерами [start, stop); примерно половина завершена и сохранена в результатах"""
+    survey = main.survey_registry.current
+    completed = []
+    for n in range(start, stop):
+        session = main.new_session(f"bench-{n}")
+        answers = make_answers(survey, rng)
+        if rng.random() < 0.5:
+            session.answers = answers
+            session.current_question_index = len(survey)
+            completed.append((session.id, answers, session.started_at, survey.version))
+        else:
+            keep = rng.randint(0, len(answers) - 1)
+            session.answers = answers[:keep]
+            session.current_question_index = keep
+        await main.session_store.save(session)
+        main.live_stats.restore(session, completed=main.is_session_completed(session))
+    # результаты - напрямую в хранилище одной транзакцией, без очереди записи
+    await asyncio.to_thread(main.results_store.add_many, completed)
+
+
+async def run(sizes: List[int], iterations: int, seed: int) -> Dict[str, Any]:
+    import main
+
+    rng = random.Random(seed)
+    survey = main.survey_registry.current
+    metrics: Dict[str, Any] = {}
+
+    questions = list(survey.questions)
+    answers = [(rng.choice(SAMPLE_ANSWERS), rng.choice(questions), survey.version) for _ in range(iterations)]
+    cursor = itertools.cycle(answers)
+    metrics["check_numeric_answer"] = summarize(
+        time_sync(lambda: main.check_numeric_answer(*next(cursor)), iterations)
+    )
+
+    session = main.new_session("bench-current")
+    session.current_question_index = len(survey) // 2
+    metrics["get_current_question"] = summarize(
+        time_sync(lambda: main.get_current_question(session), iterations)
+    )
+
+    token = main.ADMIN_TOKEN
+    # как при старте сервера: save_survey_result ставит результат в очередь фоновой записи
+    main.result_writer.start()
+    populated = 0
+    for size in sorted(sizes):
+        # размеры растут: досоздаем только недостающие сессии
+        await populate(main, populated, size, rng)
+        populated = size
+        answers_record = make_answers(survey, rng)
+        ids = iter(range(iterations))
+        save_samples = await time_async(
+            lambda: main.save_survey_result(f"bench-save-{size}-{next(ids)}", answers_record, survey.version),
+            iterations,
+        )
+        # админские замеры - по уже записанным результатам
+        await main.result_writer.flush()
+        scale: Dict[str, Any] = {
+            "save_survey_result": summarize(save_samples),
+            "admin_stats": summarize(await time_async(lambda: main.get_admin_stats(token=token), iterations)),
+            "admin_distribution": summarize(
+                await time_async(lambda: main.get_answer_distribution(token=token), iterations)
+            ),
+            "admin_responses_page": summarize(await time_async(
+                lambda: main.get_all_responses(
+                    limit=50, cursor=None, status="all", order="desc", since=None, until=None,
+                    question_id=None, answer_code=None, survey_version=None, token=token,
+                ),
+                max(1, iterations // 10),
+            )),
+        }
+        metrics[f"sessions_{size}"] = scale
+        print(f"sessions={size}: done")
+
+    await main.session_store.close()
+    await main.result_writer.close()
+    main.results_store.close()
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Микробенчмарки бэкенда опроса")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="число сессий через запятую")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="файл для JSON отчета")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    with tempfile.TemporaryDirectory() as workdir:
+        prepare_environment(workdir)
+        metrics = asyncio.run(run(sizes, args.iterations, args.seed))
+    write_report(
+        args.output,
+        "micro",
+        {"sizes": sizes, "iterations": args.iterations, "seed": args.seed},
+        metrics,
+    )
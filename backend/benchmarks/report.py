@@ -0,0 +1,67 @@
+"""Машиночитаемые отчеты бенчмарков (JSON).
+
+Каждый отчет содержит окружение (коммит, python, платформа), параметры
+запуска и метрики; метрики с задержками описываются через summarize().
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(samples_ms: List[float], elapsed_s: Optional[float] = None) -> Dict[str, float]:
+    """Перцентили по замерам в миллисекундах; elapsed_s - общее время для расчета ops_per_sec"""
+    ordered = sorted(samples_ms)
+    count = len(ordered)
+    summary = {
+        "count": count,
+        "mean_ms": round(sum(ordered) / count, 4) if count else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50), 4),
+        "p95_ms": round(percentile(ordered, 0.95), 4),
+        "p99_ms": round(percentile(ordered, 0.99), 4),
+        "max_ms": round(ordered[-1], 4) if count else 0.0,
+    }
+    if elapsed_s is None:
+        elapsed_s = sum(ordered) / 1000
+    summary["ops_per_sec"] = round(count / elapsed_s, 2) if elapsed_s > 0 else 0.0
+    return summary
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(path: Optional[str], kind: str, params: Dict[str, Any], metrics: Dict[str, Any]) -> Dict[str, Any]:
+    report = {
+        "kind": kind,
+        "created_at": datetime.now().isoformat(),
+        "environment": {
+            "git_revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": params,
+        "metrics": metrics,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    return report
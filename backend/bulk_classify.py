@@ -0,0 +1,305 @@
+"""Пакетная классификация ответов, собранных вне чата (бумажные анкеты, телефон).
+
+Пары (question_id, ответ) группируются по вопросу; то, что не решается
+локально или из кеша, отправляется в LLM пачками - много ответов в одном
+запросе со структурированным JSON ответом. Результат - answer_record
+того же вида, что строит send_message.
+
+CLI:
+    python bulk_classify.py answers.jsonl classified.jsonl [--batch-size 25]
+
+Каждая строка входа: {"question_id": 1, "answer": "...", "session_id": "..."}
+(session_id необязателен).
+"""
+import asyncio
+import inspect
+import json
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from answer_record import AnswerRecord
+from llm import LLMClient
+from match_cache import MatchCache, normalize_answer
+from survey_registry import CompiledQuestion, CompiledSurvey
+
+
+DEFAULT_BATCH_SIZE = 25
+# сколько завершенных задач хранить в памяти
+MAX_FINISHED_JOBS = 100
+
+# (ответ, вопрос, версия опроса) -> коды или None, если локально не решается
+LocalResolver = Callable[[str, CompiledQuestion, str], Optional[List[str]]]
+
+
+@dataclass
+class BulkItem:
+    question_id: Any
+    answer: str
+    session_id: Optional[str] = None
+
+
+@dataclass
+class BulkJob:
+    id: str
+    total: int
+    survey_version: str
+    status: str = "pending"  # pending -> running -> completed | failed
+    processed: int = 0
+    llm_requests: int = 0
+    errors: List[str] = field(default_factory=list)
+    results: List[Optional[Dict[str, Any]]] = field(default_factory=list)
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    finished_at: Optional[str] = None
+
+    def progress(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "llm_requests": self.llm_requests,
+            "survey_version": self.survey_version,
+            "errors": self.errors[-20:],
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+def build_answer_record(question: CompiledQuestion, codes: List[str], answer: str) -> Dict[str, Any]:
+    return {
+        "question_id": question.id,
+        "question": question.question,
+        "answer_codes": codes,
+        "answer_texts": question.texts_for(codes),
+        "original_answer": answer,
+    }
+
+
+def build_batch_prompt(question: CompiledQuestion, answers: List[str]) -> str:
+    options_text = "\n".join(f"{i}) {opt.code}: {opt.text}" for i, opt in enumerate(question.options, 1))
+    answers_text = "\n".join(f"{n}. {json.dumps(answer, ensure_ascii=False)}" for n, answer in enumerate(answers, 1))
+    if question.type == "single_choice":
+        rule = "Для каждого ответа выбери ОДИН наиболее подходящий код."
+    else:
+        rule = "Для каждого ответа выбери ВСЕ подходящие коды."
+    # сначала неизменная для вопроса часть, ответы - в конце (prefix caching)
+    return f"""Вопрос социологического опроса: "{question.question}"
+
+Доступные варианты ответов (с номерами):
+{options_text}
+
+{rule}
+Учитывай числовые ответы, ключевые слова, синонимы и похожие фразы.
+Если ответ не подходит ни к одному варианту, верни для него пустой список.
+Верни ТОЛЬКО JSON вида {{"results": [{{"n": 1, "codes": ["{question.options[0].code}"]}}, ...]}} для каждого ответа.
+
+Ответы респондентов ({len(answers)}):
+{answers_text}"""
+
+
+def parse_batch_response(content: str, question: CompiledQuestion, count: int) -> List[List[str]]:
+    """JSON ответ модели -> список кодов для каждого ответа (невалидные коды отбрасываются)"""
+    parsed = [[] for _ in range(count)]
+    data = json.loads(content)
+    for item in data.get("results", []):
+        try:
+            n = int(item.get("n")) - 1
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= n < count:
+            continue
+        codes = [str(c).strip() for c in item.get("codes") or [] if str(c).strip() in question.options_by_code]
+        if question.type == "single_choice":
+            codes = codes[:1]
+        parsed[n] = list(dict.fromkeys(codes))
+    return parsed
+
+
+class BulkClassifier:
+    def __init__(
+        self,
+        llm: LLMClient,
+        resolve_locally: LocalResolver,
+        cache: Optional[MatchCache] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ):
+        self.llm = llm
+        self.resolve_locally = resolve_locally
+        self.cache = cache
+        self.batch_size = batch_size
+
+    async def classify_batch(self, question: CompiledQuestion, answers: List[str]) -> List[List[str]]:
+        content = await self.llm.complete(
+            [
+                {"role": "system", "content": "Ты помощник для анализа ответов в социологическом опросе. Отвечай только валидным JSON."},
+                {"role": "user", "content": build_batch_prompt(question, answers)},
+            ],
+            temperature=0,
+            max_tokens=50 + 25 * len(answers),
+            response_format={"type": "json_object"},
+            kind="bulk",
+        )
+        return parse_batch_response(content, question, len(answers))
+
+    async def run(self, job: BulkJob, survey: CompiledSurvey, items: List[BulkItem]):
+        """Заполняет job.results (по порядку items)"""
+        job.status = "running"
+        job.results = [None] * len(items)
+        # question.id -> нормализованный ответ -> позиции; одинаковые ответы уходят в LLM один раз
+        pending: Dict[Any, Dict[str, List[int]]] = defaultdict(lambda: defaultdict(list))
+
+        for position, item in enumerate(items):
+            # id из JSONL или CSV может прийти строкой: "1" и 1 - один вопрос
+            question = survey.question_for(item.question_id)
+            if question is None:
+                job.errors.append(f"item {position}: unknown question_id {item.question_id}")
+                job.processed += 1
+                continue
+
+            codes = self.resolve_locally(item.answer, question, survey.version)
+            if not codes and self.cache is not None:
+                codes = await self.cache.get(survey.version, question.id, item.answer)
+            if codes:
+                job.results[position] = build_answer_record(question, codes, item.answer)
+                job.processed += 1
+            else:
+                pending[question.id][normalize_answer(item.answer)].append(position)
+
+        batches = []
+        for question_id, groups in pending.items():
+            entries = list(groups.values())
+            for start in range(0, len(entries), self.batch_size):
+                batches.append((survey.question_for(question_id), entries[start:start + self.batch_size]))
+
+        async def run_batch(question: CompiledQuestion, entries: List[List[int]]):
+            answers = [items[positions[0]].answer for positions in entries]
+            try:
+                job.llm_requests += 1
+                batch_codes = await self.classify_batch(question, answers)
+            except Exception as e:
+                job.errors.append(f"question {question.id}: {e}")
+                batch_codes = [[] for _ in answers]
+            for positions, answer, codes in zip(entries, answers, batch_codes):
+                if self.cache is not None:
+                    await self.cache.put(survey.version, question.id, answer, codes)
+                for position in positions:
+                    job.results[position] = build_answer_record(question, codes, items[position].answer)
+                    job.processed += 1
+
+        # параллельность ограничивает семафор LLMClient
+        await asyncio.gather(*(run_batch(q, entries) for q, entries in batches))
+
+
+class BulkJobManager:
+    """Фоновые задачи пакетной классификации с прогрессом"""
+
+    def __init__(
+        self,
+        classifier: BulkClassifier,
+        save_session: Optional[Callable[[str, List[AnswerRecord], Optional[str]], Any]] = None,
+    ):
+        self.classifier = classifier
+        self.save_session = save_session
+        self.jobs: Dict[str, BulkJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, survey: CompiledSurvey, items: List[BulkItem], save_results: bool = False) -> BulkJob:
+        job = BulkJob(id=str(uuid.uuid4()), total=len(items), survey_version=survey.version)
+        self._forget_old_jobs()
+        self.jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, survey, items, save_results))
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return job
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    async def _run(self, job: BulkJob, survey: CompiledSurvey, items: List[BulkItem], save_results: bool):
+        try:
+            await self.classifier.run(job, survey, items)
+            if save_results and self.save_session is not None:
+                for session_id, answers in group_by_session(items, job.results).items():
+                    # версия опроса известна - в результат идут компактные записи без текстов
+                    records = [
+                        AnswerRecord(answer["question_id"], answer["answer_codes"], answer["original_answer"])
+                        for answer in answers
+                    ]
+                    await _maybe_await(self.save_session(session_id, records, job.survey_version))
+            job.status = "completed"
+        except Exception as e:
+            job.status = "failed"
+            job.errors.append(str(e))
+        finally:
+            job.finished_at = datetime.now().isoformat()
+
+
+def group_by_session(items: List[BulkItem], results: List[Optional[Dict[str, Any]]]) -> Dict[str, List[Dict]]:
+    """Ответы с session_id в порядке входа, сгруппированные по респонденту"""
+    sessions: Dict[str, List[Dict]] = defaultdict(list)
+    for item, record in zip(items, results):
+        if item.session_id and record is not None:
+            sessions[item.session_id].append(record)
+    return dict(sessions)
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def _run_cli(input_path: str, output_path: str, batch_size: int):
+    # CLI использует тот же опрос, кеш и локальное сопоставление, что и сервер
+    import main
+
+    items = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                items.append(BulkItem(question_id=row["question_id"], answer=row["answer"], session_id=row.get("session_id")))
+
+    classifier = BulkClassifier(main.llm, main.resolve_answer_locally, main.match_cache, batch_size=batch_size)
+    survey = main.survey_registry.current
+    job = BulkJob(id=str(uuid.uuid4()), total=len(items), survey_version=survey.version)
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(1)
+            print(f"\r{job.processed}/{job.total} ({job.llm_requests} LLM requests)", end="", flush=True)
+
+    reporter = asyncio.create_task(report_progress())
+    try:
+        await classifier.run(job, survey, items)
+    finally:
+        reporter.cancel()
+        await main.llm.aclose()
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        for item, record in zip(items, job.results):
+            if record is None:
+                continue
+            if item.session_id:
+                record = {"session_id": item.session_id, **record}
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    print(f"\rClassified {job.processed}/{job.total} answers with {job.llm_requests} LLM requests")
+    for error in job.errors:
+        print(f"  error: {error}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Пакетная классификация ответов")
+    parser.add_argument("input", help="JSONL с полями question_id, answer, session_id")
+    parser.add_argument("output", help="куда записать answer_record (JSONL)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+    asyncio.run(_run_cli(args.input, args.output, args.batch_size))
@@ -0,0 +1,128 @@
+"""Потоковый экспорт результатов.
+
+Каждый формат - генератор, который получает строки/документы порциями и
+сразу отдает байты клиенту, поэтому память не растет с числом респондентов.
+Parquet доступен, если установлен pyarrow.
+"""
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List
+
+
+CSV_FIELDS = ["session_id", "timestamp", "question_id", "question", "answer_codes", "answer_texts", "original_answer"]
+
+# сколько строк копится перед отправкой очередного куска
+CHUNK_ROWS = 500
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "json": "application/json",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def csv_stream(rows: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    pending = 0
+    async for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= CHUNK_ROWS:
+            yield _drain(buffer)
+            pending = 0
+    yield _drain(buffer)
+
+
+async def jsonl_stream(docs: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    lines: List[str] = []
+    async for doc in docs:
+        lines.append(json.dumps(doc, ensure_ascii=False))
+        if len(lines) >= CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+async def json_array_stream(docs: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """JSON массив, который пишется по одному элементу"""
+    first = True
+    yield "["
+    async for doc in docs:
+        yield ("\n" if first else ",\n") + json.dumps(doc, ensure_ascii=False)
+        first = False
+    yield "\n]\n"
+
+
+def parquet_stream(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """Parquet с row group на каждые CHUNK_ROWS строк (синхронный: вызывается в пуле потоков)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, pa.string()) for name in CSV_FIELDS])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    batch: Dict[str, List[Any]] = {name: [] for name in CSV_FIELDS}
+
+    def flush():
+        writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+        for values in batch.values():
+            values.clear()
+
+    for row in rows:
+        for name in CSV_FIELDS:
+            value = row.get(name)
+            batch[name].append(None if value is None else str(value))
+        if len(batch["session_id"]) >= CHUNK_ROWS:
+            flush()
+            yield sink.take()
+    if batch["session_id"]:
+        flush()
+    writer.close()
+    yield sink.take()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл только на запись: накопленные байты забираются через take()"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _drain(buffer: io.StringIO) -> str:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+    return data
@@ -0,0 +1,78 @@
+"""Счетчики для /admin/stats, обновляемые по ходу опроса.
+
+Вместо обхода всех сессий на каждый запрос статистики счетчики меняются
+в start_chat и send_message: O(1) на событие и O(K) на чтение.
+Счетчики живут в памяти процесса и при старте восстанавливаются
+одним проходом по хранилищу сессий. Активные - незавершенные сессии, которые
+еще есть в хранилище: удаленные по TTL/LRU приходят в session_evicted.
+"""
+from collections import Counter, OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from answer_record import AnswerRecord
+
+
+class LiveStats:
+    def __init__(self, recent_limit: int = 10):
+        self.recent_limit = recent_limit
+        self.total_sessions = 0
+        self.completed_surveys = 0
+        # id незавершенных сессий в хранилище
+        self._active = set()
+        # session_id -> последняя активность, самые свежие в конце
+        self._recent: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # (survey_version, question_id) -> code -> количество ответов; id и коды
+        # между версиями могут совпадать, поэтому версии не смешиваются
+        self._tallies: Dict[Tuple[str, Any], Counter] = defaultdict(Counter)
+
+    @property
+    def active_sessions(self) -> int:
+        return len(self._active)
+
+    def session_started(self, session):
+        self.total_sessions += 1
+        self._active.add(session.id)
+
+    def answer_recorded(self, session, answer: AnswerRecord):
+        self._tallies[(session.survey_version, answer.question_id)].update(answer.codes)
+        self._touch_recent(session, answer)
+
+    def session_completed(self, session):
+        self.completed_surveys += 1
+        self._active.discard(session.id)
+
+    def session_evicted(self, session_id: str):
+        """Сессия удалена из хранилища по TTL или вытеснена: брошенная сессия больше не активна"""
+        self._active.discard(session_id)
+
+    def restore(self, session, completed: bool):
+        """Учесть уже существующую сессию (при старте процесса)"""
+        self.session_started(session)
+        for answer in session.answers:
+            self._tallies[(session.survey_version, answer.question_id)].update(answer.codes)
+        if session.answers:
+            self._touch_recent(session, session.answers[-1])
+        if completed:
+            self.session_completed(session)
+
+    def _touch_recent(self, session, answer: AnswerRecord):
+        # last_answer - запись без текстов; для выдачи ее раскрывают по survey_version
+        self._recent[session.id] = {
+            "session_id": session.id,
+            "started_at": session.started_at,
+            "survey_version": session.survey_version,
+            "answers_count": len(session.answers),
+            "last_answer": answer,
+        }
+        self._recent.move_to_end(session.id)
+        while len(self._recent) > self.recent_limit:
+            self._recent.popitem(last=False)
+
+    def recent_responses(self) -> List[Dict[str, Any]]:
+        return list(reversed(self._recent.values()))
+
+    def tallies(self, survey_version: str, question_id: Optional[Any] = None) -> Dict[Any, Dict[str, int]]:
+        """question_id -> code -> количество ответов по сессиям версии survey_version"""
+        if question_id is not None:
+            return {question_id: dict(self._tallies.get((survey_version, question_id), {}))}
+        return {qid: dict(counts) for (version, qid), counts in self._tallies.items() if version == survey_version}
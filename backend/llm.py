@@ -0,0 +1,312 @@
+"""Асинхронный слой для запросов к OpenAI.
+
+Один AsyncOpenAI клиент на процесс с общим пулом HTTP соединений,
+таймаут на каждый вызов и ограничение числа одновременных запросов.
+Поверх - защита от деградации upstream (см. llm_resilience): лимит под
+квоту RPM/TPM, повторы с jitter, хеджирующий запрос после p95 и автомат
+отключения. Пока автомат открыт, available=False, и приложение работает
+без LLM (локальное сопоставление и шаблонные благодарности).
+
+track_usage() собирает токены всех вызовов одного ответа в чате (включая
+вызовы из порожденных задач) - для учета стоимости хода.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from llm_resilience import (
+    LLM_HEDGES,
+    LLM_RETRIES,
+    CircuitBreaker,
+    LatencyTracker,
+    RateLimiter,
+    estimate_tokens,
+    is_retryable,
+    retry_delay,
+)
+from metrics import LLM_REQUEST_DURATION, LLM_REQUESTS, LLM_TOKENS
+
+
+DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# общий бюджет времени одного вызова (включая повторы), секунды
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "15"))
+# сколько запросов к API может выполняться одновременно
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+# квота аккаунта: запросов и токенов в минуту (0 - без ограничения)
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+# дольше этого не ждем слота лимитера - сразу отказ
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "2"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.2"))
+# хеджирующий запрос после p95 задержки (но не раньше LLM_HEDGE_MIN_DELAY)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") != "0"
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.3"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+_usage: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("llm_usage", default=None)
+
+
+def track_usage() -> Dict[str, int]:
+    """Начать учет токенов в текущем контексте; словарь пополняется по мере вызовов"""
+    usage = {"prompt": 0, "completion": 0, "cached": 0}
+    _usage.set(usage)
+    return usage
+
+
+class LLMClient:
+    """Обертка над AsyncOpenAI с семафором, таймаутами и защитой от сбоев upstream"""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        timeout: float = LLM_TIMEOUT,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        rate_limiter: Optional[RateLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        max_retries: int = LLM_MAX_RETRIES,
+        hedge: bool = LLM_HEDGE,
+    ):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.rate_limiter = rate_limiter or RateLimiter(LLM_RPM, LLM_TPM, max_wait=LLM_RATE_LIMIT_MAX_WAIT)
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+        self.latency = LatencyTracker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency,
+            ),
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=self._http_client,
+            max_retries=0,
+        )
+
+    @property
+    def available(self) -> bool:
+        """False - upstream признан недоступным, вызовы будут отклонены"""
+        return self.breaker.available
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        model: str = DEFAULT_MODEL,
+        temperature: float = 0.3,
+        max_tokens: int = 50,
+        timeout: Optional[float] = None,
+        response_format: Optional[Dict[str, Any]] = None,
+        kind: str = "other",
+    ) -> str:
+        """Один chat completion; возвращает текст ответа без пробелов по краям.
+
+        kind - назначение промпта для метрик (match, ack, bulk).
+        timeout - бюджет на весь вызов вместе с повторами и хеджированием.
+        Исключения (в том числе asyncio.TimeoutError и llm_resilience.LLMUnavailable) пробрасываются вызывающему.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        request = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if response_format:
+            request["response_format"] = response_format
+        estimated = estimate_tokens(messages, max_tokens)
+
+        self.breaker.before_call(kind)
+        attempt = 0
+        while True:
+            try:
+                response = await self._hedged(request, kind, estimated, deadline)
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release()
+                if not retryable or attempt >= self.max_retries or self.breaker.state == CircuitBreaker.OPEN:
+                    raise
+                delay = retry_delay(attempt, e, LLM_RETRY_BASE, cap=2.0)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                LLM_RETRIES.inc(kind=kind)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # отмена вызывающим - не вердикт о здоровье upstream
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return (response.choices[0].message.content or "").strip()
+
+    async def _hedged(self, request: Dict[str, Any], kind: str, estimated: int, deadline: float):
+        """Попытка; если она дольше p95, параллельно запускается вторая, побеждает первая успешная"""
+        primary = asyncio.create_task(self._attempt(request, kind, estimated, deadline))
+        hedge_delay = self._hedge_delay(kind)
+        if hedge_delay is None or time.monotonic() + hedge_delay >= deadline:
+            return await primary
+
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                hedge = asyncio.create_task(self._attempt(request, kind, estimated, deadline))
+                tasks.add(hedge)
+                LLM_HEDGES.inc(kind=kind, result="launched")
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            LLM_HEDGES.inc(kind=kind, result="won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _hedge_delay(self, kind: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p95 = self.latency.p95(kind)
+        return None if p95 is None else max(p95, LLM_HEDGE_MIN_DELAY)
+
+    async def _attempt(self, request: Dict[str, Any], kind: str, estimated: int, deadline: float):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        await self.rate_limiter.acquire(estimated, kind, max_wait=min(remaining, self.rate_limiter.max_wait))
+        model = request["model"]
+        async with self._semaphore:
+            started = time.perf_counter()
+            remaining = max(0.001, deadline - time.monotonic())
+            try:
+                response = await asyncio.wait_for(
+                    self.client.chat.completions.create(**request, timeout=remaining),
+                    timeout=remaining,
+                )
+            except BaseException as e:
+                self._observe(model, kind, started, e)
+                raise
+        self._observe(model, kind, started, None, response.usage)
+        self.latency.record(kind, time.perf_counter() - started)
+        if response.usage is not None:
+            self.rate_limiter.correct(estimated, response.usage.total_tokens)
+        return response
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        *,
+        model: str = DEFAULT_MODEL,
+        temperature: float = 0.3,
+        max_tokens: int = 50,
+        timeout: Optional[float] = None,
+        kind: str = "other",
+    ) -> AsyncIterator[str]:
+        """Chat completion потоком: фрагменты текста по мере генерации.
+
+        timeout ограничивает ожидание первого ответа и каждого следующего фрагмента.
+        Повторов и хеджирования нет: после первого фрагмента повтор невозможен.
+        """
+        timeout = timeout or self.timeout
+        estimated = estimate_tokens(messages, max_tokens)
+        self.breaker.before_call(kind)
+        try:
+            await self.rate_limiter.acquire(estimated, kind)
+        except BaseException:
+            self.breaker.release()
+            raise
+        async with self._semaphore:
+            started = time.perf_counter()
+            usage = None
+            try:
+                stream = await asyncio.wait_for(
+                    self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        timeout=timeout,
+                        stream=True,
+                        # последний фрагмент несет usage - для учета токенов
+                        stream_options={"include_usage": True},
+                    ),
+                    timeout=timeout,
+                )
+                try:
+                    async for chunk in stream:
+                        usage = chunk.usage or usage
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            yield delta
+                finally:
+                    await stream.close()
+            except BaseException as e:
+                self._observe(model, kind, started, e)
+                if isinstance(e, Exception) and is_retryable(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release()
+                raise
+        self._observe(model, kind, started, None, usage)
+        self.breaker.record_success()
+        if usage is not None:
+            self.rate_limiter.correct(estimated, usage.total_tokens)
+
+    def _observe(self, model: str, kind: str, started: float, error: Optional[BaseException], usage=None):
+        LLM_REQUEST_DURATION.observe(time.perf_counter() - started, model=model, kind=kind)
+        if error is None:
+            outcome = "ok"
+        elif isinstance(error, asyncio.TimeoutError):
+            outcome = "timeout"
+        elif isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        LLM_REQUESTS.inc(model=model, kind=kind, outcome=outcome)
+        if usage is None:
+            return
+        prompt = usage.prompt_tokens or 0
+        completion = usage.completion_tokens or 0
+        # часть входных токенов, взятая из prompt cache провайдера
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        LLM_TOKENS.inc(prompt, model=model, kind=kind, direction="prompt")
+        LLM_TOKENS.inc(completion, model=model, kind=kind, direction="completion")
+        LLM_TOKENS.inc(cached, model=model, kind=kind, direction="cached")
+        turn = _usage.get()
+        if turn is not None:
+            turn["prompt"] += prompt
+            turn["completion"] += completion
+            turn["cached"] += cached
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "available": self.available,
+            "breaker": self.breaker.status(),
+            "rate_limiter": self.rate_limiter.status(),
+            "hedge_delay_s": {kind: self._hedge_delay(kind) for kind in self.latency.kinds()},
+        }
+
+    async def aclose(self):
+        await self._http_client.aclose()
@@ -0,0 +1,228 @@
+"""Защита от деградации OpenAI: лимиты, повторы, хеджирование, автомат отключения.
+
+- RateLimiter - два token bucket (запросы и токены в минуту) под квоту аккаунта;
+  если ждать слота дольше допустимого, вызов сразу отклоняется.
+- retry_delay - экспоненциальная пауза с полным jitter (или Retry-After от API).
+- LatencyTracker - p95 последних успешных вызовов: после него запускается
+  дублирующий (хеджирующий) запрос.
+- CircuitBreaker - после серии сбоев upstream считается недоступным на
+  cooldown секунд; в это время вызовы отклоняются без сети, затем один
+  пробный вызов решает, закрыть автомат или открыть снова.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+import httpx
+import openai
+
+from metrics import Counter, Histogram
+
+
+LLM_RETRIES = Counter("survey_llm_retries_total", "OpenAI request retries by prompt kind", ("kind",))
+LLM_HEDGES = Counter(
+    "survey_llm_hedges_total", "Hedged duplicate OpenAI requests (launched, won)", ("kind", "result")
+)
+LLM_RATE_LIMIT_WAIT = Histogram(
+    "survey_llm_rate_limit_wait_seconds", "Time spent waiting for the client-side rate limiter", ("kind",)
+)
+LLM_REJECTED = Counter(
+    "survey_llm_rejected_total", "OpenAI calls rejected without a request (circuit open, rate limit)", ("kind", "reason")
+)
+LLM_BREAKER_TRANSITIONS = Counter(
+    "survey_llm_breaker_transitions_total", "Circuit breaker state changes", ("state",)
+)
+
+
+class LLMUnavailable(Exception):
+    """Вызов отклонен без обращения к API (автомат открыт или превышена квота)"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"LLM unavailable: {reason}")
+        self.reason = reason
+
+
+def estimate_tokens(messages, max_tokens: int) -> int:
+    # ~4 символа на токен; точное число приходит в usage и корректирует бакет
+    return sum(len(str(m.get("content", ""))) for m in messages) // 4 + max_tokens
+
+
+class TokenBucket:
+    """Бакет с резервированием: остаток может уйти в минус, тогда вызов ждет своей очереди"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Списать amount, вернуть сколько секунд ждать до его доступности"""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float):
+        self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class RateLimiter:
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_wait: float = 5.0):
+        # 0 - без ограничения
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_wait = max_wait
+
+    async def acquire(self, tokens: int, kind: str, max_wait: Optional[float] = None):
+        max_wait = self.max_wait if max_wait is None else max_wait
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait > max_wait:
+            self.release(tokens)
+            LLM_REJECTED.inc(kind=kind, reason="rate_limit")
+            raise LLMUnavailable("client rate limit")
+        LLM_RATE_LIMIT_WAIT.observe(wait, kind=kind)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def release(self, tokens: int):
+        """Вернуть резерв (вызов не состоялся)"""
+        if self.requests is not None:
+            self.requests.refund(1)
+        if self.tokens is not None:
+            self.tokens.refund(tokens)
+
+    def correct(self, estimated: int, actual: int):
+        """Поправить бакет токенов по фактическому usage"""
+        if self.tokens is not None and actual:
+            self.tokens.tokens -= actual - estimated
+
+    def status(self) -> Dict[str, Optional[float]]:
+        return {
+            "requests_available": round(self.requests.tokens, 1) if self.requests else None,
+            "tokens_available": round(self.tokens.tokens, 1) if self.tokens else None,
+        }
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Сбой на стороне upstream или сети - имеет смысл повторить"""
+    if isinstance(error, (asyncio.TimeoutError, openai.APITimeoutError, openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, openai.RateLimitError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def retry_delay(attempt: int, error: BaseException, base: float, cap: float) -> float:
+    """Полный jitter: случайная пауза от 0 до base * 2^attempt; Retry-After имеет приоритет"""
+    response = getattr(error, "response", None)
+    if response is not None:
+        try:
+            retry_after = float(response.headers.get("retry-after", ""))
+            return min(cap, max(0.0, retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class LatencyTracker:
+    """Окно последних успешных задержек по типу промпта"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._window = window
+
+    def record(self, kind: str, seconds: float):
+        samples = self._samples.get(kind)
+        if samples is None:
+            samples = self._samples[kind] = deque(maxlen=self._window)
+        samples.append(seconds)
+
+    def kinds(self):
+        return list(self._samples)
+
+    def p95(self, kind: str) -> Optional[float]:
+        samples = self._samples.get(kind)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(0.95 * (len(ordered) - 1) + 0.5))]
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def available(self) -> bool:
+        """Можно ли сейчас рассчитывать на LLM (для выбора деградированного режима)"""
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.cooldown
+        if self.state == self.HALF_OPEN:
+            return not self._probe_in_flight
+        return True
+
+    def before_call(self, kind: str):
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.cooldown:
+                LLM_REJECTED.inc(kind=kind, reason="circuit_open")
+                raise LLMUnavailable("circuit open")
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            # пропускаем один пробный вызов
+            if self._probe_in_flight:
+                LLM_REJECTED.inc(kind=kind, reason="circuit_open")
+                raise LLMUnavailable("circuit half-open")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self._probe_in_flight = False
+        self.consecutive_failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self.state != self.OPEN:
+                self._transition(self.OPEN)
+
+    def release(self):
+        """Вызов завершился без вердикта о здоровье upstream (например, ошибка запроса)"""
+        self._probe_in_flight = False
+
+    def _transition(self, state: str):
+        self.state = state
+        LLM_BREAKER_TRANSITIONS.inc(state=state)
+        print(f"LLM circuit breaker: {state}")
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "available": self.available,
+            "consecutive_failures": self.consecutive_failures,
+        }
@@ -0,0 +1,200 @@
+"""Локальное (без LLM) сопоставление ответа с вариантами.
+
+Для каждого вопроса один раз строится индекс: основы слов вариантов
+(упрощенный стеммер для русского) и TF-IDF векторы символьных триграмм,
+сложенные в матрицы NumPy. Ответ сравнивается со всеми вариантами сразу
+по покрытию ключевых слов и косинусу триграмм; уверенные совпадения
+решаются локально, остальное уходит в LLM.
+"""
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from survey_registry import CompiledQuestion
+
+
+_TOKEN_RE = re.compile(r"\w+[#+]*", re.UNICODE)
+
+STOPWORDS = frozenset(
+    "и или а но в во на с со к ко по о об от до из за у для про я мы вы ты он она они "
+    "мне меня мой моя мое мои это то так же еще тоже уже бы ли как что".split()
+)
+# при отрицании в ответе локальное решение не принимается
+NEGATIONS = frozenset(("не", "нет", "ни", "кроме", "без"))
+
+_SUFFIXES = sorted(
+    (
+        "иями ями ами ией ием иях ого его ому ему ыми ими ой ей ий ый ая яя ое ее ые ие "
+        "ом ем ам ям ах ях ую юю ов ев ей ию ия ие ь ы и а я о е у ю"
+    ).split(),
+    key=len,
+    reverse=True,
+)
+
+
+def stem(word: str) -> str:
+    """Очень простой стеммер: отрезает типичное окончание, оставляя основу от 3 букв"""
+    if not word.isalpha() or not ("а" <= word[0] <= "я"):
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def content_stems(tokens: List[str]) -> FrozenSet[str]:
+    return frozenset(stem(t) for t in tokens if t not in STOPWORDS)
+
+
+def trigrams(text: str) -> Counter:
+    padded = f"  {' '.join(tokenize(text))} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class QuestionIndex:
+    """Предвычисленные признаки вариантов одного вопроса.
+
+    Варианты - строки матриц: нормированные TF-IDF векторы триграмм и
+    индикаторы основ слов. Ответ сравнивается со всеми вариантами сразу
+    двумя умножениями матрицы на вектор.
+    """
+
+    def __init__(self, question: CompiledQuestion):
+        self.question = question
+        self.codes = [opt.code for opt in question.options]
+        grams = [trigrams(opt.text) for opt in question.options]
+        stems = [content_stems(tokenize(opt.text)) for opt in question.options]
+
+        # idf по вариантам вопроса: общие для всех вариантов триграммы почти не весят
+        df = Counter(g for counts in grams for g in counts)
+        total = len(grams)
+        self.vocabulary = {g: i for i, g in enumerate(df)}
+        self.idf = np.array([math.log((1 + total) / (1 + n)) + 1 for n in df.values()])
+        # триграммы, которых нет ни в одном варианте, получают максимальный idf
+        self.default_idf = math.log(1 + total) + 1
+
+        self.matrix = np.zeros((total, len(self.vocabulary)))
+        for row, counts in enumerate(grams):
+            for g, tf in counts.items():
+                self.matrix[row, self.vocabulary[g]] = tf
+        self.matrix *= self.idf
+        norms = np.linalg.norm(self.matrix, axis=1)
+        self.matrix /= np.where(norms > 0, norms, 1.0)[:, None]
+
+        self.stem_vocabulary = {t: i for i, t in enumerate(sorted(frozenset().union(*stems)))}
+        self.stem_matrix = np.zeros((total, len(self.stem_vocabulary)))
+        for row, option_stems in enumerate(stems):
+            self.stem_matrix[row, [self.stem_vocabulary[t] for t in option_stems]] = 1.0
+        self.stem_counts = self.stem_matrix.sum(axis=1)
+        self.stems_by_code = dict(zip(self.codes, stems))
+
+    def scores(self, answer: str) -> List[Tuple[str, float]]:
+        """Оценка [0, 1] для каждого варианта"""
+        vector = np.zeros(len(self.vocabulary))
+        unknown = 0.0
+        for g, tf in trigrams(answer).items():
+            column = self.vocabulary.get(g)
+            if column is None:
+                unknown += (tf * self.default_idf) ** 2
+            else:
+                vector[column] = tf * self.idf[column]
+        norm = math.sqrt(float(vector @ vector) + unknown) or 1.0
+        cosine = self.matrix @ vector / norm
+
+        present = np.zeros(len(self.stem_vocabulary))
+        columns = [self.stem_vocabulary[t] for t in content_stems(tokenize(answer)) if t in self.stem_vocabulary]
+        present[columns] = 1.0
+        coverage = np.divide(
+            self.stem_matrix @ present, self.stem_counts,
+            out=np.zeros(len(self.codes)), where=self.stem_counts > 0,
+        )
+        return list(zip(self.codes, (0.5 * cosine + 0.5 * coverage).tolist()))
+
+
+@dataclass
+class LocalMatch:
+    codes: List[str]
+    score: float
+
+
+class LocalMatcher:
+    def __init__(self, threshold: float = 0.7, margin: float = 0.15):
+        # минимальная оценка варианта и (для single_choice) отрыв от второго места
+        self.threshold = threshold
+        self.margin = margin
+        self._indexes: Dict[Tuple[str, int], QuestionIndex] = {}
+        self._lock = threading.Lock()
+
+    def index_for(self, question: CompiledQuestion, survey_version: str) -> QuestionIndex:
+        key = (survey_version, question.index)
+        index = self._indexes.get(key)
+        if index is None:
+            with self._lock:
+                index = self._indexes.setdefault(key, QuestionIndex(question))
+        return index
+
+    def warm(self, survey):
+        """Построить индексы всех вопросов опроса заранее"""
+        for question in survey.questions:
+            self.index_for(question, survey.version)
+
+    def match(self, answer: str, question: CompiledQuestion, survey_version: str) -> Optional[LocalMatch]:
+        """Уверенное совпадение или None (тогда решает LLM)"""
+        tokens = tokenize(answer)
+        if not tokens or NEGATIONS.intersection(tokens):
+            return None
+
+        index = self.index_for(question, survey_version)
+        scored = index.scores(answer)
+        scored.sort(key=lambda item: item[1], reverse=True)
+
+        if question.type == "single_choice":
+            best_code, best = scored[0]
+            runner_up = scored[1][1] if len(scored) > 1 else 0.0
+            if best >= self.threshold and best - runner_up >= self.margin:
+                return LocalMatch(codes=[best_code], score=best)
+            return None
+
+        selected = [(code, score) for code, score in scored if score >= self.threshold]
+        if not selected:
+            return None
+        # для multiple_choice каждое значимое слово ответа должно относиться к выбранному
+        # варианту, иначе часть ответа могла бы потеряться ("python и rust")
+        explained = frozenset().union(*(index.stems_by_code[code] for code, _ in selected))
+        if content_stems(tokens) - explained:
+            return None
+        # порядок вариантов как в опросе
+        order = {code: i for i, code in enumerate(question.codes)}
+        selected.sort(key=lambda item: order[item[0]])
+        return LocalMatch(codes=[code for code, _ in selected], score=min(s for _, s in selected))
+
+
+class TierStats:
+    """Сколько ответов решено на каждом уровне сопоставления"""
+
+    TIERS = ("numeric", "local", "cache", "llm", "unclear", "degraded")
+
+    def __init__(self):
+        self._counts = Counter()
+
+    def record(self, tier: str):
+        self._counts[tier] += 1
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        total = sum(self._counts.values())
+        return {
+            tier: {
+                "count": self._counts[tier],
+                "share": round(self._counts[tier] / total, 4) if total else 0.0,
+            }
+            for tier in self.TIERS
+        }
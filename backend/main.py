@@ -1,21 +1,62 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import iterate_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import json
 import os
+import re
 from datetime import datetime
 from dotenv import load_dotenv
-from openai import OpenAI
 import uuid
 import hashlib
 import secrets
+import asyncio
+import base64
+import time
 
 load_dotenv()
 
+from llm import LLMClient, track_usage
+from match_cache import MatchCache
+from local_matcher import LocalMatcher, TierStats
+from answer_parser import AnswerParser
+from prompts import PromptBook, acknowledgement_messages
+from survey_registry import SurveyRegistry, CompiledQuestion, compile_survey, survey_file_data
+from survey_store import SurveyVersionStore
+from admission import START, TURN, AdmissionController, AdmissionMiddleware
+from turn_gate import TurnConflict, TurnGate
+from turn_pipeline import (
+    ACK_MODE_LLM, ACK_MODES, LatencyRecorder, PrefetchedStream, UsageRecorder, run_turn, template_acknowledgement, timed
+)
+from bulk_classify import BulkClassifier, BulkItem, BulkJobManager
+from session_store import Session, create_session_store
+from answer_record import AnswerRecord, expand_answers
+from results_store import ResultsStore
+from persistence import ResultRecord, ResultWriter, atomic_write_json
+from live_stats import LiveStats
+from admin_events import EventBroadcaster
+from metrics import HTTP_REQUEST_DURATION, REGISTRY, TURN_TOKENS, Counter, Gauge
+from tracing import RequestInstrumentation, SlowRequestProfiler, recent_traces, span
+from answer_search import LiveAnswerIndex, fts_query, parse_query
+from analytics import AnalyticsEngine, ResultFrame, parse_segment
+from exporters import MEDIA_TYPES, csv_stream, json_array_stream, jsonl_stream, parquet_available, parquet_stream
+
 app = FastAPI(title="Survey Chat Bot")
 
+# допуск запросов чата при перегрузке: ходы начатых опросов раньше новых сессий,
+# лишнее - 503 + Retry-After; внутри CORS, чтобы браузер видел ответ 503
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "64")),
+    reserved_turn_slots=int(os.getenv("ADMISSION_RESERVED_TURN_SLOTS", "8")),
+    turn_budget=float(os.getenv("ADMISSION_TURN_BUDGET", "2.0")),
+    start_budget=float(os.getenv("ADMISSION_START_BUDGET", "0.5")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "500"))
+)
+app.add_middleware(AdmissionMiddleware, controller=admission, classify=lambda scope: classify_chat_request(scope))
+
 # CORS настройки
 app.add_middleware(
     CORSMiddleware,
@@ -23,21 +64,125 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # заголовки ответа, которые фронтенд читает на другом origin
+    expose_headers=["Retry-After", "Idempotent-Replayed", "X-Trace-Id", "Server-Timing"],
 )
 
-# OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAI (асинхронный клиент с общим пулом соединений)
+llm = LLMClient(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
 
 #  система авторизации
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "admin123")  # В продакшене использовать JWT
 security = HTTPBearer()
 
-# хранение сессии (можно использовать Redis/DB)
-sessions: Dict[str, Dict[str, Any]] = {}
+# режим благодарности по умолчанию: "llm" или "template" (без запроса к API);
+# опрос может переопределить его в settings.ack_mode
+ACK_MODE = os.getenv("ACK_MODE", ACK_MODE_LLM)
 
-#  вопросы опроса
-with open("survey_questions.json", "r", encoding="utf-8") as f:
-    SURVEY_QUESTIONS = json.load(f)
+# кеш сопоставления ответов (SQLite уровень включается через MATCH_CACHE_DB)
+match_cache = MatchCache(
+    max_entries=int(os.getenv("MATCH_CACHE_SIZE", "10000")),
+    db_path=os.getenv("MATCH_CACHE_DB") or None,
+    ttl_seconds=float(os.getenv("MATCH_CACHE_TTL", str(30 * 24 * 3600)))
+)
+
+# локальное сопоставление до обращения к LLM и статистика по уровням
+local_matcher = LocalMatcher(
+    threshold=float(os.getenv("LOCAL_MATCH_THRESHOLD", "0.7")),
+    margin=float(os.getenv("LOCAL_MATCH_MARGIN", "0.15"))
+)
+match_tiers = TierStats()
+# разбор номеров и порядковых по правилам, скомпилированным для каждого вопроса
+answer_parser = AnswerParser(min_confidence=float(os.getenv("PARSER_MIN_CONFIDENCE", "0.6")))
+
+# ответы на повторы ходов по turn_id и очередность ходов внутри сессии
+turn_gate = TurnGate(responses_per_session=int(os.getenv("TURN_REPLAY_SIZE", "8")))
+
+# замеры времени этапов обработки ответа и токенов LLM на ответ
+turn_latency = LatencyRecorder()
+turn_tokens = UsageRecorder()
+
+# хранение сессий: memory (по умолчанию), sqlite:///path или redis://host:port/db
+session_store = create_session_store(
+    os.getenv("SESSION_STORE", "memory"),
+    ttl_seconds=float(os.getenv("SESSION_TTL", str(72 * 3600))),
+    on_evict=lambda session_id: session_evicted(session_id)
+)
+# как часто удалять истекшие сессии (и снимать их со счетчиков активных), секунды
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+# завершенные опросы (SQLite с индексами вместо файла на каждого респондента)
+results_store = ResultsStore(os.getenv("RESULTS_DB", "results.sqlite3"))
+# поиск по исходным ответам незавершенных сессий; сохраненные ищутся через FTS5 в results_store
+live_search = LiveAnswerIndex(ttl_seconds=float(os.getenv("SESSION_TTL", str(72 * 3600))))
+# запись результатов в фоне пачками; обработчик ждет, только если очередь заполнена
+result_writer = ResultWriter(
+    results_store,
+    max_queue=int(os.getenv("RESULTS_QUEUE_SIZE", "1000")),
+    batch_size=int(os.getenv("RESULTS_BATCH_SIZE", "100")),
+    # результаты, которые не удалось записать, - файлами в том же виде, что прежние results/survey_*.json
+    dead_letter_dir=os.getenv("RESULTS_DEAD_LETTER_DIR", "results_dead_letter"),
+    # записанные результаты ищутся в базе, из памяти их можно убрать
+    on_written=lambda batch: live_search.discard(record.session_id for record in batch)
+)
+
+# аналитика по сохраненным результатам: колонки по версиям, догружаются по мере записи
+analytics = AnalyticsEngine(results_store, cache_size=int(os.getenv("ANALYTICS_CACHE_SIZE", "256")))
+
+# счетчики для /admin/stats, обновляются по событиям сессий
+live_stats = LiveStats(recent_limit=10)
+
+# поток событий для админ панели: пачка не чаще раза в ADMIN_EVENTS_INTERVAL секунд
+admin_events = EventBroadcaster(
+    lambda: {
+        "total_sessions": live_stats.total_sessions,
+        "completed_surveys": live_stats.completed_surveys,
+        "active_sessions": live_stats.active_sessions,
+        "recent_responses": recent_responses(),
+        "tallies": live_stats.tallies(survey_registry.current.version),
+        "tallies_version": survey_registry.current.version
+    },
+    interval=float(os.getenv("ADMIN_EVENTS_INTERVAL", "0.5"))
+)
+ADMIN_EVENTS_HEARTBEAT = 15.0
+
+# /metrics для Prometheus; выключается METRICS_ENABLED=0
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+slow_request_profiler = SlowRequestProfiler()
+
+# значения вычисляются при чтении /metrics
+Gauge("survey_sessions", "Survey sessions by state", ("state",), callback=lambda: {
+    "active": live_stats.active_sessions,
+    "completed": live_stats.completed_surveys
+})
+Gauge("survey_match_cache_hit_ratio", "Share of LLM match lookups served by the cache",
+      callback=lambda: match_cache.stats()["hit_ratio"])
+Gauge("survey_match_cache_entries", "Entries in the in-memory match cache",
+      callback=lambda: match_cache.stats()["memory_entries"])
+Counter("survey_match_tier_total", "Answers resolved by each matching tier", ("tier",),
+        callback=lambda: {tier: data["count"] for tier, data in match_tiers.report().items()})
+Gauge("survey_llm_available", "1 if the LLM is used, 0 while the circuit breaker keeps the app in degraded mode",
+      callback=lambda: 1 if llm.available else 0)
+Gauge("survey_admin_event_subscribers", "Open admin event streams",
+      callback=lambda: admin_events.subscriber_count)
+Counter("survey_turn_replays_total", "Chat turns answered from the turn_id replay cache",
+        callback=lambda: turn_gate.replayed)
+Gauge("survey_admission_queue_depth", "Chat requests waiting for an admission slot", ("kind",),
+      callback=lambda: {kind: admission.queue_depth(kind) for kind in (TURN, START)})
+Gauge("survey_admission_active", "Chat requests being processed", callback=lambda: admission.active)
+Gauge("survey_results_queue_depth", "Results waiting in the write-behind queue",
+      callback=lambda: result_writer.pending)
+
+# промпты сопоставления для каждого вопроса (статическая часть строится один раз)
+match_prompts = PromptBook()
+
+#  вопросы опроса (читаются с диска один раз); все версии - в SURVEY_VERSIONS_DIR по хешу содержимого
+survey_store = SurveyVersionStore(os.getenv("SURVEY_VERSIONS_DIR", "survey_versions"))
+survey_registry = SurveyRegistry("survey_questions.json", store=survey_store)
+initial_survey = survey_registry.load()
+local_matcher.warm(initial_survey)
+answer_parser.warm(initial_survey)
+match_prompts.warm(initial_survey)
 
 
 class LoginRequest(BaseModel):
@@ -47,11 +192,26 @@ class LoginRequest(BaseModel):
 
 class SurveyUpload(BaseModel):
     questions: List[Dict[str, Any]]
+    settings: Optional[Dict[str, Any]] = None
+
+
+class BulkAnswer(BaseModel):
+    question_id: Any
+    answer: str
+    session_id: Optional[str] = None
+
+
+class BulkClassifyRequest(BaseModel):
+    items: List[BulkAnswer]
+    # сохранить ответы с session_id как результаты опроса
+    save_results: bool = False
 
 
 class ChatMessage(BaseModel):
     session_id: Optional[str] = None
     message: str
+    # id хода от клиента: повторная отправка с тем же id не обрабатывается заново
+    turn_id: Optional[str] = None
 
 
 class ChatResponse(BaseModel):
@@ -79,231 +239,328 @@ def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends(secur
 
 
 def load_survey_questions():
-    """Загрузка вопросов из JSON"""
-    with open("survey_questions.json", "r", encoding="utf-8") as f:
-        return json.load(f)
+    """Вопросы текущего опроса (из реестра, без чтения файла)"""
+    return survey_registry.current.to_list()
 
 
-def save_survey_result(session_id: str, answers: List[Dict]):
-    """Сохранение результатов опроса в JSON файл"""
-    os.makedirs("results", exist_ok=True)
-    
-    result = {
-        "session_id": session_id,
-        "timestamp": datetime.now().isoformat(),
-        "answers": answers
-    }
-    
-    filename = f"results/survey_{session_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
-    
-    return filename
+def new_session(session_id: str) -> Session:
+    """Новая сессия, привязанная к текущей версии опроса"""
+    return Session(id=session_id, survey_version=survey_registry.current.version)
+
+
+def is_session_completed(session: Session) -> bool:
+    try:
+        survey = survey_registry.get(session.survey_version)
+    except KeyError:
+        # версии опроса сессии больше нет: продолжить ее нельзя, но и завершенной она не считается
+        return False
+    return session.current_question_index >= len(survey)
+
+
+async def save_survey_result(session_id: str, answers: List[AnswerRecord], survey_version: Optional[str] = None):
+    """Сохранение результатов опроса: в очередь фоновой записи, без дискового I/O в обработчике"""
+    await result_writer.submit(session_id, answers, survey_version=survey_version)
 
 
-def get_current_question(session: Dict) -> Optional[Dict]:
+def get_current_question(session: Session) -> Optional[CompiledQuestion]:
     """Получить вопрос для сессии"""
-    current_index = session.get("current_question_index", 0)
-    questions = load_survey_questions()
-    
-    if current_index < len(questions):
-        return questions[current_index]
-    return None
+    survey = survey_registry.get(session.survey_version)
+    return survey.question_at(session.current_question_index)
 
 
-def match_answer_to_options(user_answer: str, question: Dict) -> List[str]:
-    """
-    Использование API для сопоставления ответа пользователя с вариантами
-    """
-    # проверяем числовые ответы и ключевые слова
-    numeric_result = check_numeric_answer(user_answer, question)
-    if numeric_result:
-        return numeric_result
+def expand_document(doc: Dict) -> Dict:
+    """Ответы документа с текстами вопросов и вариантов его версии опроса (для админки и экспорта).
     
-    lines = []
-    for i, opt in enumerate(question["options"], 1):
-        lines.append(f"{i}) {opt['code']}: {opt['text']}")
-    options_text = "\n".join(lines)
-    
-    if question["type"] == "single_choice":
-        prompt = f"""Пользователь ответил на вопрос: "{question['question']}"
-        
-Его ответ: "{user_answer}"
+    Версия ищется без подстановки текущей: у старых результатов без версии
+    остаются сохраненные тексты, а не формулировки нынешнего опроса.
+    """
+    doc["answers"] = expand_answers(doc["answers"], survey_registry.find(doc.get("survey_version")))
+    return doc
 
-Доступные варианты ответов (с номерами):
-{options_text}
 
-Задача: определи, какой вариант ответа наиболее подходит к ответу пользователя.
-Учитывай:
-- Числовые ответы (1, 2, 3, "первое", "второе", "третий")
-- Ключевые слова из вариантов
-- Синонимы и похожие фразы
+def find_question(survey_version: Optional[str], question_id) -> Optional[CompiledQuestion]:
+    survey = survey_registry.find(survey_version)
+    return survey.question_for(question_id) if survey is not None else None
 
-Верни ТОЛЬКО код варианта (например: A1, B2, и т.д.), без дополнительного текста.
-Если ответ не подходит ни к одному варианту, верни "UNCLEAR"."""
 
-    else:  # multiple_choice
-        prompt = f"""Пользователь ответил на вопрос: "{question['question']}"
-        
-Его ответ: "{user_answer}"
+def expand_answer_rows(rows):
+    """Плоские строки ответов с текстами вопроса и вариантов (CSV, Parquet); сохраненные тексты не заменяются"""
+    for row in rows:
+        if row["question"] is not None or row["answer_texts"]:
+            yield row
+            continue
+        question = find_question(row["survey_version"], row["question_id"])
+        codes = row["answer_codes"].split(",") if row["answer_codes"] else []
+        row["question"] = question.question if question else None
+        row["answer_texts"] = ",".join(question.texts_for(codes)) if question else ""
+        yield row
+
 
-Доступные варианты ответов (с номерами):
-{options_text}
+def with_question_texts(hits: List[Dict]) -> List[Dict]:
+    for hit in hits:
+        if hit.get("question") is None:
+            question = find_question(hit["survey_version"], hit["question_id"])
+            hit["question"] = question.question if question else None
+    return hits
 
-Задача: определи, какие варианты ответов подходят к ответу пользователя.
-Учитывай:
-- Числовые ответы (1,2,3 или "первое и второе")
-- Ключевые слова из вариантов
-- Синонимы и похожие фразы
 
-Верни коды вариантов через запятую (например: C1,C3 или C1,C2,C5), без пробелов и дополнительного текста.
-Если ответ не подходит ни к одному варианту, верни "UNCLEAR"."""
+def recent_responses() -> List[Dict]:
+    return [
+        {**entry, "last_answer": entry["last_answer"].expand(survey_registry.find(entry["survey_version"]))}
+        for entry in live_stats.recent_responses()
+    ]
 
+
+def resolve_answer_locally(user_answer: str, question: CompiledQuestion, survey_version: str) -> Optional[List[str]]:
+    """Сопоставление без LLM: номера вариантов и лексическое совпадение"""
+    # проверяем числовые ответы и ключевые слова
+    numeric_result = check_numeric_answer(user_answer, question, survey_version)
+    if numeric_result:
+        match_tiers.record("numeric")
+        return numeric_result
+    
+    # уверенное лексическое совпадение с текстом варианта
+    local_result = local_matcher.match(user_answer, question, survey_version)
+    if local_result:
+        match_tiers.record("local")
+        return local_result.codes
+    return None
+
+
+async def match_answer_to_options(user_answer: str, question: CompiledQuestion, survey_version: str) -> List[str]:
+    """
+    Использование API для сопоставления ответа пользователя с вариантами
+    """
+    # числовые ответы и уверенные лексические совпадения - без API
+    with span("local_match"):
+        local_result = resolve_answer_locally(user_answer, question, survey_version)
+    if local_result:
+        return local_result
+    
+    # такой ответ на этот вопрос уже сопоставляли
+    with span("cache_lookup"):
+        cached = await match_cache.get(survey_version, question.id, user_answer)
+    if cached is not None:
+        match_tiers.record("cache")
+        return cached
+    
+    # upstream недоступен (автомат открыт) - только локальное сопоставление
+    if not llm.available:
+        match_tiers.record("degraded")
+        return []
+    
+    # статическая часть промпта построена при загрузке опроса, ответ - последним сообщением
+    prompt = match_prompts.for_question(question, survey_version)
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Ты помощник для анализа ответов в социологическом опросе. Твоя задача - точно сопоставить ответ пользователя с предложенными вариантами. Учитывай числовые ответы и ключевые слова."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=50
-        )
-        
-        result = response.choices[0].message.content.strip()
-        
-        if result == "UNCLEAR":
+        with span("llm_match"):
+            result = await llm.complete(
+                prompt.messages(user_answer),
+                temperature=0.3,
+                max_tokens=prompt.max_tokens,
+                response_format=prompt.response_format,
+                kind="match"
+            )
+        matched = prompt.parse(result)
+        if not matched:
+            match_tiers.record("unclear")
             return []
         
-        if question["type"] == "single_choice":
-            return [result] if result in [opt["code"] for opt in question["options"]] else []
-        else:
-            codes = result.split(",")
-            valid_codes = [opt["code"] for opt in question["options"]]
-            return [code.strip() for code in codes if code.strip() in valid_codes]
+        await match_cache.put(survey_version, question.id, user_answer, matched)
+        match_tiers.record("llm")
+        return matched
     
     except Exception as e:
+        # сбой или отказ LLM (повторы уже исчерпаны) - ответ не распознан без API
+        match_tiers.record("degraded")
         print(f"Error matching answer: {e}")
         return []
 
 
-def check_numeric_answer(user_answer: str, question: Dict) -> List[str]:
+def check_numeric_answer(user_answer: str, question: CompiledQuestion, survey_version: Optional[str] = None) -> List[str]:
     """
-    Проверяем числовые ответы и ключевые слова для выбора вариантов
+    Номера, порядковые, диапазоны, "все кроме ..." и количества - разбором по правилам вопроса
     """
-    answer_lower = user_answer.lower().strip()
-    
-    # числовые ответы
-    import re
-    
-    # ищем числа в ответе
-    numbers = re.findall(r'\d+', answer_lower)
-    
-    if numbers:
-        selected_codes = []
-        for num_str in numbers:
-            try:
-                num = int(num_str)
-                if 1 <= num <= len(question["options"]):
-                    selected_codes.append(question["options"][num - 1]["code"])
-            except (ValueError, IndexError):
-                continue
-        
-        if selected_codes:
-            return selected_codes
-    
-    # проверка ключевого слова
-    ordinal_words = {
-        "первое": 1, "первый": 1, "первая": 1, "первое": 1,
-        "второе": 2, "второй": 2, "вторая": 2, "второе": 2,
-        "третье": 3, "третий": 3, "третья": 3, "третье": 3,
-        "четвертое": 4, "четвертый": 4, "четвертая": 4, "четвертое": 4,
-        "пятое": 5, "пятый": 5, "пятая": 5, "пятое": 5,
-        "последнее": -1, "последний": -1, "последняя": -1, "последнее": -1
-    }
-    
-    for word, index in ordinal_words.items():
-        if word in answer_lower:
-            if index == -1:  # последнее
-                selected_codes = [question["options"][-1]["code"]]
-            else:
-                if 1 <= index <= len(question["options"]):
-                    selected_codes = [question["options"][index - 1]["code"]]
-                else:
-                    continue
-            
-            # для multiple_choice проверяем, есть ли еще числа
-            if question["type"] == "multiple_choice":
-                # другие числа в ответе
-                other_numbers = re.findall(r'\d+', answer_lower.replace(word, ""))
-                for num_str in other_numbers:
-                    try:
-                        num = int(num_str)
-                        if 1 <= num <= len(question["options"]):
-                            code = question["options"][num - 1]["code"]
-                            if code not in selected_codes:
-                                selected_codes.append(code)
-                    except (ValueError, IndexError):
-                        continue
-            
-            return selected_codes
+    result = answer_parser.parse(user_answer, question, survey_version or survey_registry.current.version)
+    return result.codes if result else []
+
+
+ACK_FALLBACK = "Спасибо за ответ!"
+
+# благодарность с такими словами заменяется на стандартную
+UNWANTED_ACK_PHRASES = [
+    "следующий вопрос", "следующий", "теперь", "давайте", "перейдем",
+    "привет", "здравствуйте", "добро пожаловать", "начнем",
+    "?", "вопрос", "спросить", "расскажите", "какой", "как", "что"
+]
+
+
+# все фразы одним выражением: один проход по тексту вместо проверки каждой фразы
+UNWANTED_ACK_RE = re.compile("|".join(re.escape(phrase) for phrase in UNWANTED_ACK_PHRASES))
+
+
+def is_clean_acknowledgement(text: str) -> bool:
+    return UNWANTED_ACK_RE.search(text.lower()) is None
+
+
+async def generate_bot_response(user_message: str) -> str:
+    """Генерация благодарности за ответ с использованием API"""
+    try:
+        with span("acknowledgement"):
+            bot_response = await llm.complete(
+                acknowledgement_messages(user_message),
+                temperature=0.3,
+                max_tokens=50,
+                kind="ack"
+            )
+        return bot_response if is_clean_acknowledgement(bot_response) else ACK_FALLBACK
     
-    return []
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        return ACK_FALLBACK
 
 
-def generate_bot_response(session: Dict, user_message: str) -> str:
-    """Генерация ответа бота с использованием API"""
-    current_question = get_current_question(session)
+def stream_bot_response(user_message: str):
+    """Благодарность потоком фрагментов (проверка фраз - у вызывающего, по полному тексту)"""
+    return llm.stream(acknowledgement_messages(user_message), temperature=0.3, max_tokens=50, kind="ack")
+
+
+def unclear_answer_message(question: CompiledQuestion) -> str:
+    options_text = "\n".join([f"- {opt.text}" for opt in question.options])
+    return f"Ваш ответ не понятен. Пожалуйста, выберите из следующих вариантов:\n\n{options_text}"
+
+
+def completion_message(session: Session) -> str:
+    return f"Спасибо за участие в опросе! Ваши ответы сохранены. \n\nВсего вопросов: {len(session.answers)}"
+
+
+async def record_answer(session: Session, question: CompiledQuestion, matched_codes: List[str], original_answer: str):
+    """Сохранить распознанный ответ и перейти дальше; возвращает следующий вопрос или None, если опрос окончен"""
+    answer_record = AnswerRecord(question.id, matched_codes, original_answer)
+    session.answers.append(answer_record)
     
-    if not current_question:
-        return "Спасибо за участие в опросе! Ваши ответы сохранены."
+    # идет к следующему вопросу
+    session.current_question_index += 1
+    # флаг нужен индексу незавершенных сессий в хранилище
+    session.completed = is_session_completed(session)
+    with span("persist_session"):
+        await session_store.save(session)
+    live_stats.answer_recorded(session, answer_record)
+    live_search.add(session.id, len(session.answers) - 1, session.started_at, session.survey_version, answer_record)
+    admin_events.publish("answer_recorded", {
+        "session_id": session.id,
+        "answer": answer_record.expand(survey_registry.find(session.survey_version))
+    })
+    next_question = get_current_question(session)
     
-    # контекст для GPT
-    options_text = ""
-    for opt in current_question["options"]:
-        options_text += f"- {opt['text']}\n"
-    options_text = options_text.strip()
-        
-    prompt = f"""Ты - дружелюбный ассистент, который проводит социологический опрос.
+    if next_question is None:
+        # опрос окончен
+        with span("persist_result"):
+            await save_survey_result(session.id, session.answers, session.survey_version)
+        live_stats.session_completed(session)
+        admin_events.publish("survey_completed", {"session_id": session.id, "answers_count": len(session.answers)})
+    
+    return next_question
 
-Пользователь только что ответил: "{user_message}"
 
-Твоя задача:
-1. Поблагодари пользователя за ответ кратко и естественно
-2. НЕ задавай никаких вопросов - вопросы задает система автоматически
-3. НЕ приветствуй - это уже сделано в начале опроса
-4. Будь дружелюбным и лаконичным
+@app.on_event("startup")
+async def migrate_legacy_results():
+    # одноразовый перенос старых results/*.json в хранилище
+    imported = await asyncio.to_thread(results_store.migrate_json_dir, "results")
+    if imported:
+        print(f"Imported {imported} legacy result files")
 
-Ответь пользователю ТОЛЬКО благодарностью (1 предложение максимум):"""
 
-    try:
-        response = client.chat.completions.create(
-             model="gpt-4o-mini",
-             messages=[
-                 {"role": "system", "content": "Ты дружелюбный ассистент для проведения опросов. Твоя ЕДИНСТВЕННАЯ задача - благодарить пользователя за ответы. НЕ задавай вопросы, НЕ приветствуй, НЕ спрашивай следующий вопрос. Только благодарность."},
-                 {"role": "user", "content": prompt}
-             ],
-             temperature=0.3,
-             max_tokens=50
-         )
-        
-        bot_response = response.choices[0].message.content.strip()
+@app.on_event("startup")
+async def build_search_index():
+    # ответы, сохраненные до появления полнотекстового индекса
+    indexed = await asyncio.to_thread(results_store.build_search_index)
+    if indexed:
+        print(f"Indexed {indexed} stored answers for search")
 
-        unwanted_phrases = [
-            "следующий вопрос", "следующий", "теперь", "давайте", "перейдем",
-            "привет", "здравствуйте", "добро пожаловать", "начнем",
-            "?", "вопрос", "спросить", "расскажите", "какой", "как", "что"
-        ]
-        
-        for phrase in unwanted_phrases:
-            if phrase in bot_response.lower():
-                return "Спасибо за ответ!"
-        
-        return bot_response
+
+@app.on_event("startup")
+async def start_result_writer():
+    result_writer.start()
+
+
+@app.on_event("startup")
+async def warm_analytics():
+    # первая загрузка колонок текущей версии в фоне, чтобы первый запрос админки не ждал
+    asyncio.create_task(asyncio.to_thread(analytics.refresh, survey_registry.current))
+
+
+@app.on_event("startup")
+async def restore_live_stats():
+    # один проход по сохраненным сессиям (SQLite/Redis переживают перезапуск)
+    existing = [session async for session in session_store.iter_sessions()]
+    existing.sort(key=lambda s: s.updated_at)
+    for session in existing:
+        completed = is_session_completed(session)
+        live_stats.restore(session, completed=completed)
+        if not completed:
+            for position, answer in enumerate(session.answers):
+                live_search.add(session.id, position, session.started_at, session.survey_version, answer)
+
+
+def session_evicted(session_id: str):
+    live_stats.session_evicted(session_id)
+    live_search.discard([session_id])
+
+
+async def sweep_sessions_periodically():
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        try:
+            await session_store.sweep()
+        except Exception as e:
+            print(f"Error sweeping expired sessions: {e}")
+
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    if SESSION_SWEEP_INTERVAL > 0:
+        asyncio.create_task(sweep_sessions_periodically())
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await llm.aclose()
+    match_cache.close()
+    await session_store.close()
+    # дописываем очередь результатов до закрытия базы
+    await result_writer.close()
+    results_store.close()
+    await admin_events.close()
+
+
+# пакетная классификация ответов, собранных вне чата
+bulk_jobs = BulkJobManager(
+    BulkClassifier(llm, resolve_answer_locally, match_cache),
+    save_session=save_survey_result
+)
+
+
+# снаружи допуска и CORS: в гистограмму попадают и ожидание места, и ответы 503
+app.add_middleware(RequestInstrumentation, histogram=HTTP_REQUEST_DURATION, profiler=slow_request_profiler)
+
+
+async def classify_chat_request(scope) -> Optional[str]:
+    """Класс запроса для допуска: ход начатого опроса, новая сессия или без ограничений.
     
-    except Exception as e:
-        print(f"Error generating response: {e}")
-        return "Спасибо за ответ!"
+    Только по методу и пути, без чтения хранилища: запрос, которому откажут с 503,
+    не должен нагружать SQLite/Redis.
+    """
+    if scope["method"] != "POST":
+        return None
+    path = scope["path"]
+    if path.startswith("/chat/message"):
+        return TURN
+    if path == "/chat/start":
+        return START
+    if path.startswith("/chat/start/"):
+        # страница чата открывает сессию, уже созданную через /chat/start, - как ход
+        return TURN
+    return None
 
 
 # Endpoints for users
@@ -313,29 +570,36 @@ async def root():
     return {"message": "API is running"}
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.post("/chat/start")
 async def start_chat():
     """Новая сессия опроса"""
     session_id = str(uuid.uuid4())
     
-    sessions[session_id] = {
-        "current_question_index": 0,
-        "answers": [],
-        "started_at": datetime.now().isoformat()
-    }
+    session = new_session(session_id)
+    await session_store.save(session)
+    live_stats.session_started(session)
+    admin_events.publish("session_started", {"session_id": session.id, "started_at": session.started_at})
     
-    first_question = get_current_question(sessions[session_id])
+    first_question = get_current_question(session)
     
     welcome_message = f"""Добрый день! Я бот для проведения социологического опроса. 
     
 Сейчас я задам вам несколько вопросов. Вы можете отвечать своими словами, а я постараюсь понять ваш ответ.
 
-Начнем! {first_question['question']}"""
+Начнем! {first_question.question}"""
     
     return ChatResponse(
         session_id=session_id,
         message=welcome_message,
-        current_question=first_question,
+        current_question=first_question.to_dict(),
         is_completed=False
     )
 
@@ -345,30 +609,30 @@ async def start_chat_with_session(session_id: str):
     """Начать сессию с конкретным ID"""
     
     # проверяем, существует ли уже сессия
-    if session_id in sessions:
-        session = sessions[session_id]
+    session = await session_store.get(session_id)
+    if session:
         current_question = get_current_question(session)
         
         if current_question:
             # если это первый вопрос (индекс 0), показываем приветствие
-            if session.get("current_question_index", 0) == 0:
+            if session.current_question_index == 0:
                 welcome_message = f"""Добрый день! Я бот для проведения социологического опроса. 
                 
 Сейчас я задам вам несколько вопросов. Вы можете отвечать своими словами, а я постараюсь понять ваш ответ.
 
-Начнем! {current_question['question']}"""
+Начнем! {current_question.question}"""
                 
                 return ChatResponse(
                     session_id=session_id,
                     message=welcome_message,
-                    current_question=current_question,
+                    current_question=current_question.to_dict(),
                     is_completed=False
                 )
             else:
                 return ChatResponse(
                     session_id=session_id,
-                    message=f"Продолжаем опрос! {current_question['question']}",
-                    current_question=current_question,
+                    message=f"Продолжаем опрос! {current_question.question}",
+                    current_question=current_question.to_dict(),
                     is_completed=False
                 )
         else:
@@ -380,98 +644,254 @@ async def start_chat_with_session(session_id: str):
             )
     
     # Создаем новую сессию с указанным ID
-    sessions[session_id] = {
-        "current_question_index": 0,
-        "answers": [],
-        "started_at": datetime.now().isoformat()
-    }
+    session = new_session(session_id)
+    await session_store.save(session)
+    live_stats.session_started(session)
+    admin_events.publish("session_started", {"session_id": session.id, "started_at": session.started_at})
     
-    first_question = get_current_question(sessions[session_id])
+    first_question = get_current_question(session)
     
     welcome_message = f"""Добрый день! Я бот для проведения социологического опроса. 
     
 Сейчас я задам вам несколько вопросов. Вы можете отвечать своими словами, а я постараюсь понять ваш ответ.
 
-Начнем! {first_question['question']}"""
+Начнем! {first_question.question}"""
     
     return ChatResponse(
         session_id=session_id,
         message=welcome_message,
-        current_question=first_question,
+        current_question=first_question.to_dict(),
         is_completed=False
     )
 
 
 @app.post("/chat/message", response_model=ChatResponse)
-async def send_message(chat_message: ChatMessage):
-    """Обработка сообщения пользователя"""
+async def send_message(chat_message: ChatMessage, response: Response):
+    """Обработка сообщения пользователя.
     
-    if not chat_message.session_id or chat_message.session_id not in sessions:
+    С turn_id повтор того же сообщения возвращает сохраненный ответ вместо новой обработки.
+    """
+    if not chat_message.session_id:
         raise HTTPException(status_code=404, detail="Session is not found. Please start a new chat.")
     
-    session = sessions[chat_message.session_id]
+    async def process():
+        # сессия читается под блокировкой сессии: предыдущий ход уже сохранен
+        session = await session_store.get(chat_message.session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session is not found. Please start a new chat.")
+        return await process_message(session, chat_message.message, response)
+    
+    try:
+        chat_response, replayed = await turn_gate.run(
+            chat_message.session_id, chat_message.turn_id, chat_message.message, process
+        )
+    except TurnConflict:
+        raise HTTPException(status_code=409, detail="Turn id was already used with a different message")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return chat_response
+
+
+async def process_message(session: Session, message: str, response: Response) -> ChatResponse:
+    survey = survey_registry.get(session.survey_version)
     current_question = get_current_question(session)
     
     if not current_question:
         raise HTTPException(status_code=400, detail="Survey already completed")
     
-    # сопоставить ответ пользователя с вариантами
-    matched_codes = match_answer_to_options(chat_message.message, current_question)
+    # благодарность нужна, только если после этого вопроса будет следующий
+    has_next = current_question.index + 1 < len(survey)
+    ack_mode = survey.settings.get("ack_mode", ACK_MODE)
+    acknowledge = None
+    # без доступного LLM - шаблонная благодарность
+    if has_next and ack_mode == ACK_MODE_LLM and llm.available:
+        acknowledge = lambda: generate_bot_response(message)
+    
+    # сопоставление ответа и благодарность выполняются параллельно
+    usage = track_usage()
+    turn = await run_turn(
+        lambda: match_answer_to_options(message, current_question, survey.version),
+        acknowledge
+    )
+    turn_latency.record(turn.timings)
+    record_turn_usage(usage)
+    response.headers["Server-Timing"] = turn.server_timing()
+    matched_codes = turn.matched_codes
     
     if not matched_codes:
         # если не удалось сопоставить, просим уточнить
-        options_text = "\n".join([f"- {opt['text']}" for opt in current_question["options"]])
         return ChatResponse(
-            session_id=chat_message.session_id,
-            message=f"Ваш ответ не понятен. Пожалуйста, выберите из следующих вариантов:\n\n{options_text}",
-            current_question=current_question,
+            session_id=session.id,
+            message=unclear_answer_message(current_question),
+            current_question=current_question.to_dict(),
             is_completed=False
         )
     
-    # получаем текст выбранных ответов
-    selected_texts = []
-    for code in matched_codes:
-        for option in current_question["options"]:
-            if option["code"] == code:
-                selected_texts.append(option["text"])
-                break
-    
-    answer_record = {
-        "question_id": current_question["id"],
-        "question": current_question["question"],
-        "answer_codes": matched_codes,
-        "answer_texts": selected_texts,
-        "original_answer": chat_message.message
-    }
-    session["answers"].append(answer_record)
-    
-    # идет к следующему вопросу
-    session["current_question_index"] += 1
-    next_question = get_current_question(session)
+    next_question = await record_answer(session, current_question, matched_codes, message)
     
     if next_question:
         # еще не закончился опрос
-        bot_response = generate_bot_response(session, chat_message.message)
-        full_message = f"{bot_response}\n\n{next_question['question']}"
+        bot_response = turn.acknowledgement or template_acknowledgement(message)
+        full_message = f"{bot_response}\n\n{next_question.question}"
         
         return ChatResponse(
-            session_id=chat_message.session_id,
+            session_id=session.id,
             message=full_message,
-            current_question=next_question,
+            current_question=next_question.to_dict(),
             is_completed=False
         )
     else:
-        # опрос окончен
-        filename = save_survey_result(chat_message.session_id, session["answers"])
-        
         return ChatResponse(
-            session_id=chat_message.session_id,
-            message=f"Спасибо за участие в опросе! Ваши ответы сохранены. \n\nВсего вопросов: {len(session['answers'])}",
+            session_id=session.id,
+            message=completion_message(session),
             current_question=None,
             is_completed=True
         )
 
 
+def record_turn_usage(usage: Dict[str, int]):
+    turn_tokens.record(usage)
+    for direction, tokens in usage.items():
+        TURN_TOKENS.observe(tokens, direction=direction)
+
+
+def ndjson_event(event_type: str, **data) -> str:
+    return json.dumps({"type": event_type, **data}, ensure_ascii=False) + "\n"
+
+
+@app.post("/chat/message/stream")
+async def send_message_stream(chat_message: ChatMessage):
+    """Обработка сообщения с ответом потоком NDJSON.
+    
+    События по мере готовности: match (ответ распознан и сохранен), ack_delta
+    (фрагменты благодарности), ack (итоговый текст благодарности), затем
+    question или completed; unclear - ответ не распознан. Последнее событие - done.
+    С turn_id повтор того же сообщения получает события исходного хода (без ack_delta).
+    """
+    session = await session_store.get(chat_message.session_id) if chat_message.session_id else None
+    if not session:
+        raise HTTPException(status_code=404, detail="Session is not found. Please start a new chat.")
+    
+    turn_id = f"stream:{chat_message.turn_id}" if chat_message.turn_id else None
+    message = chat_message.message
+    replay = turn_replay(session.id, turn_id, message)
+    if replay is not None:
+        return StreamingResponse(iter(replay), media_type="application/x-ndjson", headers={"Idempotent-Replayed": "true"})
+    
+    if not get_current_question(session):
+        raise HTTPException(status_code=400, detail="Survey already completed")
+    
+    async def events():
+        async with turn_gate.session_lock(session.id):
+            # дубликат, ждавший блокировку, получает события уже выполненного хода
+            replay = turn_replay(session.id, turn_id, message)
+            if replay is not None:
+                for line in replay:
+                    yield line
+                return
+            current = await session_store.get(session.id)
+            current_question = get_current_question(current) if current else None
+            if current_question is None:
+                yield ndjson_event("error", detail="Survey already completed")
+                return
+            async for line in stream_turn(current, current_question, message, turn_id):
+                yield line
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+def turn_replay(session_id: str, turn_id: Optional[str], message: str) -> Optional[List[str]]:
+    if turn_id is None:
+        return None
+    try:
+        return turn_gate.lookup(session_id, turn_id, message)
+    except TurnConflict:
+        raise HTTPException(status_code=409, detail="Turn id was already used with a different message")
+
+
+async def stream_turn(session: Session, current_question: CompiledQuestion, message: str, turn_id: Optional[str]):
+    survey = survey_registry.get(session.survey_version)
+    has_next = current_question.index + 1 < len(survey)
+    ack_mode = survey.settings.get("ack_mode", ACK_MODE)
+    # благодарность начинает генерироваться одновременно с сопоставлением
+    usage = track_usage()
+    ack_stream = None
+    if has_next and ack_mode == ACK_MODE_LLM and llm.available:
+        ack_stream = PrefetchedStream(stream_bot_response(message))
+    
+    # события хода для повтора по turn_id (фрагменты благодарности не нужны)
+    replay: List[str] = []
+    
+    def emit(event_type: str, **data) -> str:
+        line = ndjson_event(event_type, **data)
+        if event_type != "ack_delta":
+            replay.append(line)
+        return line
+    
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    try:
+        with timed(timings, "total"):
+            with timed(timings, "match"):
+                matched_codes = await match_answer_to_options(message, current_question, survey.version)
+            
+            if not matched_codes:
+                yield emit(
+                    "unclear",
+                    message=unclear_answer_message(current_question),
+                    current_question=current_question.to_dict()
+                )
+            else:
+                next_question = await record_answer(session, current_question, matched_codes, message)
+                match_event = emit("match", matched_codes=matched_codes, answer_texts=current_question.texts_for(matched_codes))
+                if next_question is None:
+                    final_events = [ndjson_event("completed", message=completion_message(session))]
+                else:
+                    final_events = [
+                        ndjson_event("ack", text=template_acknowledgement(message)),
+                        ndjson_event("question", message=next_question.question, current_question=next_question.to_dict())
+                    ]
+                if turn_id is not None:
+                    # ответ уже записан: даже при обрыве потока повтор не запишет его второй раз
+                    turn_gate.remember(session.id, turn_id, message, [match_event, *final_events, ndjson_event("done")])
+                yield match_event
+                
+                if next_question is None:
+                    yield emit("completed", message=completion_message(session))
+                else:
+                    acknowledgement = None
+                    if ack_stream is not None:
+                        parts = []
+                        try:
+                            with span("acknowledgement"), timed(timings, "ack"):
+                                async for delta in ack_stream:
+                                    if not parts:
+                                        timings["first_token"] = (time.perf_counter() - started) * 1000
+                                    parts.append(delta)
+                                    yield emit("ack_delta", text=delta)
+                            acknowledgement = "".join(parts).strip()
+                            if acknowledgement and not is_clean_acknowledgement(acknowledgement):
+                                acknowledgement = ACK_FALLBACK
+                        except Exception as e:
+                            print(f"Error streaming response: {e}")
+                            acknowledgement = ACK_FALLBACK
+                    # итоговый текст заменяет показанные фрагменты
+                    yield emit("ack", text=acknowledgement or template_acknowledgement(message))
+                    yield emit(
+                        "question",
+                        message=next_question.question,
+                        current_question=next_question.to_dict()
+                    )
+        yield emit("done", timings={stage: round(ms, 1) for stage, ms in timings.items()}, tokens=usage)
+        turn_latency.record(timings)
+        record_turn_usage(usage)
+        if turn_id is not None:
+            turn_gate.remember(session.id, turn_id, message, replay)
+    finally:
+        if ack_stream is not None:
+            ack_stream.cancel()
+
+
 @app.get("/survey/questions")
 async def get_questions():
     """Получить все вопросы опроса"""
@@ -493,131 +913,430 @@ async def admin_login(login_data: LoginRequest):
 @app.get("/admin/stats")
 async def get_admin_stats(token: str = Depends(verify_admin_token)):
     """Статистика для админ панели"""
-    total_sessions = len(sessions)
-    completed_surveys = len([s for s in sessions.values() if s.get("current_question_index", 0) >= len(load_survey_questions())])
-    active_sessions = total_sessions - completed_surveys
-    
-    # получаем последние ответы
-    recent_responses = []
-    for session_id, session_data in sessions.items():
-        if session_data.get("answers"):
-            recent_responses.append({
-                "session_id": session_id,
-                "started_at": session_data.get("started_at"),
-                "answers_count": len(session_data["answers"]),
-                "last_answer": session_data["answers"][-1] if session_data["answers"] else None
-            })
-    
-    # сортировка по времени начала
-    recent_responses.sort(key=lambda x: x["started_at"], reverse=True)
-    
     return AdminStats(
-        total_sessions=total_sessions,
-        completed_surveys=completed_surveys,
-        active_sessions=active_sessions,
-        recent_responses=recent_responses[:10]  # ласт 10
+        total_sessions=live_stats.total_sessions,
+        completed_surveys=live_stats.completed_surveys,
+        active_sessions=live_stats.active_sessions,
+        recent_responses=recent_responses()  # ласт 10
     )
 
 
-@app.get("/admin/responses")
-async def get_all_responses(token: str = Depends(verify_admin_token)):
-    """получить все ответы пользователей"""
-    all_responses = []
-    
-    # читаем сохраненные результаты
-    results_dir = "results"
-    if os.path.exists(results_dir):
-        for filename in os.listdir(results_dir):
-            if filename.startswith("survey_") and filename.endswith(".json"):
-                filepath = os.path.join(results_dir, filename)
+@app.get("/admin/events")
+async def admin_event_stream(request: Request, token: str):
+    """Server-Sent Events для админ панели: снимок счетчиков и пачки событий.
+    
+    EventSource не умеет передавать заголовки, поэтому токен идет в query.
+    """
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid admin token")
+    
+    subscription = admin_events.subscribe()
+    
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
                 try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        all_responses.append(data)
-                except Exception as e:
-                    print(f"Error reading {filename}: {e}")
-    
-    # добавляем активные сессии
-    for session_id, session_data in sessions.items():
-        if session_data.get("answers"):
-            # обрабатываем ответы для активных сессий
-            processed_answers = []
-            for answer in session_data["answers"]:
-                processed_answer = answer.copy()
-                # если нет answer_texts, добавляем их
-                if "answer_texts" not in processed_answer:
-                    questions = load_survey_questions()
-                    question = next((q for q in questions if q["id"] == answer["question_id"]), None)
-                    if question:
-                        selected_texts = []
-                        for code in answer["answer_codes"]:
-                            for option in question["options"]:
-                                if option["code"] == code:
-                                    selected_texts.append(option["text"])
-                                    break
-                        processed_answer["answer_texts"] = selected_texts
-                processed_answers.append(processed_answer)
-            
-            all_responses.append({
-                "session_id": session_id,
-                "timestamp": session_data.get("started_at"),
-                "answers": processed_answers,
-                "status": "completed" if session_data.get("current_question_index", 0) >= len(load_survey_questions()) else "in_progress"
-            })
+                    yield await asyncio.wait_for(subscription.queue.get(), timeout=ADMIN_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # комментарий держит соединение через прокси
+                    yield ": keepalive\n\n"
+        finally:
+            admin_events.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/admin/stats/distribution")
+async def get_answer_distribution(
+    survey_version: Optional[str] = None,
+    token: str = Depends(verify_admin_token)
+):
+    """Распределение ответов по вариантам для каждого вопроса текущей или указанной версии опроса"""
+    survey = analytics_survey(survey_version)
+    tallies = live_stats.tallies(survey.version)
+    distribution = []
+    for question in survey.questions:
+        counts = tallies.get(question.id, {})
+        distribution.append({
+            "question_id": question.id,
+            "question": question.question,
+            "total": sum(counts.values()),
+            "options": [
+                {"code": opt.code, "text": opt.text, "count": counts.get(opt.code, 0)}
+                for opt in question.options
+            ]
+        })
+    return {"survey_version": survey.version, "questions": distribution}
+
+
+def analytics_survey(survey_version: Optional[str]):
+    try:
+        return survey_registry.get(survey_version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Version not found")
+
+
+def analytics_segment(since: Optional[str], until: Optional[str], filters: Optional[List[str]]):
+    try:
+        return parse_segment(since, until, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/admin/analytics/distribution")
+async def get_analytics_distribution(
+    survey_version: Optional[str] = None,
+    question_id: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    filter: Optional[List[str]] = Query(None),
+    token: str = Depends(verify_admin_token)
+):
+    """Распределение вариантов по сохраненным результатам версии.
+    
+    Сегмент: since/until и filter=question_id:code1,code2 (можно несколько, условия через И).
+    """
+    survey = analytics_survey(survey_version)
+    segment = analytics_segment(since, until, filter)
+    try:
+        return await asyncio.to_thread(analytics.distribution, survey, segment, question_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Question not found")
+
+
+@app.get("/admin/analytics/crosstab")
+async def get_analytics_crosstab(
+    row: str,
+    column: str,
+    survey_version: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    filter: Optional[List[str]] = Query(None),
+    token: str = Depends(verify_admin_token)
+):
+    """Кросс-таблица двух вопросов (row и column - id вопросов) по сохраненным результатам"""
+    survey = analytics_survey(survey_version)
+    segment = analytics_segment(since, until, filter)
+    try:
+        return await asyncio.to_thread(analytics.crosstab, survey, row, column, segment)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Question not found")
+
+
+@app.get("/admin/analytics/funnel")
+async def get_analytics_funnel(
+    survey_version: Optional[str] = None,
+    include_in_progress: bool = True,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    filter: Optional[List[str]] = Query(None),
+    token: str = Depends(verify_admin_token)
+):
+    """Воронка по вопросам: сколько ответили на каждый вопрос и где остановились незавершенные сессии"""
+    survey = analytics_survey(survey_version)
+    segment = analytics_segment(since, until, filter)
+    in_progress = None
+    if include_in_progress:
+        # незавершенных сессий немного (ограничены TTL), их кадр строится на каждый запрос
+        sessions = [
+            (session.started_at, session.answers)
+            async for session in session_store.iter_sessions()
+            if session.survey_version == survey.version and session.answers and not is_session_completed(session)
+        ]
+        in_progress = ResultFrame.from_answers(survey, sessions)
+    return await asyncio.to_thread(analytics.funnel, survey, segment, in_progress)
+
+
+@app.get("/admin/analytics/status")
+async def get_analytics_status(token: str = Depends(verify_admin_token)):
+    """Загруженные кадры (респонденты, метка данных) и попадания кеша аналитики"""
+    return analytics.stats()
+
+
+RESPONSE_STATUSES = ("all", "completed", "in_progress")
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(timestamp), str(session_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def session_matches_filters(session: Session, since, until, survey_version, question_id, answer_code) -> bool:
+    if survey_version and session.survey_version != survey_version:
+        return False
+    if (since and session.started_at < since) or (until and session.started_at >= until):
+        return False
+    return answers_match(session.answers, question_id, answer_code)
+
+
+def answers_match(answers: List[AnswerRecord], question_id, answer_code) -> bool:
+    """Есть ответ на question_id с кодом answer_code (None - любой), как EXISTS в results_store.query_results"""
+    if question_id is None and answer_code is None:
+        return True
+    return any(
+        (question_id is None or str(answer.question_id) == question_id)
+        and (answer_code is None or answer_code in answer.codes)
+        for answer in answers
+    )
+
+
+def query_queued(limit, after, newest_first, since, until, survey_version, question_id, answer_code) -> List[Dict]:
+    """Завершенные опросы из очереди фоновой записи: в базе их еще нет, а сессии уже не незавершенные"""
+    page = []
+    for record in queued_results(since, until, survey_version):
+        key = (record.timestamp, record.session_id)
+        if after and not (key < after if newest_first else key > after):
+            continue
+        if answers_match(record.answers, question_id, answer_code):
+            page.append(result_document(record))
+    page.sort(key=lambda x: (x["timestamp"], x["session_id"]), reverse=newest_first)
+    return page[:limit]
+
+
+async def query_in_progress(limit, after, newest_first, since, until, survey_version, question_id, answer_code):
+    """Незавершенные сессии с ответами по индексу хранилища: чтение останавливается на limit совпадениях"""
+    page = []
+    async for session in session_store.iter_in_progress(after, newest_first, since, until):
+        # сессии, сохраненные до флага completed, проверяются по длине опроса
+        if is_session_completed(session):
+            continue
+        if session_matches_filters(session, since, until, survey_version, question_id, answer_code):
+            page.append(session)
+            if len(page) >= limit:
+                break
+    return [
+        expand_document({
+            "session_id": session.id,
+            "timestamp": session.started_at,
+            "answers": session.answers,
+            "status": "in_progress",
+            "survey_version": session.survey_version
+        })
+        for session in page
+    ]
+
+
+@app.get("/admin/responses")
+async def get_all_responses(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    status: str = "all",
+    order: str = "desc",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    question_id: Optional[str] = None,
+    answer_code: Optional[str] = None,
+    survey_version: Optional[str] = None,
+    token: str = Depends(verify_admin_token)
+):
+    """Страница ответов пользователей.
     
-    # сорт по времени
-    all_responses.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+    Сортировка по времени (order=desc|asc), фильтры по статусу, датам, вопросу,
+    коду ответа и версии опроса. Следующая страница - ?cursor=<next_cursor>.
+    """
+    if status not in RESPONSE_STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    if order not in ("desc", "asc"):
+        raise HTTPException(status_code=400, detail="Invalid order")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    newest_first = order == "desc"
+    after = decode_cursor(cursor) if cursor else None
+    filters = (since, until, survey_version, question_id, answer_code)
     
-    return {"responses": all_responses}
+    # берем по limit + 1 из каждого источника: лишняя запись говорит, что есть следующая страница
+    page = []
+    if status in ("all", "completed"):
+        # очередь читается до базы: что записалось между ними, встретится дважды - оставляем копию из базы
+        queued = query_queued(limit + 1, after, newest_first, *filters)
+        completed = await asyncio.to_thread(
+            results_store.query_results,
+            limit + 1, after, newest_first, since, until, survey_version, question_id, answer_code
+        )
+        saved = {(result["timestamp"], result["session_id"]) for result in completed}
+        completed.extend(doc for doc in queued if (doc["timestamp"], doc["session_id"]) not in saved)
+        for result in completed:
+            result["status"] = "completed"
+        page.extend(completed)
+    if status in ("all", "in_progress"):
+        page.extend(await query_in_progress(limit + 1, after, newest_first, *filters))
+    
+    page.sort(key=lambda x: (x["timestamp"], x["session_id"]), reverse=newest_first)
+    has_more = len(page) > limit
+    page = page[:limit]
+    next_cursor = encode_cursor((page[-1]["timestamp"], page[-1]["session_id"])) if has_more else None
+    for result in page:
+        if result["status"] == "completed":
+            expand_document(result)
+    
+    return {"responses": page, "next_cursor": next_cursor}
+
+
+def decode_search_cursor(cursor: str):
+    try:
+        score, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(score), int(rowid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/admin/search")
+async def search_answers(
+    q: str,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    question_id: Optional[str] = None,
+    answer_code: Optional[str] = None,
+    survey_version: Optional[str] = None,
+    include_in_progress: bool = True,
+    token: str = Depends(verify_admin_token)
+):
+    """Поиск по исходным ответам: слова, "фразы" и префиксы (кош*), лучшие совпадения первыми.
+    
+    hits - сохраненные результаты постранично (?cursor=<next_cursor>), in_progress -
+    совпадения в незавершенных сессиях (только на первой странице).
+    """
+    try:
+        terms = parse_query(q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_search_cursor(cursor) if cursor else None
+    
+    hits = await asyncio.to_thread(
+        results_store.search_answers,
+        fts_query(terms), limit + 1, after, question_id, answer_code, survey_version
+    )
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    next_cursor = encode_cursor(hits[-1]["key"]) if has_more else None
+    for hit in hits:
+        del hit["key"]
+        hit["status"] = "completed"
+    
+    in_progress = []
+    if include_in_progress and after is None:
+        in_progress = live_search.search(terms, limit, question_id, answer_code, survey_version)
+    
+    return {"hits": with_question_texts(hits), "next_cursor": next_cursor, "in_progress": with_question_texts(in_progress)}
 
 
 @app.post("/admin/survey/upload")
 async def upload_survey(survey_data: SurveyUpload, token: str = Depends(verify_admin_token)):
     """Загрузить новый опрос с сохранением предыдущей версии"""
     try:
-        # валидация общего формата
-        for question in survey_data.questions:
-            if not all(key in question for key in ["id", "question", "type", "options"]):
-                raise HTTPException(status_code=400, detail="Invalid question structure")
-            
-            if question["type"] not in ["single_choice", "multiple_choice"]:
-                raise HTTPException(status_code=400, detail="Invalid question type")
+        # валидация общего формата (компиляция без публикации)
+        try:
+            compile_survey(survey_data.questions, settings=survey_data.settings)
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=str(e) or "Invalid question structure")
         
-        # сохраняем текущий опрос как версию
-        current_survey_path = "survey_questions.json"
-        previous_version_saved = False
+        settings = survey_data.settings or {}
+        if settings.get("ack_mode", ACK_MODE) not in ACK_MODES:
+            raise HTTPException(status_code=400, detail="Invalid ack_mode")
         
-        if os.path.exists(current_survey_path):
-            try:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                version_path = f"survey_versions/survey_v{timestamp}.json"
-                
-                # копируем текущий опрос в версии
-                with open(current_survey_path, "r", encoding="utf-8") as current_file:
-                    current_data = json.load(current_file)
-                
-                with open(version_path, "w", encoding="utf-8") as version_file:
-                    json.dump(current_data, version_file, ensure_ascii=False, indent=2)
-                
-                previous_version_saved = True
-            except Exception as e:
-                print(f"Error saving previous version: {e}")
-                previous_version_saved = False
+        # версия адресуется хешем содержимого: повторная загрузка того же опроса ничего не пишет
+        previous = survey_registry.current
+        version, created = await asyncio.to_thread(survey_store.save, survey_data.questions, settings)
+        
+        # сохраняем новый опрос (временный файл + rename, в потоке)
+        await asyncio.to_thread(atomic_write_json, "survey_questions.json", survey_file_data(survey_data.questions, settings))
         
-        # сохраняем новый опрос
-        with open("survey_questions.json", "w", encoding="utf-8") as f:
-            json.dump(survey_data.questions, f, ensure_ascii=False, indent=2)
+        # атомарно подменяем текущий опрос в памяти
+        published = survey_registry.publish(survey_data.questions, settings)
+        local_matcher.warm(published)
+        answer_parser.warm(published)
+        match_prompts.warm(published)
         
         return {
             "message": "Survey uploaded successfully", 
             "questions_count": len(survey_data.questions),
-            "previous_version_saved": previous_version_saved
+            "version": version,
+            "created": created,
+            "previous_version_saved": previous.version in survey_store
         }
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error uploading survey: {str(e)}")
 
 
+@app.get("/admin/latency")
+async def get_turn_latency(token: str = Depends(verify_admin_token)):
+    """Время этапов обработки ответа (p50/p95/p99 по последним ответам) и токены LLM на ответ"""
+    return {"stages": turn_latency.summary(), "tokens": turn_tokens.summary()}
+
+
+@app.get("/admin/traces")
+async def get_traces(limit: int = 50, token: str = Depends(verify_admin_token)):
+    """Последние трассы запросов (TRACE_SAMPLE_RATE или заголовок X-Trace: 1)"""
+    traces = list(recent_traces)[-max(1, limit):]
+    return {"traces": list(reversed(traces))}
+
+
+@app.get("/admin/admission")
+async def get_admission_status(token: str = Depends(verify_admin_token)):
+    """Допуск запросов чата: занятые места, очереди, среднее время обработки, отказы"""
+    return admission.status()
+
+
+@app.get("/admin/llm")
+async def get_llm_status(token: str = Depends(verify_admin_token)):
+    """Состояние защиты LLM: автомат отключения, лимитер, задержки хеджирования"""
+    return llm.status()
+
+
+@app.get("/admin/cache")
+async def get_match_cache_stats(token: str = Depends(verify_admin_token)):
+    """Счетчики кеша сопоставления ответов"""
+    return match_cache.stats()
+
+
+@app.get("/admin/matching")
+async def get_matching_tiers(token: str = Depends(verify_admin_token)):
+    """Доля ответов, решенных каждым уровнем сопоставления"""
+    return {
+        "tiers": match_tiers.report(),
+        "local_threshold": local_matcher.threshold,
+        "local_margin": local_matcher.margin
+    }
+
+
+@app.post("/admin/bulk/classify")
+async def start_bulk_classification(request: BulkClassifyRequest, token: str = Depends(verify_admin_token)):
+    """Запустить фоновую классификацию пачки ответов"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No items to classify")
+    
+    items = [BulkItem(question_id=i.question_id, answer=i.answer, session_id=i.session_id) for i in request.items]
+    job = bulk_jobs.submit(survey_registry.current, items, save_results=request.save_results)
+    return job.progress()
+
+
+@app.get("/admin/bulk/jobs/{job_id}")
+async def get_bulk_job(job_id: str, include_results: bool = False, token: str = Depends(verify_admin_token)):
+    """Прогресс (и при include_results=true - результаты) пакетной классификации"""
+    job = bulk_jobs.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    data = job.progress()
+    if include_results:
+        data["results"] = job.results
+    return data
+
+
 @app.get("/admin/survey/current")
 async def get_current_survey(token: str = Depends(verify_admin_token)):
     """Получить текущий опрос"""
@@ -626,123 +1345,152 @@ async def get_current_survey(token: str = Depends(verify_admin_token)):
 
 @app.get("/admin/survey/versions")
 async def get_survey_versions(token: str = Depends(verify_admin_token)):
-    """Получить список всех версий опросов"""
-    versions = []
-    versions_dir = "survey_versions"
-    
-    if os.path.exists(versions_dir):
-        for filename in os.listdir(versions_dir):
-            if filename.startswith("survey_v") and filename.endswith(".json"):
-                filepath = os.path.join(versions_dir, filename)
-                try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                    
-                    # извлекаем дату из имени файла
-                    timestamp_str = filename.replace("survey_v", "").replace(".json", "")
-                    try:
-                        timestamp = datetime.strptime(timestamp_str, "%Y%m%d_%H%M%S")
-                        versions.append({
-                            "filename": filename,
-                            "timestamp": timestamp.isoformat(),
-                            "questions_count": len(data),
-                            "first_question": data[0]["question"] if data else "Нет вопросов"
-                        })
-                    except ValueError:
-                        continue
-                except Exception as e:
-                    print(f"Error reading {filename}: {e}")
-    
-    # сортируем по времени (новые сверху)
-    versions.sort(key=lambda x: x["timestamp"], reverse=True)
+    """Получить список всех версий опросов (из манифеста, без чтения файлов версий)"""
+    current = survey_registry.current.version
+    versions = [
+        {
+            **entry,
+            "timestamp": entry["created_at"],
+            "first_question": entry["first_question"] or "Нет вопросов",
+            "current": entry["version"] == current
+        }
+        for entry in survey_store.list()
+    ]
     return {"versions": versions}
 
 
-@app.get("/admin/survey/versions/{filename}")
-async def get_survey_version(filename: str, token: str = Depends(verify_admin_token)):
-    """Получить конкретную версию опроса"""
-    filepath = os.path.join("survey_versions", filename)
-    
-    if not os.path.exists(filepath):
+@app.get("/admin/survey/versions/{version}")
+async def get_survey_version(version: str, token: str = Depends(verify_admin_token)):
+    """Получить конкретную версию опроса (по id или имени файла старой версии)"""
+    version_id = survey_store.resolve(version)
+    if version_id is None:
         raise HTTPException(status_code=404, detail="Version not found")
     
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data
+        questions, settings = await asyncio.to_thread(survey_store.load, version_id)
+        return survey_file_data(questions, settings)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error reading version: {str(e)}")
 
 
-@app.get("/admin/export/csv")
-async def export_csv(token: str = Depends(verify_admin_token)):
-    """Экспорт результатов в CSV"""
-    import csv
-    import io
+def queued_results(since: Optional[str], until: Optional[str], survey_version: Optional[str]) -> List[ResultRecord]:
+    """Завершенные опросы из очереди фоновой записи, еще не попавшие в базу (фильтры как у results_store)"""
+    return [
+        record for record in result_writer.pending_records()
+        if (not survey_version or record.survey_version == survey_version)
+        and (not since or record.timestamp >= since)
+        and (not until or record.timestamp < until)
+    ]
+
+
+def with_queued_results(items, queued: List[ResultRecord], expand):
+    """Строки или документы из базы, затем результаты очереди, которых среди них не было.
+    
+    Снимок очереди берется до чтения базы: то, что успело записаться за время
+    чтения, встречается в items и второй раз не выдается.
+    """
+    keys = {(record.session_id, record.timestamp) for record in queued}
+    seen = set()
+    for item in items:
+        key = (item["session_id"], item["timestamp"])
+        if key in keys:
+            seen.add(key)
+        yield item
+    for record in queued:
+        if (record.session_id, record.timestamp) not in seen:
+            yield from expand(record)
+
+
+def result_document(record: ResultRecord) -> Dict:
+    """Результат из очереди записи в том же виде, что results_store.iter_results"""
+    doc = {"session_id": record.session_id, "timestamp": record.timestamp, "answers": record.answers}
+    if record.survey_version:
+        doc["survey_version"] = record.survey_version
+    return doc
+
+
+def result_answer_rows(record: ResultRecord):
+    """Результат из очереди записи плоскими строками, как results_store.iter_answer_rows"""
+    for answer in record.answers:
+        yield {
+            "session_id": record.session_id,
+            "timestamp": record.timestamp,
+            "question_id": str(answer.question_id),
+            "answer_codes": ",".join(answer.codes),
+            "original_answer": answer.original_answer,
+            "survey_version": record.survey_version,
+            "question": answer.stored_texts[0] if answer.stored_texts else None,
+            "answer_texts": ",".join(answer.stored_texts[1]) if answer.stored_texts else None,
+        }
+
+
+def iter_export_rows(since: Optional[str], until: Optional[str], survey_version: Optional[str]):
+    """Плоские строки ответов сохраненных результатов и очереди записи, с текстами"""
+    queued = queued_results(since, until, survey_version)
+    rows = results_store.iter_answer_rows(since=since, until=until, survey_version=survey_version)
+    return expand_answer_rows(with_queued_results(rows, queued, result_answer_rows))
+
+
+async def iter_export_documents(since: Optional[str], until: Optional[str], survey_version: Optional[str]):
+    """Сохраненные результаты (и еще не записанные из очереди), затем незавершенные сессии с ответами"""
+    queued = queued_results(since, until, survey_version)
+    results = results_store.iter_results(since=since, until=until, survey_version=survey_version)
+    documents = with_queued_results(results, queued, lambda record: [result_document(record)])
+    # тексты подставляются в том же потоке, что и чтение базы
+    async for doc in iterate_in_threadpool(expand_document(doc) for doc in documents):
+        yield doc
     
-    # собираем все данные
-    all_data = []
-    results_dir = "results"
+    async for session in session_store.iter_sessions():
+        # завершенные уже выданы выше: из базы или из очереди записи
+        if not session.answers or is_session_completed(session):
+            continue
+        if survey_version and session.survey_version != survey_version:
+            continue
+        if (since and session.started_at < since) or (until and session.started_at >= until):
+            continue
+        doc = expand_document({
+            "session_id": session.id,
+            "timestamp": session.started_at,
+            "answers": session.answers,
+            "survey_version": session.survey_version
+        })
+        doc["status"] = "in_progress"
+        yield doc
+
+
+@app.get("/admin/export/{export_format}")
+async def export_results(
+    export_format: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    survey_version: Optional[str] = None,
+    token: str = Depends(verify_admin_token)
+):
+    """Потоковый экспорт результатов: csv, json, jsonl или parquet.
     
-    if os.path.exists(results_dir):
-        for filename in os.listdir(results_dir):
-            if filename.startswith("survey_") and filename.endswith(".json"):
-                filepath = os.path.join(results_dir, filename)
-                try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        for answer in data.get("answers", []):
-                            all_data.append({
-                                "session_id": data["session_id"],
-                                "timestamp": data["timestamp"],
-                                "question_id": answer["question_id"],
-                                "question": answer["question"],
-                                "answer_codes": ",".join(answer["answer_codes"]),
-                                "answer_texts": ",".join(answer.get("answer_texts", [])),
-                                "original_answer": answer["original_answer"]
-                            })
-                except Exception as e:
-                    print(f"Error reading {filename}: {e}")
-    
-    # создать CSV
-    output = io.StringIO()
-    if all_data:
-        writer = csv.DictWriter(output, fieldnames=all_data[0].keys())
-        writer.writeheader()
-        writer.writerows(all_data)
-    
-    return {"csv_data": output.getvalue()}
-
-
-@app.get("/admin/export/json")
-async def export_json(token: str = Depends(verify_admin_token)):
-    """Экспорт файлов в JSON"""
-    all_responses = []
-    results_dir = "results"
-    
-    if os.path.exists(results_dir):
-        for filename in os.listdir(results_dir):
-            if filename.startswith("survey_") and filename.endswith(".json"):
-                filepath = os.path.join(results_dir, filename)
-                try:
-                    with open(filepath, "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        all_responses.append(data)
-                except Exception as e:
-                    print(f"Error reading {filename}: {e}")
-    
-    for session_id, session_data in sessions.items():
-        if session_data.get("answers"):
-            all_responses.append({
-                "session_id": session_id,
-                "timestamp": session_data.get("started_at"),
-                "answers": session_data["answers"],
-                "status": "completed" if session_data.get("current_question_index", 0) >= len(load_survey_questions()) else "in_progress"
-            })
-    
-    all_responses.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-    
-    return {"json_data": json.dumps(all_responses, ensure_ascii=False, indent=2)}
+    since/until - ISO дата или время (until не включается), survey_version - версия опроса.
+    """
+    if export_format not in MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="Unknown export format")
+    
+    if export_format == "csv":
+        body = csv_stream(iterate_in_threadpool(iter_export_rows(since, until, survey_version)))
+    elif export_format == "parquet":
+        if not parquet_available():
+            raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+        # синхронный генератор - StreamingResponse выполняет его в пуле потоков
+        body = parquet_stream(iter_export_rows(since, until, survey_version))
+    elif export_format == "jsonl":
+        body = jsonl_stream(iter_export_documents(since, until, survey_version))
+    else:
+        body = json_array_stream(iter_export_documents(since, until, survey_version))
+    
+    filename = f"survey_results_{datetime.now().strftime('%Y-%m-%d')}.{export_format}"
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 if __name__ == "__main__":
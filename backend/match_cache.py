@@ -0,0 +1,152 @@
+"""Кеш сопоставления ответов с вариантами.
+
+Ключ - (версия опроса, id вопроса, нормализованный ответ), значение - коды вариантов.
+Два уровня: LRU в памяти и (опционально) SQLite на диске с TTL и вытеснением.
+"""
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# "#" и "+" остаются частью слова, как в local_matcher и FTS: "C#", "C++" и "C" - разные ответы
+_TOKEN_RE = re.compile(r"\w+[#+]*", re.UNICODE)
+# версия нормализации в ключе на диске: записи прежних версий просто не находятся
+# и уходят по TTL/LRU (прежняя склеивала "C#" и "C")
+_KEY_FORMAT = "2"
+
+
+def normalize_answer(text: str) -> str:
+    """Регистр, ё/е, пунктуация и лишние пробелы не влияют на ключ"""
+    text = text.lower().replace("ё", "е")
+    return " ".join(_TOKEN_RE.findall(text))
+
+
+CacheKey = Tuple[str, str, str]
+
+
+class MatchCache:
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        db_path: Optional[str] = None,
+        ttl_seconds: float = 30 * 24 * 3600,
+        max_db_entries: int = 200000,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_db_entries = max_db_entries
+        self._memory: "OrderedDict[CacheKey, Tuple[str, ...]]" = OrderedDict()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0}
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS match_cache ("
+                " key TEXT PRIMARY KEY,"
+                " codes TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_hit REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_match_cache_last_hit ON match_cache(last_hit)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(version: str, question_id: Any, answer: str) -> CacheKey:
+        return (version, str(question_id), normalize_answer(answer))
+
+    async def get(self, version: str, question_id: Any, answer: str) -> Optional[List[str]]:
+        key = self.make_key(version, question_id, answer)
+        codes = self._memory.get(key)
+        if codes is not None:
+            self._memory.move_to_end(key)
+            self._counters["memory_hits"] += 1
+            return list(codes)
+
+        if self._db is not None:
+            codes = await asyncio.to_thread(self._db_get, key)
+            if codes is not None:
+                self._remember(key, codes)
+                self._counters["disk_hits"] += 1
+                return list(codes)
+
+        self._counters["misses"] += 1
+        return None
+
+    async def put(self, version: str, question_id: Any, answer: str, codes: List[str]):
+        """Сохранить результат; пустые результаты (не распознано/ошибка) не кешируются"""
+        if not codes:
+            return
+        key = self.make_key(version, question_id, answer)
+        self._remember(key, tuple(codes))
+        self._counters["puts"] += 1
+        if self._db is not None:
+            await asyncio.to_thread(self._db_put, key, tuple(codes))
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            **self._counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_enabled": self._db is not None,
+        }
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def _remember(self, key: CacheKey, codes: Tuple[str, ...]):
+        self._memory[key] = codes
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # SQLite уровень (выполняется в отдельном потоке)
+
+    @staticmethod
+    def _db_key(key: CacheKey) -> str:
+        return "\x1f".join((_KEY_FORMAT,) + key)
+
+    def _db_get(self, key: CacheKey) -> Optional[Tuple[str, ...]]:
+        now = time.time()
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT codes, created_at FROM match_cache WHERE key = ?", (self._db_key(key),)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._db.execute("DELETE FROM match_cache WHERE key = ?", (self._db_key(key),))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE match_cache SET last_hit = ? WHERE key = ?", (now, self._db_key(key)))
+            self._db.commit()
+        return tuple(json.loads(row[0]))
+
+    def _db_put(self, key: CacheKey, codes: Tuple[str, ...]):
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO match_cache (key, codes, created_at, last_hit) VALUES (?, ?, ?, ?)",
+                (self._db_key(key), json.dumps(codes), now, now),
+            )
+            # вытеснение раз в 1000 записей: просроченные и самые давно использованные
+            if self._counters["puts"] % 1000 == 0:
+                self._db.execute("DELETE FROM match_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+                self._db.execute(
+                    "DELETE FROM match_cache WHERE key IN ("
+                    " SELECT key FROM match_cache ORDER BY last_hit DESC LIMIT -1 OFFSET ?)",
+                    (self.max_db_entries,),
+                )
+            self._db.commit()
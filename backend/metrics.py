@@ -0,0 +1,182 @@
+"""Метрики в формате Prometheus без внешних зависимостей.
+
+Счетчики, гистограммы и gauge с метками; все метрики регистрируются в
+REGISTRY при создании, render() отдает текстовый формат для /metrics.
+Счетчик и gauge могут вычисляться в момент чтения через callback.
+"""
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, "Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric"):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional["Metric"]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class _ValueMetric(Metric):
+    """Значения задаются вызовами или вычисляются callback'ом при каждом чтении.
+
+    callback возвращает число (метрика без меток) или словарь {значения меток: число}.
+    """
+
+    def __init__(self, *args, callback: Optional[Callable[[], object]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+        self._values: Dict[LabelValues, float] = {}
+
+    def value(self, **labels) -> float:
+        return self._current().get(self._key(labels), 0.0)
+
+    def _current(self) -> Dict[LabelValues, float]:
+        if self.callback is None:
+            return dict(self._values)
+        result = self.callback()
+        if isinstance(result, dict):
+            return {tuple(str(v) for v in (k if isinstance(k, tuple) else (k,))): float(v) for k, v in result.items()}
+        return {(): float(result)}
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._current().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(_ValueMetric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_ValueMetric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # значения меток -> (счетчики по корзинам, сумма, количество)
+        self._values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            yield f"{self.name}_bucket{labels} {count}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {count}"
+
+
+# метрики, общие для нескольких модулей
+
+HTTP_REQUEST_DURATION = Histogram(
+    "survey_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+STAGE_DURATION = Histogram(
+    "survey_stage_duration_seconds", "Latency of processing stages inside a request", ("stage",)
+)
+LLM_REQUESTS = Counter(
+    "survey_llm_requests_total", "OpenAI requests by model, prompt kind and outcome", ("model", "kind", "outcome")
+)
+LLM_REQUEST_DURATION = Histogram(
+    "survey_llm_request_duration_seconds", "OpenAI request latency by model and prompt kind", ("model", "kind")
+)
+LLM_TOKENS = Counter(
+    "survey_llm_tokens_total", "OpenAI tokens by model, prompt kind and direction", ("model", "kind", "direction")
+)
+TURN_TOKENS = Histogram(
+    "survey_turn_llm_tokens", "OpenAI tokens spent on one chat turn", ("direction",),
+    buckets=(0, 50, 100, 200, 400, 800, 1600, 3200, 6400)
+)
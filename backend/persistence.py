@@ -0,0 +1,258 @@
+"""Запись на диск вне обработчиков запросов.
+
+ResultWriter - write-behind очередь результатов опроса. Обработчик только
+кладет запись в ограниченную очередь; фоновая задача забирает все, что
+накопилось, и пишет пачку в потоке одной транзакцией (один commit на пачку,
+а не на каждый результат). Пока идет запись, следующие результаты копятся
+и уходят следующей пачкой. Если очередь заполнена, обработчик ждет места
+(backpressure). При остановке очередь дописывается до конца. Пачка, которую
+не удалось записать за max_attempts попыток, делится пополам, пока не
+останутся отдельные результаты; те, что не пишутся и поодиночке (битая
+строка, нарушение ограничения), уходят в dead-letter каталог файлами
+survey_<session_id>.json, и очередь идет дальше.
+
+atomic_write_json - запись файла через временный файл и rename: после сбоя
+на диске либо старое содержимое, либо новое целиком.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from answer_record import AnswerRecord
+from metrics import Counter, Histogram
+
+
+RESULT_BATCH_SIZE = Histogram(
+    "survey_results_write_batch_size", "Results written per transaction by the write-behind queue",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+RESULT_WRITE_DURATION = Histogram(
+    "survey_results_write_duration_seconds", "Duration of one write-behind transaction"
+)
+RESULT_WRITE_ERRORS = Counter("survey_results_write_errors_total", "Failed write-behind transactions (retried)")
+RESULT_DEAD_LETTERS = Counter(
+    "survey_results_dead_letter_total", "Results the write-behind queue could not write and moved to the dead-letter directory"
+)
+RESULT_QUEUE_FULL = Counter(
+    "survey_results_queue_full_total", "Times a request waited for room in the results write queue"
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ResultRecord:
+    session_id: str
+    answers: List[AnswerRecord]
+    timestamp: str
+    survey_version: Optional[str]
+
+    def as_tuple(self):
+        return (self.session_id, self.answers, self.timestamp, self.survey_version)
+
+
+class ResultWriter:
+    """Фоновая запись результатов в ResultsStore пачками"""
+
+    def __init__(
+        self,
+        store,
+        max_queue: int = 1000,
+        batch_size: int = 100,
+        retry_delay: float = 0.5,
+        on_written: Optional[Callable[[List[ResultRecord]], None]] = None,
+        max_attempts: int = 5,
+        dead_letter_dir: Optional[str] = None,
+    ):
+        self.store = store
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # None - незаписанные результаты только попадают в лог
+        self.dead_letter_dir = dead_letter_dir
+        # вызывается с пачкой после успешной записи (в цикле событий)
+        self.on_written = on_written
+        self.retry_delay = retry_delay
+        self._queue: "asyncio.Queue[ResultRecord]" = asyncio.Queue(maxsize=max_queue)
+        # поставленные в очередь и еще не записанные (включая пишущуюся пачку), в порядке submit;
+        # ключ - id(record): записи одной сессии могут повторяться
+        self._unwritten: Dict[int, ResultRecord] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def pending_records(self) -> List[ResultRecord]:
+        """Результаты, которые уже приняты, но еще не в базе: их нет ни в ResultsStore, ни среди незавершенных сессий"""
+        return list(self._unwritten.values())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(
+        self,
+        session_id: str,
+        answers: List[AnswerRecord],
+        survey_version: Optional[str] = None,
+        timestamp: Optional[str] = None,
+    ):
+        """Поставить результат в очередь; время фиксируется в момент вызова"""
+        record = ResultRecord(session_id, list(answers), timestamp or datetime.now().isoformat(), survey_version)
+        if self._task is None or self._closing:
+            # писатель не запущен (скрипты) или уже останавливается - пишем сами, но не в цикле событий
+            await asyncio.to_thread(self.store.add_many, [record.as_tuple()])
+            self._written([record])
+            return
+        self._unwritten[id(record)] = record
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            RESULT_QUEUE_FULL.inc()
+            try:
+                await self._queue.put(record)
+            except BaseException:
+                del self._unwritten[id(record)]
+                raise
+
+    async def flush(self):
+        """Дождаться записи всего, что уже в очереди"""
+        if self._task is not None:
+            await self._queue.join()
+
+    async def close(self, timeout: float = 30.0):
+        """Дописать очередь и остановить фоновую задачу"""
+        self._closing = True
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Results writer stopped with %d unsaved results", self._queue.qsize())
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            # все, что накопилось за время предыдущей записи, - в ту же транзакцию
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: List[ResultRecord]):
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            error = await self._try_write(batch)
+            if error is None:
+                return
+            if attempt < self.max_attempts:
+                # диск занят или недоступен - пачка остается в памяти и пишется повторно
+                logger.warning(
+                    "Error writing %d results (attempt %d/%d), retrying in %.1fs: %s",
+                    len(batch), attempt, self.max_attempts, delay, error,
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        await self._split(batch, error)
+
+    async def _split(self, batch: List[ResultRecord], error: Exception):
+        """Пачка не пишется целиком: половины пишутся по одной попытке, не записанные поодиночке - в dead-letter"""
+        if len(batch) == 1:
+            self._unwritten.pop(id(batch[0]), None)
+            await asyncio.to_thread(self._dead_letter, batch[0], error)
+            return
+        middle = len(batch) // 2
+        for half in (batch[:middle], batch[middle:]):
+            half_error = await self._try_write(half)
+            if half_error is not None:
+                await self._split(half, half_error)
+
+    async def _try_write(self, batch: List[ResultRecord]) -> Optional[Exception]:
+        started = asyncio.get_running_loop().time()
+        try:
+            await asyncio.to_thread(self.store.add_many, [record.as_tuple() for record in batch])
+        except Exception as e:
+            RESULT_WRITE_ERRORS.inc()
+            return e
+        RESULT_WRITE_DURATION.observe(asyncio.get_running_loop().time() - started)
+        RESULT_BATCH_SIZE.observe(len(batch))
+        for record in batch:
+            self._unwritten.pop(id(record), None)
+        self._written(batch)
+        return None
+
+    def _dead_letter(self, record: ResultRecord, error: Exception):
+        RESULT_DEAD_LETTERS.inc()
+        data = {
+            "session_id": record.session_id,
+            "timestamp": record.timestamp,
+            "survey_version": record.survey_version,
+            "answers": [AnswerRecord.unpack(answer).pack() for answer in record.answers],
+            "error": str(error),
+        }
+        if self.dead_letter_dir is None:
+            logger.error("Result %s was not written and is dropped: %s; %s", record.session_id, error, json.dumps(data, ensure_ascii=False))
+            return
+        path = os.path.join(self.dead_letter_dir, f"survey_{record.session_id}.json")
+        try:
+            os.makedirs(self.dead_letter_dir, exist_ok=True)
+            atomic_write_json(path, data)
+        except Exception as e:
+            logger.error("Result %s was not written (%s) and could not be saved to %s: %s", record.session_id, error, path, e)
+            return
+        logger.error("Result %s was not written, moved to %s: %s", record.session_id, path, error)
+
+    def _written(self, batch: List[ResultRecord]):
+        if self.on_written is None:
+            return
+        try:
+            self.on_written(batch)
+        except Exception as e:
+            logger.exception("Error in results writer callback: %s", e)
+
+
+def atomic_write_json(path: str, data: Any):
+    """JSON во временный файл рядом, fsync и rename поверх path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # rename должен пережить сбой питания - синхронизируем каталог (где это возможно)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
@@ -0,0 +1,161 @@
+"""Скомпилированные промпты для запросов к LLM.
+
+Промпт сопоставления строится для каждого вопроса один раз при загрузке
+опроса: системное сообщение с инструкцией, текстом вопроса и
+пронумерованными вариантами. Ответ пользователя идет последним отдельным
+сообщением, поэтому начало запроса одинаково для всех ответов на вопрос и
+может переиспользоваться prompt cache провайдера (у OpenAI - префиксы от
+1024 токенов).
+
+Формат ответа задается JSON-схемой (structured outputs): коды ограничены
+enum вариантов вопроса, single_choice возвращает один код или null.
+Ответ модели не нужно разбирать по строкам, остается только json.loads.
+"""
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Tuple
+
+from survey_registry import CompiledQuestion
+
+
+MATCH_INSTRUCTIONS = {
+    "single_choice": """Ты помощник для анализа ответов в социологическом опросе. Сопоставь ответ пользователя (следующее сообщение) с одним из вариантов.
+Учитывай:
+- Числовые ответы (1, 2, 3, "первое", "второе", "третий")
+- Ключевые слова из вариантов
+- Синонимы и похожие фразы
+
+Верни код наиболее подходящего варианта в поле "code".
+Если ответ не подходит ни к одному варианту, верни null.""",
+    "multiple_choice": """Ты помощник для анализа ответов в социологическом опросе. Сопоставь ответ пользователя (следующее сообщение) с вариантами.
+Учитывай:
+- Числовые ответы (1,2,3 или "первое и второе")
+- Ключевые слова из вариантов
+- Синонимы и похожие фразы
+
+Верни коды всех подходящих вариантов в поле "codes".
+Если ответ не подходит ни к одному варианту, верни пустой список.""",
+}
+
+ACK_INSTRUCTIONS = """Ты дружелюбный ассистент, который проводит социологический опрос. Следующее сообщение - ответ пользователя на вопрос опроса.
+
+Твоя задача:
+1. Поблагодари пользователя за ответ кратко и естественно
+2. НЕ задавай никаких вопросов - вопросы задает система автоматически
+3. НЕ приветствуй - это уже сделано в начале опроса
+4. Будь дружелюбным и лаконичным
+
+Ответь ТОЛЬКО благодарностью (1 предложение максимум)."""
+
+
+def acknowledgement_messages(user_message: str) -> List[Dict[str, str]]:
+    """Благодарность: общая для всех ответов инструкция, затем ответ пользователя"""
+    return [
+        {"role": "system", "content": ACK_INSTRUCTIONS},
+        {"role": "user", "content": user_message},
+    ]
+
+
+def options_block(question: CompiledQuestion) -> str:
+    return "\n".join(f"{i}) {opt.code}: {opt.text}" for i, opt in enumerate(question.options, 1))
+
+
+def match_schema(question: CompiledQuestion) -> Dict[str, Any]:
+    codes = list(question.codes)
+    if question.type == "single_choice":
+        properties = {"code": {"type": ["string", "null"], "enum": codes + [None]}}
+        required = ["code"]
+    else:
+        properties = {"codes": {"type": "array", "items": {"type": "string", "enum": codes}}}
+        required = ["codes"]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "answer_match",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": required,
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+@dataclass(frozen=True)
+class MatchPrompt:
+    """Неизменяемая часть запроса сопоставления для одного вопроса"""
+
+    system: str
+    response_format: Dict[str, Any]
+    max_tokens: int
+    single: bool
+    # коды в порядке вариантов опроса
+    codes: Tuple[str, ...]
+    valid_codes: FrozenSet[str]
+
+    def messages(self, user_answer: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": user_answer},
+        ]
+
+    def parse(self, content: str) -> List[str]:
+        """JSON ответ модели -> коды вариантов ([] - ответ не распознан).
+
+        Схема уже ограничивает коды, проверка по valid_codes нужна только для
+        OpenAI-совместимых серверов без structured outputs.
+        """
+        try:
+            data = json.loads(content)
+        except ValueError:
+            return []
+        if not isinstance(data, dict):
+            return []
+        if self.single:
+            code = data.get("code")
+            return [code] if isinstance(code, str) and code in self.valid_codes else []
+        codes = data.get("codes")
+        selected = {code for code in codes if isinstance(code, str)} if isinstance(codes, list) else set()
+        return [code for code in self.codes if code in selected]
+
+
+def compile_match_prompt(question: CompiledQuestion) -> MatchPrompt:
+    single = question.type == "single_choice"
+    system = (
+        f"{MATCH_INSTRUCTIONS[question.type]}\n\n"
+        f'Вопрос: "{question.question}"\n\n'
+        f"Варианты ответов (с номерами):\n{options_block(question)}"
+    )
+    return MatchPrompt(
+        system=system,
+        response_format=match_schema(question),
+        # {"code":"A1"} или {"codes":["C1","C3"]} - несколько токенов на код
+        max_tokens=20 if single else 12 + 6 * len(question.options),
+        single=single,
+        codes=question.codes,
+        valid_codes=frozenset(question.codes),
+    )
+
+
+class PromptBook:
+    """Промпты сопоставления по (версия опроса, номер вопроса), строятся один раз"""
+
+    def __init__(self):
+        self._prompts: Dict[Tuple[str, int], MatchPrompt] = {}
+        self._lock = threading.Lock()
+
+    def for_question(self, question: CompiledQuestion, survey_version: str) -> MatchPrompt:
+        key = (survey_version, question.index)
+        prompt = self._prompts.get(key)
+        if prompt is None:
+            with self._lock:
+                prompt = self._prompts.setdefault(key, compile_match_prompt(question))
+        return prompt
+
+    def warm(self, survey):
+        """Скомпилировать промпты всех вопросов опроса заранее"""
+        for question in survey.questions:
+            self.for_question(question, survey.version)
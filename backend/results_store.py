@@ -0,0 +1,445 @@
+"""Хранилище завершенных опросов (SQLite).
+
+Вместо отдельного JSON файла на каждого респондента результаты пишутся в
+две таблицы: results (ответы целиком) и answers (по строке на ответ,
+с индексами по времени, сессии и вопросу). Запись и выборки не зависят
+от числа уже сохраненных результатов. Исходные ответы индексируются в
+answers_fts (FTS5 по основам слов, см. answer_search) в той же транзакции.
+
+Тексты вопросов и вариантов не сохраняются: results.answers - компактные
+записи (answer_record.dump_answers), answers - id вопроса и коды, а
+question и answer_texts заполнены только у записей, перенесенных с текстами
+из прежнего формата. Остальные тексты подставляет вызывающий код по
+survey_version результата.
+
+Перенос старых results/*.json:
+    python results_store.py migrate [results] [--db results.sqlite3]
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from answer_record import AnswerRecord, dump_answers, load_answers
+from answer_search import index_text
+
+
+DEFAULT_DB_PATH = "results.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    survey_version TEXT,
+    answers TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_timestamp ON results(timestamp);
+CREATE INDEX IF NOT EXISTS idx_results_session ON results(session_id);
+CREATE INDEX IF NOT EXISTS idx_results_version ON results(survey_version);
+CREATE INDEX IF NOT EXISTS idx_results_keyset ON results(timestamp, session_id);
+
+CREATE TABLE IF NOT EXISTS answers (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    position INTEGER NOT NULL,
+    session_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    question_id TEXT NOT NULL,
+    question TEXT,
+    answer_codes TEXT NOT NULL,
+    answer_texts TEXT,
+    original_answer TEXT,
+    PRIMARY KEY (result_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_answers_timestamp ON answers(timestamp);
+CREATE INDEX IF NOT EXISTS idx_answers_session ON answers(session_id);
+CREATE INDEX IF NOT EXISTS idx_answers_question ON answers(question_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS answers_fts USING fts5(
+    stems,
+    tokenize = "unicode61 remove_diacritics 0 tokenchars '#+'"
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ResultsStore:
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        fts_exists = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'answers_fts'"
+        ).fetchone()
+        self._db.executescript(_SCHEMA)
+        not_null = {row[1]: row[3] for row in self._db.execute("PRAGMA table_info(answers)")}
+        for column in ("question", "answer_texts"):
+            if column not in not_null:
+                self._db.execute(f"ALTER TABLE answers ADD COLUMN {column} TEXT")
+        # в старой схеме answer_texts NOT NULL - вместо NULL пишем туда пустую строку
+        self._no_texts = "" if not_null.get("answer_texts") else None
+        if not fts_exists:
+            # ответы, сохраненные до появления индекса, дописывает build_search_index
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) SELECT 'fts_backfill_until', MAX(rowid) FROM answers"
+                " HAVING MAX(rowid) IS NOT NULL"
+            )
+        self._db.commit()
+
+    def add(
+        self,
+        session_id: str,
+        answers: List[Dict[str, Any]],
+        timestamp: Optional[str] = None,
+        survey_version: Optional[str] = None,
+    ) -> int:
+        """Сохранить результат опроса, вернуть его id"""
+        with self._lock:
+            result_id = self._insert(session_id, answers, timestamp or datetime.now().isoformat(), survey_version)
+            self._db.commit()
+        return result_id
+
+    def add_many(self, records: List[Tuple[str, List[Dict[str, Any]], str, Optional[str]]]) -> List[int]:
+        """Пачка (session_id, answers, timestamp, survey_version) одной транзакцией - один commit на пачку"""
+        with self._lock:
+            try:
+                ids = [self._insert(*record) for record in records]
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._db.commit()
+        return ids
+
+    def _insert(self, session_id, answers, timestamp, survey_version) -> int:
+        answers = [AnswerRecord.unpack(answer) for answer in answers]
+        cursor = self._db.execute(
+            "INSERT INTO results (session_id, timestamp, survey_version, answers) VALUES (?, ?, ?, ?)",
+            (session_id, timestamp, survey_version, dump_answers(answers)),
+        )
+        result_id = cursor.lastrowid
+        self._db.executemany(
+            "INSERT INTO answers (result_id, position, session_id, timestamp, question_id, question,"
+            " answer_codes, answer_texts, original_answer) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    result_id,
+                    position,
+                    session_id,
+                    timestamp,
+                    str(answer.question_id),
+                    answer.stored_texts[0] if answer.stored_texts else None,
+                    ",".join(answer.codes),
+                    ",".join(answer.stored_texts[1]) if answer.stored_texts else self._no_texts,
+                    answer.original_answer,
+                )
+                for position, answer in enumerate(answers)
+            ],
+        )
+        # rowid строк answers идут подряд: первая строка результата - после вставки
+        first_rowid = self._db.execute("SELECT last_insert_rowid()").fetchone()[0] - len(answers) + 1
+        self._db.executemany(
+            "INSERT INTO answers_fts (rowid, stems) VALUES (?, ?)",
+            [
+                (first_rowid + position, stems)
+                for position, stems in enumerate(index_text(answer.original_answer) for answer in answers)
+                if stems
+            ],
+        )
+        return result_id
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def iter_results(
+        self,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        newest_first: bool = True,
+        batch_size: int = 500,
+        survey_version: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Документы результатов порциями; answers - AnswerRecord без текстов"""
+        where, params = _filters("", since, until, survey_version)
+        order = "DESC" if newest_first else "ASC"
+        sql = f"SELECT id, session_id, timestamp, survey_version, answers FROM results{where} ORDER BY timestamp {order}, id {order}"
+        for row in self._iter_rows(sql, params, batch_size):
+            result = {"session_id": row[1], "timestamp": row[2], "answers": load_answers(row[4])}
+            if row[3]:
+                result["survey_version"] = row[3]
+            yield result
+
+    def query_results(
+        self,
+        limit: int = 50,
+        after: Optional[Tuple[str, str]] = None,
+        newest_first: bool = True,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        survey_version: Optional[str] = None,
+        question_id: Optional[str] = None,
+        answer_code: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Страница результатов с keyset-пагинацией по (timestamp, session_id).
+
+        after - ключ последней записи предыдущей страницы; стоимость запроса
+        не зависит от номера страницы. answer_code без question_id ищется
+        по всем вопросам.
+        """
+        where, params = _filters("", since, until, survey_version)
+        clauses = [where[len(" WHERE "):]] if where else []
+        if after:
+            clauses.append("(timestamp, session_id) " + ("<" if newest_first else ">") + " (?, ?)")
+            params.extend(after)
+        if question_id is not None or answer_code is not None:
+            exists = "EXISTS (SELECT 1 FROM answers a WHERE a.result_id = results.id"
+            if question_id is not None:
+                exists += " AND a.question_id = ?"
+                params.append(str(question_id))
+            if answer_code is not None:
+                # answer_codes хранятся через запятую
+                exists += " AND (',' || a.answer_codes || ',') LIKE ?"
+                params.append(f"%,{answer_code},%")
+            clauses.append(exists + ")")
+        order = "DESC" if newest_first else "ASC"
+        sql = (
+            "SELECT session_id, timestamp, survey_version, answers FROM results"
+            + (" WHERE " + " AND ".join(clauses) if clauses else "")
+            + f" ORDER BY timestamp {order}, session_id {order} LIMIT ?"
+        )
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        results = []
+        for row in rows:
+            result = {"session_id": row[0], "timestamp": row[1], "answers": load_answers(row[3])}
+            if row[2]:
+                result["survey_version"] = row[2]
+            results.append(result)
+        return results
+
+    def iter_answer_rows(
+        self,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        batch_size: int = 1000,
+        survey_version: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Плоские строки ответов (для CSV) в порядке сохранения; question/answer_texts - только сохраненные"""
+        version_filter = ("r.survey_version = ?", survey_version) if survey_version else None
+        where, params = _filters("a.", since, until, None, extra=version_filter)
+        sql = (
+            "SELECT a.session_id, a.timestamp, a.question_id, a.answer_codes, a.original_answer, r.survey_version,"
+            " a.question, a.answer_texts"
+            f" FROM answers a JOIN results r ON r.id = a.result_id{where} ORDER BY a.result_id, a.position"
+        )
+        for row in self._iter_rows(sql, params, batch_size):
+            yield {
+                "session_id": row[0],
+                "timestamp": row[1],
+                "question_id": row[2],
+                "answer_codes": row[3],
+                "original_answer": row[4],
+                "survey_version": row[5],
+                "question": row[6],
+                "answer_texts": row[7],
+            }
+
+    def max_result_id(self, survey_version: Optional[str] = None) -> int:
+        """Id последнего сохраненного результата (версии) - метка свежести данных"""
+        sql, params = "SELECT MAX(id) FROM results", ()
+        if survey_version:
+            sql, params = sql + " WHERE survey_version = ?", (survey_version,)
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()[0] or 0
+
+    def iter_answer_codes(
+        self,
+        survey_version: str,
+        after_id: int = 0,
+        up_to_id: Optional[int] = None,
+        batch_size: int = 5000,
+    ) -> Iterator[Tuple[int, str, str, str]]:
+        """(result_id, timestamp, question_id, answer_codes) результатов версии с id > after_id, по порядку"""
+        sql = (
+            "SELECT a.result_id, a.timestamp, a.question_id, a.answer_codes"
+            " FROM answers a JOIN results r ON r.id = a.result_id"
+            " WHERE r.survey_version = ? AND a.result_id > ?"
+        )
+        params: List[Any] = [survey_version, after_id]
+        if up_to_id is not None:
+            sql += " AND a.result_id <= ?"
+            params.append(up_to_id)
+        yield from self._iter_rows(sql + " ORDER BY a.result_id, a.position", params, batch_size)
+
+    def search_answers(
+        self,
+        match: str,
+        limit: int = 50,
+        after: Optional[Tuple[float, int]] = None,
+        question_id: Optional[str] = None,
+        answer_code: Optional[str] = None,
+        survey_version: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Ответы по выражению FTS5, лучшие (bm25) первыми.
+
+        after - ключ (score, rowid) последнего ответа предыдущей страницы.
+        """
+        clauses, params = ["answers_fts MATCH ?"], [match]
+        if after:
+            clauses.append("(f.rank, f.rowid) > (?, ?)")
+            params.extend(after)
+        if question_id is not None:
+            clauses.append("a.question_id = ?")
+            params.append(str(question_id))
+        if answer_code is not None:
+            clauses.append("(',' || a.answer_codes || ',') LIKE ?")
+            params.append(f"%,{answer_code},%")
+        if survey_version:
+            clauses.append("r.survey_version = ?")
+            params.append(survey_version)
+        sql = (
+            "SELECT a.session_id, a.timestamp, a.position, a.question_id, a.answer_codes,"
+            " a.original_answer, r.survey_version, f.rank, f.rowid, a.question"
+            " FROM answers_fts f JOIN answers a ON a.rowid = f.rowid JOIN results r ON r.id = a.result_id"
+            f" WHERE {' AND '.join(clauses)} ORDER BY f.rank, f.rowid LIMIT ?"
+        )
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [
+            {
+                "session_id": row[0],
+                "timestamp": row[1],
+                "position": row[2],
+                "question_id": _question_id(row[3]),
+                "answer_codes": row[4].split(",") if row[4] else [],
+                "original_answer": row[5],
+                "survey_version": row[6],
+                "score": row[7],
+                "key": (row[7], row[8]),
+                "question": row[9],
+            }
+            for row in rows
+        ]
+
+    def build_search_index(self, batch_size: int = 5000) -> int:
+        """Проиндексировать ответы, сохраненные до появления answers_fts; повторный вызов ничего не делает"""
+        with self._lock:
+            pending = self._db.execute("SELECT value FROM meta WHERE key = 'fts_backfill_until'").fetchone()
+        if not pending:
+            return 0
+        if pending[0] is None:
+            # пустая метка от прежних версий на пустой базе - дописывать нечего
+            with self._lock:
+                self._db.execute("DELETE FROM meta WHERE key = 'fts_backfill_until'")
+                self._db.commit()
+            return 0
+        until, indexed, last = int(pending[0]), 0, 0
+        while True:
+            # порциями, чтобы не держать блокировку записи на весь проход
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT rowid, original_answer FROM answers WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?",
+                    (last, until, batch_size),
+                ).fetchall()
+                if not rows:
+                    self._db.execute("DELETE FROM meta WHERE key = 'fts_backfill_until'")
+                    self._db.commit()
+                    return indexed
+                entries = [(rowid, stems) for rowid, stems in ((r[0], index_text(r[1])) for r in rows) if stems]
+                # OR REPLACE: после прерванного прохода строки индексируются повторно без ошибок
+                self._db.executemany("INSERT OR REPLACE INTO answers_fts (rowid, stems) VALUES (?, ?)", entries)
+                self._db.commit()
+            indexed += len(entries)
+            last = rows[-1][0]
+
+    def _iter_rows(self, sql: str, params, batch_size: int):
+        # отдельное соединение на чтение: WAL не блокирует писателей, пока идет обход
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            cursor = db.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            db.close()
+
+    def migrate_json_dir(self, results_dir: str = "results") -> int:
+        """Одноразовый перенос results/survey_*.json; повторный вызов ничего не делает"""
+        with self._lock:
+            done = self._db.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done or not os.path.isdir(results_dir):
+            return 0
+
+        imported = 0
+        with self._lock:
+            for filename in sorted(os.listdir(results_dir)):
+                if not (filename.startswith("survey_") and filename.endswith(".json")):
+                    continue
+                try:
+                    with open(os.path.join(results_dir, filename), "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    self._insert(data["session_id"], data.get("answers", []), data["timestamp"], data.get("survey_version"))
+                    imported += 1
+                except Exception as e:
+                    print(f"Error migrating {filename}: {e}")
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                (datetime.now().isoformat(),),
+            )
+            self._db.commit()
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _question_id(value: str):
+    """answers.question_id хранится текстом; числовые id отдаются числами, как в записях ответов"""
+    return int(value) if value.isascii() and value.isdigit() and str(int(value)) == value else value
+
+
+def _filters(prefix: str, since: Optional[str], until: Optional[str], survey_version: Optional[str], extra=None):
+    """WHERE по диапазону времени [since, until) и версии опроса"""
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{prefix}timestamp >= ?")
+        params.append(since)
+    if until:
+        clauses.append(f"{prefix}timestamp < ?")
+        params.append(until)
+    if survey_version:
+        clauses.append(f"{prefix}survey_version = ?")
+        params.append(survey_version)
+    if extra:
+        clauses.append(extra[0])
+        params.append(extra[1])
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Хранилище результатов опроса")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="перенести results/*.json в SQLite")
+    migrate.add_argument("results_dir", nargs="?", default="results")
+    migrate.add_argument("--db", default=os.getenv("RESULTS_DB", DEFAULT_DB_PATH))
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    count = store.migrate_json_dir(args.results_dir)
+    print(f"Imported {count} results into {args.db}")
+    store.close()
@@ -0,0 +1,494 @@
+"""Хранилище сессий опроса.
+
+Общий интерфейс SessionStore и три реализации:
+- MemorySessionStore - LRU + TTL в памяти процесса (по умолчанию);
+- SQLiteSessionStore - файл SQLite в режиме WAL, переживает перезапуск;
+- RedisSessionStore - общий Redis для нескольких воркеров.
+
+Выбор через SESSION_STORE: "memory", "sqlite:///sessions.sqlite3" или "redis://localhost:6379/0".
+После изменения сессии ее нужно сохранить через save().
+
+Каждая реализация держит вторичный индекс незавершенных сессий с ответами
+по (started_at, id): страница админки читает только его и останавливается,
+как только набрано нужное число сессий (iter_in_progress).
+
+Сессии, удаленные по TTL или вытесненные по LRU, передаются в on_evict(session_id),
+чтобы счетчики в памяти (live_stats) не считали брошенные сессии активными.
+Истекшие сессии убирает sweep(); его нужно вызывать периодически.
+"""
+import asyncio
+import bisect
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from answer_record import AnswerRecord
+
+
+DEFAULT_TTL_SECONDS = 72 * 3600
+
+
+class Session:
+    """Компактная запись сессии; ответы - AnswerRecord без текстов опроса"""
+
+    __slots__ = ("id", "survey_version", "started_at", "current_question_index", "answers", "updated_at", "completed")
+
+    def __init__(
+        self,
+        id: str,
+        survey_version: Optional[str],
+        started_at: Optional[str] = None,
+        current_question_index: int = 0,
+        answers: Optional[List[AnswerRecord]] = None,
+        updated_at: Optional[float] = None,
+        completed: bool = False,
+    ):
+        self.id = id
+        self.survey_version = survey_version
+        self.started_at = started_at or datetime.now().isoformat()
+        self.current_question_index = current_question_index
+        self.answers = answers if answers is not None else []
+        self.updated_at = updated_at or time.time()
+        # опрос пройден до конца; ставит обработчик чата перед save()
+        self.completed = bool(completed)
+
+    @property
+    def in_progress(self) -> bool:
+        return bool(self.answers) and not self.completed
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """Ключ порядка в индексе незавершенных сессий"""
+        return (self.started_at, self.id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        data["answers"] = [answer.pack() for answer in self.answers]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Session":
+        fields = {slot: data.get(slot) for slot in cls.__slots__ if slot in data}
+        if fields.get("answers") is not None:
+            # сессии, сохраненные до компактного формата, хранят полные dict-записи
+            fields["answers"] = [AnswerRecord.unpack(answer) for answer in fields["answers"]]
+        return cls(**fields)
+
+    def dumps(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, raw) -> "Session":
+        return cls.from_dict(json.loads(raw))
+
+
+class SessionStore(ABC):
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS, on_evict: Optional[Callable[[str], None]] = None):
+        # сессии без активности дольше ttl удаляются
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+
+    def _evicted(self, session_ids):
+        if self.on_evict is None:
+            return
+        for session_id in session_ids:
+            try:
+                self.on_evict(session_id)
+            except Exception as e:
+                print(f"Error in session eviction callback: {e}")
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[Session]:
+        ...
+
+    @abstractmethod
+    async def save(self, session: Session):
+        ...
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def iter_sessions(self) -> AsyncIterator[Session]:
+        """Все живые сессии (для админки)"""
+
+    async def iter_in_progress(
+        self,
+        after: Optional[Tuple[str, str]] = None,
+        newest_first: bool = True,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+    ) -> AsyncIterator[Session]:
+        """Незавершенные сессии с ответами по (started_at, id), начиная после after.
+
+        started_at в [since, until). Реализации читают индекс порциями, так что
+        вызывающий код может остановиться, набрав страницу. Здесь - общий
+        вариант полным проходом для хранилищ без индекса.
+        """
+        bounds = _KeyBounds(after, newest_first, since, until)
+        sessions = [session async for session in self.iter_sessions() if session.in_progress and bounds.contains(session.key)]
+        sessions.sort(key=lambda session: session.key, reverse=newest_first)
+        for session in sessions:
+            yield session
+
+    async def sweep(self):
+        """Удалить истекшие сессии (и сообщить о них в on_evict)"""
+
+    async def close(self):
+        pass
+
+
+class _KeyBounds:
+    """Диапазон ключей (started_at, id): после after, started_at в [since, until)"""
+
+    def __init__(self, after, newest_first: bool, since: Optional[str], until: Optional[str]):
+        self.newest_first = newest_first
+        self.lower = (since, "") if since else None
+        self.upper = (until, "") if until else None
+        after = tuple(after) if after else None
+        # after исключается так же, как until (по убыванию) или как предыдущий ключ (по возрастанию)
+        if after and newest_first:
+            self.upper = min(self.upper, after) if self.upper else after
+        self.after = after if not newest_first else None
+
+    def contains(self, key: Tuple[str, str]) -> bool:
+        if self.lower and key < self.lower:
+            return False
+        if self.upper and key >= self.upper:
+            return False
+        return not (self.after and key <= self.after)
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS, max_sessions: int = 100000, on_evict=None):
+        super().__init__(ttl_seconds, on_evict)
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        # отсортированные ключи (started_at, id) незавершенных сессий с ответами
+        self._in_progress: List[Tuple[str, str]] = []
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.time() - session.updated_at > self.ttl_seconds:
+            self._remove(session_id)
+            self._evicted([session_id])
+            return None
+        return session
+
+    async def save(self, session: Session):
+        session.updated_at = time.time()
+        previous = self._sessions.get(session.id)
+        if previous is not None and previous is not session:
+            self._unindex(previous)
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        if session.in_progress:
+            self._index(session)
+        else:
+            self._unindex(session)
+        self._evict()
+
+    async def delete(self, session_id: str):
+        self._remove(session_id)
+
+    async def iter_sessions(self) -> AsyncIterator[Session]:
+        self._evict()
+        for session in list(self._sessions.values()):
+            yield session
+
+    async def iter_in_progress(self, after=None, newest_first=True, since=None, until=None) -> AsyncIterator[Session]:
+        self._evict()
+        bounds = _KeyBounds(after, newest_first, since, until)
+        last = None
+        while True:
+            # позиция ищется заново на каждом шаге: между шагами индекс может измениться
+            keys = self._in_progress
+            if newest_first:
+                upper = last or bounds.upper
+                position = (bisect.bisect_left(keys, upper) if upper else len(keys)) - 1
+                if position < 0:
+                    return
+            else:
+                previous = last or bounds.after
+                position = max(
+                    bisect.bisect_right(keys, previous) if previous else 0,
+                    bisect.bisect_left(keys, bounds.lower) if bounds.lower else 0,
+                )
+                if position >= len(keys):
+                    return
+            key = keys[position]
+            if not bounds.contains(key):
+                return
+            last = key
+            session = self._sessions.get(key[1])
+            if session is not None and session.in_progress:
+                yield session
+
+    def _index(self, session: Session):
+        keys = self._in_progress
+        position = bisect.bisect_left(keys, session.key)
+        if position == len(keys) or keys[position] != session.key:
+            keys.insert(position, session.key)
+
+    def _unindex(self, session: Session):
+        keys = self._in_progress
+        position = bisect.bisect_left(keys, session.key)
+        if position < len(keys) and keys[position] == session.key:
+            del keys[position]
+
+    def _remove(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._unindex(session)
+        return session
+
+    async def sweep(self):
+        self._evict()
+
+    def _evict(self):
+        # самые старые по последнему изменению - в начале
+        deadline = time.time() - self.ttl_seconds
+        evicted = []
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if len(self._sessions) > self.max_sessions or oldest.updated_at < deadline:
+                self._remove(oldest.id)
+                evicted.append(oldest.id)
+            else:
+                break
+        self._evicted(evicted)
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str, ttl_seconds: float = DEFAULT_TTL_SECONDS, on_evict=None):
+        super().__init__(ttl_seconds, on_evict)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " started_at TEXT,"
+            " in_progress INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+        if "in_progress" not in columns:
+            # база от прежней версии: колонки индекса заполняются из данных сессий один раз
+            self._db.execute("ALTER TABLE sessions ADD COLUMN started_at TEXT")
+            self._db.execute("ALTER TABLE sessions ADD COLUMN in_progress INTEGER NOT NULL DEFAULT 0")
+            rows = self._db.execute("SELECT data FROM sessions").fetchall()
+            self._db.executemany(
+                "UPDATE sessions SET started_at = ?, in_progress = ? WHERE id = ?",
+                [(session.started_at, int(session.in_progress), session.id) for session in (Session.loads(data) for (data,) in rows)],
+            )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at)")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sessions_in_progress ON sessions(in_progress, started_at, id)"
+        )
+        self._db.commit()
+        self._writes = 0
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+            self._db.commit()
+            return rows
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT data FROM sessions WHERE id = ? AND updated_at >= ?",
+            (session_id, time.time() - self.ttl_seconds),
+        )
+        return Session.loads(rows[0][0]) if rows else None
+
+    async def save(self, session: Session):
+        session.updated_at = time.time()
+        await asyncio.to_thread(
+            self._execute,
+            "INSERT OR REPLACE INTO sessions (id, data, updated_at, started_at, in_progress) VALUES (?, ?, ?, ?, ?)",
+            (session.id, session.dumps(), session.updated_at, session.started_at, int(session.in_progress)),
+        )
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            await self.sweep()
+
+    async def sweep(self):
+        evicted = await asyncio.to_thread(self._delete_expired, time.time() - self.ttl_seconds)
+        self._evicted(evicted)
+
+    def _delete_expired(self, deadline: float) -> List[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM sessions WHERE updated_at < ?", (deadline,)).fetchall()
+            self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (deadline,))
+            self._db.commit()
+        return [row[0] for row in rows]
+
+    async def delete(self, session_id: str):
+        await asyncio.to_thread(self._execute, "DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    async def iter_sessions(self) -> AsyncIterator[Session]:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT data FROM sessions WHERE updated_at >= ?", (time.time() - self.ttl_seconds,)
+        )
+        for (data,) in rows:
+            yield Session.loads(data)
+
+    async def iter_in_progress(
+        self, after=None, newest_first=True, since=None, until=None, batch_size: int = 200
+    ) -> AsyncIterator[Session]:
+        clauses, params = ["in_progress = 1"], []
+        if since:
+            clauses.append("started_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("started_at < ?")
+            params.append(until)
+        order = "DESC" if newest_first else "ASC"
+        sql = (
+            f"SELECT data, started_at, id FROM sessions WHERE {' AND '.join(clauses)} AND updated_at >= ?"
+            " {keyset}"
+            f" ORDER BY started_at {order}, id {order} LIMIT ?"
+        )
+        last = tuple(after) if after else None
+        while True:
+            keyset = "AND (started_at, id) " + ("<" if newest_first else ">") + " (?, ?)" if last else ""
+            rows = await asyncio.to_thread(
+                self._execute,
+                sql.format(keyset=keyset),
+                (*params, time.time() - self.ttl_seconds, *(last or ()), batch_size),
+            )
+            for data, _, _ in rows:
+                yield Session.loads(data)
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1][1], rows[-1][2])
+
+    async def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RedisSessionStore(SessionStore):
+    KEY_PREFIX = "survey:session:"
+    # индекс незавершенных сессий: sorted set с одинаковым score, порядок - по члену
+    # "started_at\0id" (\0 меньше любого символа, поэтому порядок совпадает с (started_at, id))
+    IN_PROGRESS_KEY = "survey:sessions_in_progress"
+    # все сессии с временем последнего изменения (score) - для sweep; члены того же вида
+    UPDATED_KEY = "survey:sessions_updated"
+
+    def __init__(self, url: str, ttl_seconds: float = DEFAULT_TTL_SECONDS, client=None, on_evict=None):
+        super().__init__(ttl_seconds, on_evict)
+        if client is None:
+            try:
+                import redis.asyncio as redis_asyncio
+            except ImportError:
+                raise RuntimeError("Redis session store requires the 'redis' package (pip install redis)")
+            client = redis_asyncio.from_url(url)
+        # client можно передать снаружи (например, fakeredis в тестах)
+        self._redis = client
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        raw = await self._redis.get(self.KEY_PREFIX + session_id)
+        return Session.loads(raw) if raw is not None else None
+
+    async def save(self, session: Session):
+        session.updated_at = time.time()
+        # TTL продлевается при каждом изменении
+        await self._redis.set(self.KEY_PREFIX + session.id, session.dumps(), ex=int(self.ttl_seconds))
+        member = _index_member(session.key)
+        await self._redis.zadd(self.UPDATED_KEY, {member: session.updated_at})
+        if session.in_progress:
+            await self._redis.zadd(self.IN_PROGRESS_KEY, {member: 0})
+        else:
+            await self._redis.zrem(self.IN_PROGRESS_KEY, member)
+
+    async def delete(self, session_id: str):
+        session = await self.get(session_id)
+        await self._redis.delete(self.KEY_PREFIX + session_id)
+        if session is not None:
+            member = _index_member(session.key)
+            await self._redis.zrem(self.IN_PROGRESS_KEY, member)
+            await self._redis.zrem(self.UPDATED_KEY, member)
+
+    async def sweep(self):
+        # сами ключи сессий удаляет TTL Redis; здесь - члены индексов и уведомления
+        members = await self._redis.zrangebyscore(self.UPDATED_KEY, "-inf", time.time() - self.ttl_seconds)
+        if not members:
+            return
+        await self._redis.zrem(self.UPDATED_KEY, *members)
+        await self._redis.zrem(self.IN_PROGRESS_KEY, *members)
+        members = [member.decode("utf-8") if isinstance(member, bytes) else member for member in members]
+        self._evicted(member.split("\0", 1)[1] for member in members)
+
+    async def iter_sessions(self) -> AsyncIterator[Session]:
+        async for key in self._redis.scan_iter(match=self.KEY_PREFIX + "*", count=500):
+            raw = await self._redis.get(key)
+            if raw is not None:
+                yield Session.loads(raw)
+
+    async def iter_in_progress(
+        self, after=None, newest_first=True, since=None, until=None, batch_size: int = 200
+    ) -> AsyncIterator[Session]:
+        bounds = _KeyBounds(after, newest_first, since, until)
+        if newest_first:
+            low = "[" + _index_member(bounds.lower) if bounds.lower else "-"
+            high = "(" + _index_member(bounds.upper) if bounds.upper else "+"
+        else:
+            high = "(" + _index_member(bounds.upper) if bounds.upper else "+"
+            if bounds.after and (not bounds.lower or bounds.after >= bounds.lower):
+                low = "(" + _index_member(bounds.after)
+            else:
+                low = "[" + _index_member(bounds.lower) if bounds.lower else "-"
+        while True:
+            if newest_first:
+                members = await self._redis.zrevrangebylex(self.IN_PROGRESS_KEY, high, low, start=0, num=batch_size)
+            else:
+                members = await self._redis.zrangebylex(self.IN_PROGRESS_KEY, low, high, start=0, num=batch_size)
+            for member in members:
+                member = member.decode("utf-8") if isinstance(member, bytes) else member
+                raw = await self._redis.get(self.KEY_PREFIX + member.split("\0", 1)[1])
+                if raw is None:
+                    # сессия истекла по TTL Redis - убираем ее и из индекса
+                    await self._redis.zrem(self.IN_PROGRESS_KEY, member)
+                    continue
+                session = Session.loads(raw)
+                if session.in_progress:
+                    yield session
+            if len(members) < batch_size:
+                return
+            last = members[-1].decode("utf-8") if isinstance(members[-1], bytes) else members[-1]
+            if newest_first:
+                high = "(" + last
+            else:
+                low = "(" + last
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def _index_member(key: Tuple[str, str]) -> str:
+    return key[0] + "\0" + key[1]
+
+
+def create_session_store(
+    url: str, ttl_seconds: float = DEFAULT_TTL_SECONDS, on_evict: Optional[Callable[[str], None]] = None
+) -> SessionStore:
+    if not url or url == "memory":
+        return MemorySessionStore(ttl_seconds, on_evict=on_evict)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], ttl_seconds, on_evict=on_evict)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionStore(url, ttl_seconds, on_evict=on_evict)
+    raise ValueError(f"Unsupported SESSION_STORE: {url}")
@@ -0,0 +1,199 @@
+"""Реестр опросов.
+
+Опрос читается с диска один раз и хранится в памяти в скомпилированном виде:
+кортежи вопросов, словари code -> option и индексы id -> question.
+Горячий путь (каждое сообщение в чате) только читает готовые объекты.
+
+Файл опроса - либо список вопросов, либо объект
+{"settings": {...}, "questions": [...]} с настройками опроса.
+"""
+import hashlib
+import json
+import threading
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+
+QUESTION_TYPES = ("single_choice", "multiple_choice")
+
+
+@dataclass(frozen=True)
+class CompiledOption:
+    code: str
+    text: str
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"code": self.code, "text": self.text}
+
+
+@dataclass(frozen=True)
+class CompiledQuestion:
+    id: Any
+    index: int
+    question: str
+    type: str
+    options: Tuple[CompiledOption, ...]
+    # code -> option, для быстрого поиска текста по коду
+    options_by_code: Mapping[str, CompiledOption] = field(repr=False)
+
+    @property
+    def codes(self) -> Tuple[str, ...]:
+        return tuple(opt.code for opt in self.options)
+
+    def texts_for(self, codes: List[str]) -> List[str]:
+        """Тексты вариантов в порядке кодов, неизвестные коды пропускаются"""
+        return [self.options_by_code[c].text for c in codes if c in self.options_by_code]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Новый dict в исходном формате survey_questions.json (для API)"""
+        return {
+            "id": self.id,
+            "question": self.question,
+            "type": self.type,
+            "options": [opt.to_dict() for opt in self.options],
+        }
+
+
+@dataclass(frozen=True)
+class CompiledSurvey:
+    version: str
+    questions: Tuple[CompiledQuestion, ...]
+    by_id: Mapping[Any, CompiledQuestion] = field(repr=False)
+    # str(id) -> question: в таблице ответов и в запросах админки id приходит строкой
+    by_str_id: Mapping[str, CompiledQuestion] = field(default_factory=lambda: MappingProxyType({}), repr=False)
+    settings: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}), repr=False)
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def question_at(self, index: int) -> Optional[CompiledQuestion]:
+        if 0 <= index < len(self.questions):
+            return self.questions[index]
+        return None
+
+    def question_for(self, question_id: Any) -> Optional[CompiledQuestion]:
+        question = self.by_id.get(question_id)
+        if question is None:
+            question = self.by_str_id.get(str(question_id))
+        return question
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return [q.to_dict() for q in self.questions]
+
+
+def split_survey_data(data: Any) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Содержимое файла опроса -> (вопросы, настройки)"""
+    if isinstance(data, dict):
+        return data.get("questions", []), dict(data.get("settings") or {})
+    return data, {}
+
+
+def survey_file_data(questions: List[Dict[str, Any]], settings: Optional[Dict[str, Any]] = None) -> Any:
+    """Обратное к split_survey_data: без настроек файл остается списком вопросов"""
+    if settings:
+        return {"settings": settings, "questions": questions}
+    return questions
+
+
+def survey_version_id(questions: List[Dict[str, Any]], settings: Optional[Dict[str, Any]] = None) -> str:
+    """Идентификатор версии - хеш от канонического JSON опроса"""
+    canonical = json.dumps(survey_file_data(questions, settings), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def compile_survey(
+    questions: List[Dict[str, Any]],
+    version: Optional[str] = None,
+    settings: Optional[Dict[str, Any]] = None,
+) -> CompiledSurvey:
+    """Проверка и компиляция списка вопросов. При ошибке формата - ValueError"""
+    compiled = []
+    by_id = {}
+    for index, raw in enumerate(questions):
+        if not all(key in raw for key in ("id", "question", "type", "options")):
+            raise ValueError("Invalid question structure")
+        if raw["type"] not in QUESTION_TYPES:
+            raise ValueError("Invalid question type")
+
+        options = tuple(CompiledOption(code=str(opt["code"]), text=str(opt["text"])) for opt in raw["options"])
+        question = CompiledQuestion(
+            id=raw["id"],
+            index=index,
+            question=raw["question"],
+            type=raw["type"],
+            options=options,
+            options_by_code=MappingProxyType({opt.code: opt for opt in options}),
+        )
+        compiled.append(question)
+        by_id[question.id] = question
+
+    return CompiledSurvey(
+        version=version or survey_version_id(questions, settings),
+        questions=tuple(compiled),
+        by_id=MappingProxyType(by_id),
+        by_str_id=MappingProxyType({str(question.id): question for question in compiled}),
+        settings=MappingProxyType(dict(settings or {})),
+    )
+
+
+class SurveyRegistry:
+    """Хранит все скомпилированные версии и ссылку на текущую.
+
+    Чтение текущей версии - одно обращение к атрибуту, без блокировок:
+    замена ссылки в CPython атомарна, а сами объекты неизменяемы.
+    С хранилищем версий (survey_store.SurveyVersionStore) прошлые версии,
+    на которые ссылаются сессии, подгружаются при первом обращении.
+    """
+
+    def __init__(self, path: str, store=None):
+        self.path = path
+        self.store = store
+        self._lock = threading.Lock()
+        self._versions: Dict[str, CompiledSurvey] = {}
+        self._current: Optional[CompiledSurvey] = None
+
+    def load(self) -> CompiledSurvey:
+        """Прочитать файл опроса с диска (при старте)"""
+        with open(self.path, "r", encoding="utf-8") as f:
+            questions, settings = split_survey_data(json.load(f))
+        if self.store is not None:
+            self.store.save(questions, settings)
+        return self.publish(questions, settings)
+
+    def publish(self, questions: List[Dict[str, Any]], settings: Optional[Dict[str, Any]] = None) -> CompiledSurvey:
+        """Скомпилировать опрос и атомарно сделать его текущим"""
+        survey = compile_survey(questions, settings=settings)
+        with self._lock:
+            survey = self._versions.setdefault(survey.version, survey)
+            self._current = survey
+        return survey
+
+    @property
+    def current(self) -> CompiledSurvey:
+        survey = self._current
+        if survey is None:
+            survey = self.load()
+        return survey
+
+    def get(self, version: Optional[str]) -> CompiledSurvey:
+        """Версия по id; пустая - текущая, неизвестная - KeyError"""
+        if version is None:
+            return self.current
+        survey = self.find(version)
+        if survey is None:
+            raise KeyError(version)
+        return survey
+
+    def find(self, version: Optional[str]) -> Optional[CompiledSurvey]:
+        """Версия по id или None - без подстановки текущей (для исторических данных)"""
+        if version is None:
+            return None
+        survey = self._versions.get(version)
+        if survey is None and self.store is not None and version in self.store:
+            questions, settings = self.store.load(version)
+            with self._lock:
+                survey = self._versions.setdefault(
+                    version, compile_survey(questions, version=version, settings=settings)
+                )
+        return survey
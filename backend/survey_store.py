@@ -0,0 +1,124 @@
+"""Хранилище версий опроса с адресацией по содержимому.
+
+Каждая версия лежит в survey_versions/<id>.json, где id - хеш канонического
+JSON опроса (survey_version_id), тот же, что записывается в сессии и
+результаты. Повторная загрузка того же опроса ничего не пишет.
+
+manifest.json хранит все, что нужно списку версий (дата, число вопросов,
+первый вопрос), поэтому список читается из памяти без открытия файлов
+версий. Сами версии читаются по запросу и кешируются.
+
+Старые файлы survey_v<дата>.json индексируются в манифест один раз, когда
+манифеста еще нет.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from persistence import atomic_write_json
+from survey_registry import split_survey_data, survey_file_data, survey_version_id
+
+
+MANIFEST_NAME = "manifest.json"
+LEGACY_PREFIX = "survey_v"
+
+
+class SurveyVersionStore:
+    def __init__(self, directory: str = "survey_versions", cache_size: int = 32):
+        self.directory = directory
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        # id версии -> (вопросы, настройки), последние прочитанные
+        self._cache: "OrderedDict[str, Tuple[List[Dict[str, Any]], Dict[str, Any]]]" = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self._entries: Dict[str, Dict[str, Any]] = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                return {entry["version"]: entry for entry in json.load(f).get("versions", [])}
+        entries = self._index_legacy_files()
+        self._entries = entries
+        self._write_manifest()
+        return entries
+
+    def _index_legacy_files(self) -> Dict[str, Dict[str, Any]]:
+        entries = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not (filename.startswith(LEGACY_PREFIX) and filename.endswith(".json")):
+                continue
+            try:
+                created_at = datetime.strptime(filename[len(LEGACY_PREFIX):-len(".json")], "%Y%m%d_%H%M%S").isoformat()
+                with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as f:
+                    questions, settings = split_survey_data(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Skipping survey version {filename}: {e}")
+                continue
+            entry = _entry(survey_version_id(questions, settings), filename, questions, created_at)
+            entries.setdefault(entry["version"], entry)
+        return entries
+
+    def _write_manifest(self):
+        versions = sorted(self._entries.values(), key=lambda e: e["created_at"])
+        atomic_write_json(self._manifest_path, {"versions": versions})
+
+    def save(self, questions: List[Dict[str, Any]], settings: Optional[Dict[str, Any]] = None) -> Tuple[str, bool]:
+        """Сохранить версию; вернуть (id, True) или (id, False), если такая уже есть"""
+        version = survey_version_id(questions, settings)
+        with self._lock:
+            if version in self._entries:
+                return version, False
+            filename = f"{version}.json"
+            atomic_write_json(os.path.join(self.directory, filename), survey_file_data(questions, settings))
+            self._entries[version] = _entry(version, filename, questions, datetime.now().isoformat())
+            self._write_manifest()
+        return version, True
+
+    def __contains__(self, version: str) -> bool:
+        return version in self._entries
+
+    def entry(self, version: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(version)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Метаданные всех версий, новые сверху (без чтения файлов)"""
+        return sorted((dict(e) for e in self._entries.values()), key=lambda e: e["created_at"], reverse=True)
+
+    def resolve(self, key: str) -> Optional[str]:
+        """id версии по id или по имени файла (старые ссылки survey_v<дата>.json)"""
+        if key in self._entries:
+            return key
+        for entry in self._entries.values():
+            if entry["filename"] == key:
+                return entry["version"]
+        return None
+
+    def load(self, version: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """(вопросы, настройки) версии; KeyError - такой версии нет"""
+        with self._lock:
+            cached = self._cache.get(version)
+            if cached is not None:
+                self._cache.move_to_end(version)
+                return cached
+        entry = self._entries[version]
+        with open(os.path.join(self.directory, entry["filename"]), "r", encoding="utf-8") as f:
+            loaded = split_survey_data(json.load(f))
+        with self._lock:
+            self._cache[version] = loaded
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return loaded
+
+
+def _entry(version: str, filename: str, questions: List[Dict[str, Any]], created_at: str) -> Dict[str, Any]:
+    return {
+        "version": version,
+        "filename": filename,
+        "created_at": created_at,
+        "questions_count": len(questions),
+        "first_question": questions[0].get("question") if questions else None,
+    }
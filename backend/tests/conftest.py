@@ -0,0 +1,31 @@
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture
+def app_main(tmp_path, monkeypatch):
+    """Модуль main, собранный заново в пустом рабочем каталоге tmp_path"""
+    pytest.importorskip("fastapi")
+    pytest.importorskip("openai")
+    shutil.copy(os.path.join(BACKEND_DIR, "survey_questions.json"), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("RESULTS_DB", str(tmp_path / "results.sqlite3"))
+    monkeypatch.setenv("SESSION_STORE", "memory")
+    monkeypatch.setenv("SURVEY_VERSIONS_DIR", str(tmp_path / "survey_versions"))
+    monkeypatch.delenv("MATCH_CACHE_DB", raising=False)
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    # метрики main регистрируются при импорте: каждая сборка - с чистого реестра
+    from metrics import REGISTRY
+    monkeypatch.setattr(REGISTRY, "_metrics", dict(REGISTRY._metrics))
+    sys.modules.pop("main", None)
+    try:
+        yield importlib.import_module("main")
+    finally:
+        sys.modules.pop("main", None)
@@ -0,0 +1,21 @@
+"""Класс запроса для допуска определяется без обращения к хранилищу сессий"""
+import asyncio
+
+
+def test_chat_requests_are_classified_from_method_and_path(app_main, monkeypatch):
+    main = app_main
+
+    async def no_lookup(session_id):
+        raise AssertionError("admission must not read the session store")
+
+    monkeypatch.setattr(main.session_store, "get", no_lookup)
+
+    def classify(method, path):
+        return asyncio.run(main.classify_chat_request({"type": "http", "method": method, "path": path}))
+
+    assert classify("POST", "/chat/start") == main.START
+    assert classify("POST", "/chat/start/abc") == main.TURN
+    assert classify("POST", "/chat/message") == main.TURN
+    assert classify("POST", "/chat/message/stream") == main.TURN
+    assert classify("OPTIONS", "/chat/start/abc") is None
+    assert classify("GET", "/admin/stats") is None
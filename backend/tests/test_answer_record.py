@@ -0,0 +1,66 @@
+"""Компактные записи ответов: тексты старых результатов не подменяются текущим опросом"""
+import json
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from answer_record import AnswerRecord, expand_answers  # noqa: E402
+from results_store import ResultsStore  # noqa: E402
+from survey_registry import SurveyRegistry, compile_survey  # noqa: E402
+
+QUESTIONS = [
+    {"id": 1, "question": "Сколько вам лет?", "type": "single_choice",
+     "options": [{"code": "A1", "text": "До 18"}, {"code": "A2", "text": "18 и старше"}]},
+]
+
+LEGACY_ANSWER = {
+    "question_id": 1,
+    "question": "Ваш возраст?",
+    "answer_codes": ["A1"],
+    "answer_texts": ["Младше 18"],
+    "original_answer": "мне 16",
+}
+
+
+def test_new_record_is_expanded_from_its_version():
+    survey = compile_survey(QUESTIONS)
+    record = AnswerRecord(1, ["A2"], "20")
+    assert record.pack() == [1, ["A2"], "20"]
+    assert record.expand(survey)["answer_texts"] == ["18 и старше"]
+    assert record.expand(None)["question"] is None
+
+
+def test_legacy_texts_survive_storage_and_win_over_survey(tmp_path):
+    results_dir = tmp_path / "results"
+    results_dir.mkdir()
+    (results_dir / "survey_1.json").write_text(
+        json.dumps({"session_id": "old", "timestamp": "2024-01-01T00:00:00", "answers": [LEGACY_ANSWER]}),
+        encoding="utf-8",
+    )
+    store = ResultsStore(str(tmp_path / "results.sqlite3"))
+    assert store.migrate_json_dir(str(results_dir)) == 1
+
+    doc = next(store.iter_results())
+    assert "survey_version" not in doc
+    expanded = expand_answers(doc["answers"], compile_survey(QUESTIONS))
+    assert expanded[0]["question"] == "Ваш возраст?"
+    assert expanded[0]["answer_texts"] == ["Младше 18"]
+
+    row = next(store.iter_answer_rows())
+    assert row["question"] == "Ваш возраст?"
+    assert row["answer_texts"] == "Младше 18"
+    store.close()
+
+
+def test_registry_does_not_substitute_current_for_unknown_version():
+    registry = SurveyRegistry("missing.json")
+    current = registry.publish(QUESTIONS)
+    assert registry.get(None) is current
+    assert registry.find(None) is None
+    assert registry.find("unknown") is None
+    with pytest.raises(KeyError):
+        registry.get("unknown")
@@ -0,0 +1,44 @@
+"""Пакетная классификация: id вопроса из файла может прийти строкой"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+pytest.importorskip("openai")
+
+from bulk_classify import BulkClassifier, BulkItem, BulkJob  # noqa: E402
+from survey_registry import compile_survey  # noqa: E402
+
+QUESTIONS = [
+    {"id": 1, "question": "Чем вы занимаетесь?", "type": "single_choice",
+     "options": [{"code": "A1", "text": "Работаю"}, {"code": "A2", "text": "Учусь"}]},
+]
+
+
+class FakeLLM:
+    def __init__(self):
+        self.prompts = []
+
+    async def complete(self, messages, **kwargs):
+        self.prompts.append(messages[-1]["content"])
+        return json.dumps({"results": [{"n": 1, "codes": ["A2"]}, {"n": 2, "codes": ["A1"]}]})
+
+
+def test_string_and_int_question_ids_share_one_batch():
+    llm = FakeLLM()
+    classifier = BulkClassifier(llm, resolve_locally=lambda answer, question, version: [])
+    survey = compile_survey(QUESTIONS)
+    items = [BulkItem("1", "студент"), BulkItem(1, "инженер"), BulkItem("7", "что-то")]
+    job = BulkJob(id="job", total=len(items), survey_version=survey.version)
+
+    asyncio.run(classifier.run(job, survey, items))
+
+    assert len(llm.prompts) == 1
+    assert [r["answer_codes"] if r else None for r in job.results] == [["A2"], ["A1"], None]
+    assert job.results[0]["question_id"] == 1
+    assert job.errors == ["item 2: unknown question_id 7"]
@@ -0,0 +1,63 @@
+"""Экспорт: завершенный опрос выдается один раз - из базы или из очереди записи"""
+import csv
+import io
+import json
+import os
+import sys
+import threading
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from answer_record import AnswerRecord  # noqa: E402
+
+
+def test_completed_sessions_are_exported_once(app_main, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    main = app_main
+    survey = main.survey_registry.current
+    answers = [AnswerRecord(question.id, [question.options[0].code], "ответ") for question in survey.questions]
+
+    def session(session_id, answered):
+        item = main.new_session(session_id)
+        item.answers = answers[:answered]
+        item.current_question_index = answered
+        item.completed = answered == len(survey)
+        return item
+
+    # запись результатов стоит, пока тест не отпустит
+    release = threading.Event()
+    add_many = main.results_store.add_many
+
+    def blocked_add_many(records):
+        release.wait(10)
+        return add_many(records)
+
+    headers = {"Authorization": f"Bearer {main.ADMIN_TOKEN}"}
+    with TestClient(main.app) as client:
+        portal = client.portal
+        add_many([("saved", answers, "2024-01-01T10:00:00", survey.version)])
+        for item in (session("saved", len(survey)), session("queued", len(survey)), session("open", 1)):
+            portal.call(main.session_store.save, item)
+        monkeypatch.setattr(main.results_store, "add_many", blocked_add_many)
+        portal.call(main.save_survey_result, "queued", answers, survey.version)
+        try:
+            lines = client.get("/admin/export/jsonl", headers=headers).text.splitlines()
+            rows = list(csv.DictReader(io.StringIO(client.get("/admin/export/csv", headers=headers).text.lstrip("﻿"))))
+        finally:
+            release.set()
+
+        docs = [json.loads(line) for line in lines]
+        assert sorted((doc["session_id"], doc.get("status")) for doc in docs) == [
+            ("open", "in_progress"), ("queued", None), ("saved", None)
+        ]
+        queued = next(doc for doc in docs if doc["session_id"] == "queued")
+        assert queued["answers"][0]["question"] == survey.questions[0].question
+        assert sorted({row["session_id"] for row in rows}) == ["queued", "saved"]
+        assert len(rows) == 2 * len(survey)
+
+        # после записи результат берется из базы, и снова один раз
+        portal.call(main.result_writer.flush)
+        lines = client.get("/admin/export/jsonl", headers=headers).text.splitlines()
+        assert sorted(json.loads(line)["session_id"] for line in lines) == ["open", "queued", "saved"]
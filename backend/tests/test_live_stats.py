@@ -0,0 +1,27 @@
+"""Счетчики ответов не смешивают версии опроса с одинаковыми id и кодами"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from answer_record import AnswerRecord  # noqa: E402
+from live_stats import LiveStats  # noqa: E402
+from session_store import Session  # noqa: E402
+
+
+def test_tallies_are_kept_per_survey_version():
+    stats = LiveStats()
+    old = Session("old", "v1")
+    old.answers = [AnswerRecord(1, ["A1"], "16"), AnswerRecord(2, ["B2"], "нет")]
+    stats.restore(old, completed=True)
+
+    new = Session("new", "v2")
+    stats.session_started(new)
+    new.answers = [AnswerRecord(1, ["A2"], "20")]
+    stats.answer_recorded(new, new.answers[0])
+
+    assert stats.tallies("v1") == {1: {"A1": 1}, 2: {"B2": 1}}
+    assert stats.tallies("v2") == {1: {"A2": 1}}
+    assert stats.tallies("v2", 2) == {2: {}}
+    assert stats.tallies("v3") == {}
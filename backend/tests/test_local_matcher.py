@@ -0,0 +1,39 @@
+"""Локальное сопоставление: матричные оценки вариантов"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from local_matcher import LocalMatcher, QuestionIndex  # noqa: E402
+from survey_registry import compile_survey  # noqa: E402
+
+SURVEY = compile_survey([
+    {"id": 1, "question": "Где вы живете?", "type": "single_choice", "options": [
+        {"code": "A1", "text": "В большом городе"},
+        {"code": "A2", "text": "В поселке или деревне"},
+        {"code": "A3", "text": "Затрудняюсь ответить"},
+    ]},
+    {"id": 2, "question": "На каких языках пишете?", "type": "multiple_choice", "options": [
+        {"code": "C1", "text": "Python"},
+        {"code": "C2", "text": "C#"},
+        {"code": "C3", "text": "C++"},
+    ]},
+])
+
+
+def test_scores_are_bounded_and_rank_the_matching_option_first():
+    index = QuestionIndex(SURVEY.questions[0])
+    scores = dict(index.scores("живу в большом городе"))
+    assert list(scores) == ["A1", "A2", "A3"]
+    assert all(0.0 <= score <= 1.0 + 1e-9 for score in scores.values())
+    assert max(scores, key=scores.get) == "A1"
+    assert index.scores("") == [("A1", 0.0), ("A2", 0.0), ("A3", 0.0)]
+
+
+def test_confident_matches_resolve_locally():
+    matcher = LocalMatcher()
+    assert matcher.match("в большом городе", SURVEY.questions[0], SURVEY.version).codes == ["A1"]
+    assert matcher.match("не в городе", SURVEY.questions[0], SURVEY.version) is None
+    for answer, code in (("python", "C1"), ("C#", "C2"), ("c++", "C3")):
+        assert matcher.match(answer, SURVEY.questions[1], SURVEY.version).codes == [code]
@@ -0,0 +1,33 @@
+"""Ключ кеша сопоставления: "C#", "C++" и "C" - разные ответы"""
+import asyncio
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from match_cache import MatchCache, normalize_answer  # noqa: E402
+
+
+def test_hash_and_plus_stay_attached_to_words():
+    assert normalize_answer("  Ёлки, палки!  ") == "елки палки"
+    keys = {normalize_answer(answer) for answer in ("C#", "C++", "C", "С#", "С++", "С")}
+    assert len(keys) == 6
+    assert normalize_answer("Пишу на C# и C++.") == "пишу на c# и c++"
+
+
+def test_verdict_for_one_language_is_not_served_for_another(tmp_path):
+    async def scenario():
+        cache = MatchCache(db_path=str(tmp_path / "cache.sqlite3"))
+        await cache.put("v1", 3, "С#", ["C4"])
+        assert await cache.get("v1", 3, "с# ") == ["C4"]
+        assert await cache.get("v1", 3, "С++") is None
+        assert await cache.get("v1", 3, "C") is None
+        cache.close()
+
+        reopened = MatchCache(db_path=str(tmp_path / "cache.sqlite3"))
+        assert await reopened.get("v1", 3, "С#") == ["C4"]
+        assert await reopened.get("v1", 3, "С") is None
+        reopened.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,49 @@
+"""Фоновая запись результатов: битая строка не останавливает очередь"""
+import asyncio
+import json
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from answer_record import AnswerRecord  # noqa: E402
+from persistence import ResultWriter  # noqa: E402
+from results_store import ResultsStore  # noqa: E402
+
+
+class PoisonedStore(ResultsStore):
+    """Результат сессии "bad" не пишется никогда"""
+
+    def add_many(self, records):
+        if any(record[0] == "bad" for record in records):
+            raise ValueError("constraint failed")
+        return super().add_many(records)
+
+
+def test_poison_result_goes_to_dead_letter_and_queue_keeps_going(tmp_path):
+    async def scenario():
+        store = PoisonedStore(str(tmp_path / "results.sqlite3"))
+        written = []
+        writer = ResultWriter(
+            store, retry_delay=0, max_attempts=2, dead_letter_dir=str(tmp_path / "dead"),
+            on_written=lambda batch: written.extend(record.session_id for record in batch),
+        )
+        writer.start()
+        for session_id in ("s1", "s2", "bad", "s3", "s4"):
+            await writer.submit(session_id, [AnswerRecord(1, ["A1"], session_id)], survey_version="v1")
+        await asyncio.wait_for(writer.flush(), 5)
+        await writer.submit("s5", [AnswerRecord(1, ["A2"], "after")], survey_version="v1")
+        await asyncio.wait_for(writer.close(), 5)
+        return store, written
+
+    store, written = asyncio.run(scenario())
+    assert sorted(written) == ["s1", "s2", "s3", "s4", "s5"]
+    assert sorted(doc["session_id"] for doc in store.iter_results()) == ["s1", "s2", "s3", "s4", "s5"]
+    store.close()
+
+    assert os.listdir(tmp_path / "dead") == ["survey_bad.json"]
+    with open(tmp_path / "dead" / "survey_bad.json", encoding="utf-8") as f:
+        dead = json.load(f)
+    assert dead["survey_version"] == "v1" and "constraint failed" in dead["error"]
+    assert AnswerRecord.unpack(dead["answers"][0]) == AnswerRecord(1, ["A1"], "bad")
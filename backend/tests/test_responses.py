@@ -0,0 +1,61 @@
+"""Страницы /admin/responses: результат из очереди записи не теряется между источниками"""
+import os
+import sys
+import threading
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from answer_record import AnswerRecord  # noqa: E402
+
+
+def test_queued_result_is_paged_once(app_main, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    main = app_main
+    survey = main.survey_registry.current
+    answers = [AnswerRecord(question.id, [question.options[0].code], "ответ") for question in survey.questions]
+
+    release = threading.Event()
+    add_many = main.results_store.add_many
+
+    def blocked_add_many(records):
+        release.wait(10)
+        return add_many(records)
+
+    headers = {"Authorization": f"Bearer {main.ADMIN_TOKEN}"}
+
+    def pages(**params):
+        keys, cursor = [], None
+        while True:
+            query = {"limit": 1, **params, **({"cursor": cursor} if cursor else {})}
+            body = client.get("/admin/responses", params=query, headers=headers).json()
+            keys.extend((item["session_id"], item["status"]) for item in body["responses"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                return keys
+
+    with TestClient(main.app) as client:
+        portal = client.portal
+        add_many([("saved", answers, "2000-01-01T10:00:00", survey.version)])
+        open_session = main.new_session("open")
+        open_session.answers = answers[:1]
+        open_session.current_question_index = 1
+        portal.call(main.session_store.save, open_session)
+        monkeypatch.setattr(main.results_store, "add_many", blocked_add_many)
+        portal.call(main.save_survey_result, "queued", answers, survey.version)
+        try:
+            for order in ("desc", "asc"):
+                found = pages(order=order)
+                assert sorted(found) == [("open", "in_progress"), ("queued", "completed"), ("saved", "completed")]
+            assert pages(status="completed", since="2001-01-01") == [("queued", "completed")]
+            code = survey.questions[-1].options[0].code
+            assert sorted(pages(question_id=str(survey.questions[-1].id), answer_code=code)) == [
+                ("queued", "completed"), ("saved", "completed")
+            ]
+            queued = client.get("/admin/responses", params={"since": "2001-01-01", "status": "completed"}, headers=headers)
+            assert queued.json()["responses"][0]["answers"][0]["question"] == survey.questions[0].question
+        finally:
+            release.set()
+        portal.call(main.result_writer.flush)
+        assert sorted(pages()) == [("open", "in_progress"), ("queued", "completed"), ("saved", "completed")]
@@ -0,0 +1,24 @@
+"""Поиск по сохраненным ответам: id вопросов того же типа, что в записях ответов"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from answer_record import AnswerRecord  # noqa: E402
+from answer_search import fts_query, parse_query  # noqa: E402
+from results_store import ResultsStore  # noqa: E402
+
+
+def test_search_hits_keep_question_id_types(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite3"))
+    answers = [AnswerRecord(1, ["A1"], "кошка"), AnswerRecord("q07", ["B1"], "кошка"), AnswerRecord(12, ["C1"], "кошка")]
+    store.add_many([("s1", answers, "2024-01-01T10:00:00", "v1")])
+
+    match = fts_query(parse_query("кошка"))
+    hits = store.search_answers(match, 10)
+    assert sorted((hit["question_id"] for hit in hits), key=str) == [1, 12, "q07"]
+    page = store.query_results(10)
+    assert [answer.question_id for answer in page[0]["answers"]] == [1, "q07", 12]
+    assert [hit["question_id"] for hit in store.search_answers(match, 10, question_id="12")] == [12]
+    store.close()
@@ -0,0 +1,106 @@
+"""Индекс незавершенных сессий: тот же порядок и границы, что и полный проход"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from answer_record import AnswerRecord  # noqa: E402
+from live_stats import LiveStats  # noqa: E402
+from session_store import MemorySessionStore, RedisSessionStore, Session, SQLiteSessionStore  # noqa: E402
+
+
+def make_store(kind, tmp_path, **options):
+    if kind == "memory":
+        return MemorySessionStore(**options)
+    if kind == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), **options)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisSessionStore("redis://", client=fakeredis.FakeAsyncRedis(), **options)
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite", "redis"])
+def test_iter_in_progress_matches_full_scan(kind, tmp_path):
+    async def scenario():
+        store = make_store(kind, tmp_path)
+        rng = random.Random(7)
+        sessions = []
+        for n in range(120):
+            session = Session(f"s{n:03d}", "v1", started_at=f"2024-01-{rng.randint(1, 9):02d}T10:00:0{rng.randint(0, 3)}")
+            if rng.random() < 0.8:
+                session.answers = [AnswerRecord(1, ["A1"], "ответ")]
+            session.completed = rng.random() < 0.3
+            await store.save(session)
+            sessions.append(session)
+        # завершение и удаление убирают сессии из индекса
+        sessions[0].answers, sessions[0].completed = [AnswerRecord(1, ["A1"], "x")], True
+        await store.save(sessions[0])
+        await store.delete(sessions[1].id)
+        alive = [s for s in sessions if s.id != sessions[1].id and s.in_progress]
+
+        for _ in range(30):
+            newest_first = rng.random() < 0.5
+            since = f"2024-01-0{rng.randint(1, 5)}" if rng.random() < 0.5 else None
+            until = f"2024-01-0{rng.randint(5, 9)}" if rng.random() < 0.5 else None
+            batch = {} if kind == "memory" else {"batch_size": 7}
+            pivot = rng.choice(alive).key if rng.random() < 0.5 else None
+            expected = sorted(
+                (
+                    s.key for s in alive
+                    if (not since or s.started_at >= since) and (not until or s.started_at < until)
+                    and (not pivot or ((s.key < pivot) if newest_first else (s.key > pivot)))
+                ),
+                reverse=newest_first,
+            )
+            found = [
+                session.key
+                async for session in store.iter_in_progress(pivot, newest_first, since, until, **batch)
+            ]
+            assert found == expected
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", ["memory", "sqlite", "redis"])
+def test_expired_sessions_stop_counting_as_active(kind, tmp_path):
+    async def scenario():
+        stats = LiveStats()
+        store = make_store(kind, tmp_path, ttl_seconds=60, on_evict=stats.session_evicted)
+        abandoned, finished = Session("abandoned", "v1"), Session("finished", "v1")
+        for session in (abandoned, finished):
+            stats.session_started(session)
+            session.answers = [AnswerRecord(1, ["A1"], "ответ")]
+            await store.save(session)
+        finished.completed = True
+        await store.save(finished)
+        stats.session_completed(finished)
+        assert stats.active_sessions == 1
+
+        store.ttl_seconds = 0.01
+        time.sleep(0.05)
+        await store.sweep()
+        assert stats.active_sessions == 0
+        assert [session async for session in store.iter_in_progress()] == []
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_lru_eviction_is_reported():
+    async def scenario():
+        stats = LiveStats()
+        store = MemorySessionStore(max_sessions=2, on_evict=stats.session_evicted)
+        for n in range(3):
+            session = Session(f"s{n}", "v1")
+            stats.session_started(session)
+            await store.save(session)
+        assert stats.active_sessions == 2
+        assert await store.get("s0") is None
+
+    asyncio.run(scenario())
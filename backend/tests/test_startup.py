@@ -0,0 +1,43 @@
+"""Запуск приложения на пустой базе результатов"""
+import os
+import sqlite3
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from results_store import ResultsStore  # noqa: E402
+
+
+def test_empty_store_has_nothing_to_backfill(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite3"))
+    assert store.build_search_index() == 0
+    store.close()
+    db = sqlite3.connect(str(tmp_path / "results.sqlite3"))
+    assert db.execute("SELECT COUNT(*) FROM meta WHERE key = 'fts_backfill_until'").fetchone()[0] == 0
+
+
+def test_null_backfill_marker_is_dropped(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+    ResultsStore(path).close()
+    db = sqlite3.connect(path)
+    db.execute("INSERT INTO meta (key, value) VALUES ('fts_backfill_until', NULL)")
+    db.commit()
+    db.close()
+    store = ResultsStore(path)
+    assert store.build_search_index() == 0
+    assert store.build_search_index() == 0
+    store.close()
+
+
+def test_app_starts_on_empty_database(app_main, tmp_path):
+    from fastapi.testclient import TestClient
+
+    # версии опроса пишутся в SURVEY_VERSIONS_DIR, а не в каталог репозитория
+    assert app_main.survey_store.directory == str(tmp_path / "survey_versions")
+    assert (tmp_path / "survey_versions" / "manifest.json").exists()
+    with TestClient(app_main.app) as client:
+        assert client.get("/").status_code == 200
+        # Retry-After и заголовки хода/трассы доступны фронтенду с другого origin
+        exposed = client.get("/", headers={"Origin": "http://localhost:3000"}).headers["access-control-expose-headers"]
+        assert {"Retry-After", "Idempotent-Replayed", "X-Trace-Id"} <= {h.strip() for h in exposed.split(",")}
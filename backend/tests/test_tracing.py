@@ -0,0 +1,43 @@
+"""Время запроса считается до конца тела, в том числе у потоковых ответов"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from metrics import Histogram  # noqa: E402
+from tracing import RequestInstrumentation, SlowRequestProfiler, recent_traces  # noqa: E402
+
+
+def test_streaming_response_is_timed_until_the_last_chunk():
+    pytest.importorskip("fastapi")
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+
+    @app.get("/stream/{item_id}")
+    async def stream(item_id: str):
+        async def chunks():
+            for n in range(3):
+                await asyncio.sleep(0.1)
+                yield f"{n}\n"
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    histogram = Histogram("test_request_duration_seconds", "test", ("method", "route", "status"), registry=None)
+    app.add_middleware(RequestInstrumentation, histogram=histogram, profiler=SlowRequestProfiler(sample_rate=0))
+
+    with TestClient(app) as client:
+        response = client.get("/stream/abc", headers={"X-Trace": "1"})
+        assert response.text == "0\n1\n2\n"
+        assert response.headers["x-trace-id"] == recent_traces[-1]["trace_id"]
+        assert client.get("/missing").status_code == 404
+
+    _, total, count = histogram._values[("GET", "/stream/{item_id}", "200")]
+    assert count == 1 and total >= 0.3
+    assert recent_traces[-1]["route"] == "/stream/{item_id}" and recent_traces[-1]["duration_ms"] >= 300
+    assert ("GET", "unmatched", "404") in histogram._values
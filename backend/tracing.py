@@ -0,0 +1,198 @@
+"""Этапы обработки запроса: метрики, трассы и профили медленных запросов.
+
+span("stage") замеряет этап и пишет длительность в гистограмму
+survey_stage_duration_seconds. Если для запроса включена трасса
+(TRACE_SAMPLE_RATE или заголовок X-Trace: 1), этап попадает и в нее;
+последние трассы хранятся в памяти для /admin/traces.
+
+Профилирование: при PROFILE_SAMPLE_RATE > 0 выбранные запросы выполняются
+под cProfile (или pyinstrument, если PROFILER=pyinstrument и он установлен),
+и профиль сохраняется в PROFILE_DIR, только если запрос шел дольше
+PROFILE_SLOW_MS. Одновременно профилируется не больше одного запроса;
+в асинхронном сервере в профиль попадают и соседние задачи.
+"""
+import contextvars
+import os
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Optional
+
+from metrics import STAGE_DURATION
+
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILER = os.getenv("PROFILER", "cprofile")
+
+
+class Trace:
+    __slots__ = ("id", "name", "started", "spans")
+
+    def __init__(self, name: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def to_dict(self, duration_ms: float, **attributes) -> Dict[str, Any]:
+        return {"trace_id": self.id, "name": self.name, "duration_ms": round(duration_ms, 2), **attributes, "spans": self.spans}
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+recent_traces: Deque[Dict[str, Any]] = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+@contextmanager
+def span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append({
+                "stage": stage,
+                "start_ms": round((started - trace.started) * 1000, 2),
+                "duration_ms": round(elapsed * 1000, 2),
+            })
+
+
+def start_trace(name: str, forced: bool = False) -> Optional[contextvars.Token]:
+    """Начать трассу запроса (с вероятностью TRACE_SAMPLE_RATE или принудительно)"""
+    if not forced and (TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE):
+        return None
+    return _current_trace.set(Trace(name))
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.id if trace is not None else None
+
+
+def finish_trace(token: Optional[contextvars.Token], **attributes) -> Optional[Dict[str, Any]]:
+    if token is None:
+        return None
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    if trace is None:
+        return None
+    trace.spans.sort(key=lambda s: s["start_ms"])
+    result = trace.to_dict((time.perf_counter() - trace.started) * 1000, **attributes)
+    recent_traces.append(result)
+    return result
+
+
+class SlowRequestProfiler:
+    """Профиль выбранного запроса сохраняется, если запрос оказался медленным"""
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, slow_ms: float = PROFILE_SLOW_MS,
+                 directory: str = PROFILE_DIR, profiler: str = PROFILER):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.directory = directory
+        self.profiler = profiler
+        self._busy = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self):
+        """Профилировщик для этого запроса или None"""
+        if not self.enabled or self._busy or random.random() >= self.sample_rate:
+            return None
+        self._busy = True
+        if self.profiler == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                Profiler = None
+            if Profiler is not None:
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+                return profiler
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler, name: str, duration_ms: float) -> Optional[str]:
+        """Остановить профилировщик; вернуть путь к файлу, если запрос был медленным"""
+        if profiler is None:
+            return None
+        self._busy = False
+        is_pyinstrument = not hasattr(profiler, "disable")
+        if is_pyinstrument:
+            profiler.stop()
+        else:
+            profiler.disable()
+        if duration_ms < self.slow_ms:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+        base = os.path.join(self.directory, f"{time.strftime('%Y%m%d_%H%M%S')}_{safe_name}_{int(duration_ms)}ms")
+        if is_pyinstrument:
+            path = base + ".html"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        else:
+            path = base + ".prof"
+            profiler.dump_stats(path)
+        return path
+
+
+class RequestInstrumentation:
+    """ASGI middleware: гистограмма по маршрутам, трасса этапов и профиль медленных запросов.
+
+    Время запроса - до последней части тела (more_body=False), поэтому потоковые
+    ответы (NDJSON, SSE, экспорт) учитываются целиком, а не до отправки заголовков.
+    """
+
+    def __init__(self, app, histogram, profiler: SlowRequestProfiler):
+        self.app = app
+        self.histogram = histogram
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        forced = (b"x-trace", b"1") in scope["headers"]
+        trace_token = start_trace(f"{method} {scope['path']}", forced=forced)
+        trace_id = current_trace_id()
+        profile = self.profiler.start()
+        started = time.perf_counter()
+        status_code = 500
+        ended: Optional[float] = None
+
+        async def instrumented_send(message):
+            nonlocal status_code, ended
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if trace_id is not None:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-trace-id", trace_id.encode("ascii"))]}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                ended = time.perf_counter()
+
+        try:
+            await self.app(scope, receive, instrumented_send)
+        finally:
+            # тело может отправляться из дочерней задачи: запись - здесь, в контексте запроса
+            duration = (ended or time.perf_counter()) - started
+            # шаблон маршрута, а не путь: session_id не должен попадать в метки
+            route_path = getattr(scope.get("route"), "path", "unmatched")
+            self.histogram.observe(duration, method=method, route=route_path, status=str(status_code))
+            profile_path = self.profiler.stop(profile, f"{method} {route_path}", duration * 1000)
+            finish_trace(trace_token, route=route_path, status=status_code, profile=profile_path)
@@ -0,0 +1,115 @@
+"""Идемпотентные ходы чата.
+
+Клиент передает turn_id каждого сообщения и повторяет его при повторной
+отправке. Для сессии хранятся последние ответы по turn_id и ходы, которые
+еще выполняются: дубликат, пришедший во время обработки, ждет ту же задачу,
+поздний повтор получает сохраненный ответ. Ход выполняется отдельной
+задачей, поэтому обрыв соединения у первого запроса не прерывает его на
+середине (между записью ответа и сохранением результата хода).
+
+Ходы одной сессии выполняются по очереди (asyncio.Lock на сессию), так что
+два сообщения не сдвинут current_question_index одновременно.
+Ответы хранятся в памяти процесса.
+"""
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class TurnConflict(Exception):
+    """turn_id уже использован с другим сообщением"""
+
+
+class TurnGate:
+    def __init__(self, responses_per_session: int = 8, max_sessions: int = 10000):
+        self.responses_per_session = responses_per_session
+        self.max_sessions = max_sessions
+        # session_id -> [lock, число владельцев и ожидающих]
+        self._locks: Dict[str, List[Any]] = {}
+        # session_id -> turn_id -> (сообщение, ответ), самые свежие сессии в конце
+        self._responses: "OrderedDict[str, OrderedDict[str, Tuple[str, Any]]]" = OrderedDict()
+        # (session_id, turn_id) -> (сообщение, задача хода)
+        self._inflight: Dict[Tuple[str, str], Tuple[str, asyncio.Task]] = {}
+        self.replayed = 0
+
+    @asynccontextmanager
+    async def session_lock(self, session_id: str):
+        entry = self._locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[session_id]
+
+    def lookup(self, session_id: str, turn_id: str, message: str) -> Optional[Any]:
+        """Сохраненный ответ хода или None; другой текст с тем же turn_id - TurnConflict"""
+        stored = self._responses.get(session_id, {}).get(turn_id)
+        if stored is None:
+            return None
+        if stored[0] != message:
+            raise TurnConflict(turn_id)
+        self.replayed += 1
+        return stored[1]
+
+    def remember(self, session_id: str, turn_id: str, message: str, value: Any):
+        turns = self._responses.pop(session_id, None) or OrderedDict()
+        turns[turn_id] = (message, value)
+        turns.move_to_end(turn_id)
+        while len(turns) > self.responses_per_session:
+            turns.popitem(last=False)
+        self._responses[session_id] = turns
+        while len(self._responses) > self.max_sessions:
+            self._responses.popitem(last=False)
+
+    async def run(
+        self,
+        session_id: str,
+        turn_id: Optional[str],
+        message: str,
+        work: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """(ответ хода, True если это повтор уже выполненного или выполняемого хода)"""
+        if turn_id is None:
+            async with self.session_lock(session_id):
+                return await work(), False
+
+        cached = self.lookup(session_id, turn_id, message)
+        if cached is not None:
+            return cached, True
+
+        key = (session_id, turn_id)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            if inflight[0] != message:
+                raise TurnConflict(turn_id)
+            self.replayed += 1
+            return await asyncio.shield(inflight[1]), True
+
+        task = asyncio.create_task(self._run_locked(session_id, turn_id, message, work))
+        self._inflight[key] = (message, task)
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), False
+
+    async def _run_locked(self, session_id: str, turn_id: str, message: str, work):
+        async with self.session_lock(session_id):
+            value = await work()
+            self.remember(session_id, turn_id, message, value)
+            return value
+
+    def _finished(self, key: Tuple[str, str], task: asyncio.Task):
+        self._inflight.pop(key, None)
+        # ошибку получают ожидающие запросы; если их уже нет - не пишем "never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._responses),
+            "inflight": len(self._inflight),
+            "locked_sessions": len(self._locks),
+            "replayed": self.replayed,
+        }
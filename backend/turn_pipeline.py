@@ -0,0 +1,190 @@
+"""Конвейер обработки одного ответа в чате.
+
+Сопоставление ответа и генерация благодарности запускаются одновременно:
+благодарность зависит только от текста пользователя, поэтому ее можно
+начать спекулятивно и отбросить, если ответ не распознан.
+Для каждого этапа замеряется время.
+"""
+import asyncio
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional
+
+
+ACK_MODE_LLM = "llm"
+ACK_MODE_TEMPLATE = "template"
+ACK_MODES = (ACK_MODE_LLM, ACK_MODE_TEMPLATE)
+
+ACK_TEMPLATES = (
+    "Спасибо за ответ!",
+    "Спасибо, ответ записан!",
+    "Благодарю за ответ!",
+    "Отлично, спасибо!",
+    "Спасибо, ответ принят!",
+)
+
+
+def template_acknowledgement(user_message: str) -> str:
+    """Благодарность без обращения к API (детерминированно по тексту ответа)"""
+    return ACK_TEMPLATES[zlib.crc32(user_message.encode("utf-8")) % len(ACK_TEMPLATES)]
+
+
+@dataclass
+class TurnResult:
+    matched_codes: List[str]
+    acknowledgement: Optional[str]
+    # длительность этапов, миллисекунды
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def server_timing(self) -> str:
+        """Значение для заголовка Server-Timing"""
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in self.timings.items())
+
+
+@contextmanager
+def timed(timings: Dict[str, float], stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = (time.perf_counter() - started) * 1000
+
+
+async def run_turn(
+    match: Callable[[], Awaitable[List[str]]],
+    acknowledge: Optional[Callable[[], Awaitable[str]]],
+) -> TurnResult:
+    """Сопоставление ответа и (если нужна) благодарность параллельно.
+
+    acknowledge=None - благодарность не нужна (последний вопрос или шаблонный режим,
+    который вызывающий код обрабатывает сам).
+    """
+    timings: Dict[str, float] = {}
+    ack_task = None
+
+    async def acknowledge_timed() -> str:
+        with timed(timings, "ack"):
+            return await acknowledge()
+
+    with timed(timings, "total"):
+        if acknowledge is not None:
+            ack_task = asyncio.create_task(acknowledge_timed())
+
+        try:
+            with timed(timings, "match"):
+                matched_codes = await match()
+        except BaseException:
+            if ack_task is not None:
+                ack_task.cancel()
+            raise
+
+        acknowledgement = None
+        if ack_task is not None:
+            if matched_codes:
+                acknowledgement = await ack_task
+            else:
+                # ответ не распознан - благодарность не нужна
+                ack_task.cancel()
+
+    return TurnResult(matched_codes=matched_codes, acknowledgement=acknowledgement, timings=timings)
+
+
+class PrefetchedStream:
+    """Асинхронный поток, который начинает читаться сразу при создании.
+
+    Нужен для потоковой благодарности: запрос к LLM стартует вместе с
+    сопоставлением, а фрагменты ждут в очереди, пока их не начнут отдавать.
+    Ошибка источника пробрасывается при чтении.
+    """
+
+    _END = object()
+
+    def __init__(self, source: AsyncIterator[str]):
+        self._queue: "asyncio.Queue" = asyncio.Queue()
+        self._task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for item in source:
+                self._queue.put_nowait(item)
+        except Exception as e:
+            self._queue.put_nowait(e)
+        finally:
+            self._queue.put_nowait(self._END)
+
+    async def __aiter__(self):
+        while True:
+            item = await self._queue.get()
+            if item is self._END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def cancel(self):
+        if not self._task.done():
+            self._task.cancel()
+            # задача могла не успеть стартовать - читатель не должен зависнуть
+            self._queue.put_nowait(self._END)
+
+
+class LatencyRecorder:
+    """Скользящее окно последних замеров по этапам с перцентилями"""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, timings: Dict[str, float]):
+        for stage, ms in timings.items():
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(ms)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for stage, samples in self._samples.items():
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            result[stage] = {
+                "count": len(ordered),
+                "p50_ms": round(_percentile(ordered, 0.50), 1),
+                "p95_ms": round(_percentile(ordered, 0.95), 1),
+                "p99_ms": round(_percentile(ordered, 0.99), 1),
+            }
+        return result
+
+
+class UsageRecorder:
+    """Токены LLM на один ответ: средние по последним ответам"""
+
+    def __init__(self, window: int = 1000):
+        self._samples: Deque[Dict[str, int]] = deque(maxlen=window)
+
+    def record(self, usage: Dict[str, int]):
+        self._samples.append(dict(usage))
+
+    def summary(self) -> Dict[str, float]:
+        count = len(self._samples)
+        if not count:
+            return {"count": 0}
+        totals: Dict[str, int] = {}
+        for sample in list(self._samples):
+            for key, value in sample.items():
+                totals[key] = totals.get(key, 0) + value
+        result: Dict[str, float] = {"count": count}
+        for key, value in totals.items():
+            result[f"avg_{key}_tokens"] = round(value / count, 1)
+        prompt = totals.get("prompt", 0)
+        result["cached_share"] = round(totals.get("cached", 0) / prompt, 4) if prompt else 0.0
+        return result
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
@@ -1,20 +1,29 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import axios from 'axios'
 import './AdminPanel.css'
 
 const API_URL = 'http://localhost:8000'
+const RESPONSES_PAGE_SIZE = 50
 
 function AdminPanel() {
   const [isLoggedIn, setIsLoggedIn] = useState(false)
   const [token, setToken] = useState('')
   const [stats, setStats] = useState(null)
+  const [distribution, setDistribution] = useState([])
+  // версия опроса, по которой загружено распределение
+  const distributionVersion = useRef(null)
   const [responses, setResponses] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
+  const [responseFilters, setResponseFilters] = useState({
+    status: 'all', order: 'desc', since: '', until: '', question_id: '', answer_code: ''
+  })
   const [currentSurvey, setCurrentSurvey] = useState([])
   const [activeTab, setActiveTab] = useState('dashboard')
   const [loginData, setLoginData] = useState({ username: '', password: '' })
   const [surveyJson, setSurveyJson] = useState('')
   const [uploadMessage, setUploadMessage] = useState('')
   const [surveyVersions, setSurveyVersions] = useState([])
+  const [exportRange, setExportRange] = useState({ since: '', until: '' })
 
 
   const handleLogin = async (e) => {
@@ -42,12 +51,48 @@ function AdminPanel() {
   useEffect(() => {
     if (isLoggedIn) {
       loadStats()
+      loadDistribution()
       loadResponses()
       loadCurrentSurvey()
       loadSurveyVersions()
     }
   }, [isLoggedIn])
 
+  // живые обновления: сервер присылает снимок счетчиков и пачки событий
+  useEffect(() => {
+    if (!isLoggedIn || !token) return
+
+    const events = new EventSource(`${API_URL}/admin/events?token=${encodeURIComponent(token)}`)
+
+    const applySnapshot = (snapshot) => {
+      const { tallies, tallies_version, ...counters } = snapshot
+      setStats(counters)
+      // распределение еще грузится или опубликована новая версия - ее вопросы перечитываем целиком
+      if (tallies_version !== distributionVersion.current) {
+        if (distributionVersion.current !== null) loadDistribution()
+        return
+      }
+      setDistribution((questions) => questions.map((question) => {
+        const counts = tallies[question.question_id] || {}
+        return {
+          ...question,
+          total: Object.values(counts).reduce((sum, count) => sum + count, 0),
+          options: question.options.map((option) => ({ ...option, count: counts[option.code] || 0 }))
+        }
+      }))
+    }
+
+    events.addEventListener('stats', (e) => applySnapshot(JSON.parse(e.data)))
+    events.addEventListener('batch', (e) => applySnapshot(JSON.parse(e.data).stats))
+    // клиент отстал - перечитываем состояние целиком
+    events.addEventListener('resync', () => {
+      loadStats()
+      loadDistribution()
+    })
+
+    return () => events.close()
+  }, [isLoggedIn, token])
+
   const loadStats = async () => {
     try {
       const response = await axios.get(`${API_URL}/admin/stats`, {
@@ -59,12 +104,32 @@ function AdminPanel() {
     }
   }
 
-  const loadResponses = async () => {
+  const loadDistribution = async () => {
     try {
-      const response = await axios.get(`${API_URL}/admin/responses`, {
+      const response = await axios.get(`${API_URL}/admin/stats/distribution`, {
         headers: { Authorization: `Bearer ${token}` }
       })
-      setResponses(response.data.responses)
+      distributionVersion.current = response.data.survey_version
+      setDistribution(response.data.questions)
+    } catch (error) {
+      console.error('Error loading distribution:', error)
+    }
+  }
+
+  // cursor = null - первая страница, иначе продолжение списка
+  const loadResponses = async (cursor = null) => {
+    try {
+      const params = { limit: RESPONSES_PAGE_SIZE }
+      Object.entries(responseFilters).forEach(([key, value]) => {
+        if (value) params[key] = value
+      })
+      if (cursor) params.cursor = cursor
+      const response = await axios.get(`${API_URL}/admin/responses`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params
+      })
+      setResponses(cursor ? [...responses, ...response.data.responses] : response.data.responses)
+      setNextCursor(response.data.next_cursor)
     } catch (error) {
       console.error('Error loading responses:', error)
     }
@@ -81,9 +146,9 @@ function AdminPanel() {
     }
   }
 
-  const loadSurveyVersion = async (filename) => {
+  const loadSurveyVersion = async (version) => {
     try {
-      const response = await axios.get(`${API_URL}/admin/survey/versions/${filename}`, 
+      const response = await axios.get(`${API_URL}/admin/survey/versions/${version}`, 
         { headers: { Authorization: `Bearer ${token}` } }
       )
       setSurveyJson(JSON.stringify(response.data, null, 2))
@@ -109,41 +174,31 @@ function AdminPanel() {
     localStorage.removeItem('admin_token')
   }
 
-  const exportCSV = async () => {
-    try {
-      const response = await axios.get(`${API_URL}/admin/export/csv`, {
-        headers: { Authorization: `Bearer ${token}` }
-      })
-      
-      // создаем и скачиваем файл
-      const blob = new Blob([response.data.csv_data], { type: 'text/csv' })
-      const url = window.URL.createObjectURL(blob)
-      const a = document.createElement('a')
-      a.href = url
-      a.download = `survey_results_${new Date().toISOString().split('T')[0]}.csv`
-      a.click()
-      window.URL.revokeObjectURL(url)
-    } catch (error) {
-      alert('Ошибка экспорта: ' + error.response?.data?.detail)
-    }
-  }
-
-  const exportJSON = async () => {
+  const exportResults = async (format) => {
     try {
-      const response = await axios.get(`${API_URL}/admin/export/json`, {
-        headers: { Authorization: `Bearer ${token}` }
+      // сервер отдает файл потоком; фильтры по датам необязательны
+      const params = {}
+      if (exportRange.since) params.since = exportRange.since
+      if (exportRange.until) params.until = exportRange.until
+      const response = await axios.get(`${API_URL}/admin/export/${format}`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params,
+        responseType: 'blob'
       })
       
-      // создаем и скачиваем файл
-      const blob = new Blob([response.data.json_data], { type: 'application/json' })
-      const url = window.URL.createObjectURL(blob)
+      // скачиваем файл
+      const url = window.URL.createObjectURL(response.data)
       const a = document.createElement('a')
       a.href = url
-      a.download = `survey_results_${new Date().toISOString().split('T')[0]}.json`
+      a.download = `survey_results_${new Date().toISOString().split('T')[0]}.${format}`
       a.click()
       window.URL.revokeObjectURL(url)
     } catch (error) {
-      alert('Ошибка экспорта: ' + error.response?.data?.detail)
+      // при responseType: 'blob' текст ошибки тоже приходит как Blob
+      const detail = error.response?.data instanceof Blob
+        ? JSON.parse(await error.response.data.text()).detail
+        : error.response?.data?.detail
+      alert('Ошибка экспорта: ' + detail)
     }
   }
 
@@ -154,13 +209,15 @@ function AdminPanel() {
     }
 
     try {
-      const questions = JSON.parse(surveyJson)
+      const parsed = JSON.parse(surveyJson)
+      // формат: список вопросов или { settings, questions }
+      const payload = Array.isArray(parsed) ? { questions: parsed } : parsed
       const response = await axios.post(`${API_URL}/admin/survey/upload`, 
-        { questions },
+        payload,
         { headers: { Authorization: `Bearer ${token}` } }
       )
       
-      alert(`Опрос успешно загружен! Вопросов: ${response.data.questions_count}. Предыдущая версия сохранена: ${response.data.previous_version_saved ? 'Да' : 'Нет'}`)
+      alert(`Опрос успешно загружен! Вопросов: ${response.data.questions_count}. Предыдущая версия сохранена: ${response.data.previous_version_saved ? 'Да' : 'Нет'}${response.data.created ? '' : '. Такая версия уже была загружена'}`)
       setSurveyJson('')
       loadCurrentSurvey() // Перезагружаем текущий опрос
       loadSurveyVersions() // Загружаем список версий
@@ -296,14 +353,61 @@ function AdminPanel() {
               </div>
             </div>
 
+            <div className="distribution-section">
+              <h3>Распределение ответов</h3>
+              {distribution.map((question) => (
+                <div key={question.question_id} className="distribution-question">
+                  <div className="distribution-title">
+                    {question.question} <span className="distribution-total">({question.total})</span>
+                  </div>
+                  {question.options.map((option) => (
+                    <div key={option.code} className="distribution-row">
+                      <span className="distribution-label">{option.text}</span>
+                      <div className="distribution-bar">
+                        <div
+                          className="distribution-fill"
+                          style={{ width: `${question.total > 0 ? (option.count / question.total) * 100 : 0}%` }}
+                        />
+                      </div>
+                      <span className="distribution-count">{option.count}</span>
+                    </div>
+                  ))}
+                </div>
+              ))}
+            </div>
+
             <div className="export-section">
+              <div className="export-range">
+                <label>
+                  С:
+                  <input
+                    type="date"
+                    value={exportRange.since}
+                    onChange={(e) => setExportRange({...exportRange, since: e.target.value})}
+                  />
+                </label>
+                <label>
+                  До:
+                  <input
+                    type="date"
+                    value={exportRange.until}
+                    onChange={(e) => setExportRange({...exportRange, until: e.target.value})}
+                  />
+                </label>
+              </div>
               <div className="export-buttons">
-                <button onClick={exportCSV} className="export-button csv-button">
+                <button onClick={() => exportResults('csv')} className="export-button csv-button">
                   Экспорт в CSV
                 </button>
-                <button onClick={exportJSON} className="export-button json-button">
+                <button onClick={() => exportResults('json')} className="export-button json-button">
                   Экспорт в JSON
                 </button>
+                <button onClick={() => exportResults('jsonl')} className="export-button json-button">
+                  Экспорт в JSONL
+                </button>
+                <button onClick={() => exportResults('parquet')} className="export-button csv-button">
+                  Экспорт в Parquet
+                </button>
               </div>
             </div>
           </div>
@@ -312,6 +416,48 @@ function AdminPanel() {
         {activeTab === 'responses' && (
           <div className="responses-tab">
             <h2>Все ответы</h2>
+            <div className="responses-filters">
+              <select
+                value={responseFilters.status}
+                onChange={(e) => setResponseFilters({...responseFilters, status: e.target.value})}
+              >
+                <option value="all">Все</option>
+                <option value="completed">Завершенные</option>
+                <option value="in_progress">В процессе</option>
+              </select>
+              <select
+                value={responseFilters.order}
+                onChange={(e) => setResponseFilters({...responseFilters, order: e.target.value})}
+              >
+                <option value="desc">Сначала новые</option>
+                <option value="asc">Сначала старые</option>
+              </select>
+              <input
+                type="date"
+                value={responseFilters.since}
+                onChange={(e) => setResponseFilters({...responseFilters, since: e.target.value})}
+              />
+              <input
+                type="date"
+                value={responseFilters.until}
+                onChange={(e) => setResponseFilters({...responseFilters, until: e.target.value})}
+              />
+              <input
+                type="text"
+                placeholder="ID вопроса"
+                value={responseFilters.question_id}
+                onChange={(e) => setResponseFilters({...responseFilters, question_id: e.target.value})}
+              />
+              <input
+                type="text"
+                placeholder="Код ответа"
+                value={responseFilters.answer_code}
+                onChange={(e) => setResponseFilters({...responseFilters, answer_code: e.target.value})}
+              />
+              <button onClick={() => loadResponses()} className="responses-button">
+                Применить
+              </button>
+            </div>
             <div className="responses-table">
               {responses.map((response, index) => (
                 <div key={index} className="response-card">
@@ -338,6 +484,11 @@ function AdminPanel() {
                 </div>
               ))}
             </div>
+            {nextCursor && (
+              <button onClick={() => loadResponses(nextCursor)} className="responses-button load-more-button">
+                Загрузить еще
+              </button>
+            )}
           </div>
         )}
 
@@ -394,10 +545,10 @@ function AdminPanel() {
                 <p>Нет сохраненных версий</p>
               ) : (
                 <div className="versions-grid">
-                  {surveyVersions.map((version, index) => (
-                    <div key={index} className="version-card">
+                  {surveyVersions.map((version) => (
+                    <div key={version.version} className="version-card">
                       <div className="version-header">
-                        <h4>Версия {index + 1}</h4>
+                        <h4>{version.current ? 'Текущая версия' : `Версия ${version.version.slice(0, 8)}`}</h4>
                         <span className="version-date">
                           {new Date(version.timestamp).toLocaleString('ru-RU')}
                         </span>
@@ -408,7 +559,7 @@ function AdminPanel() {
                       </div>
                       <button 
                         className="load-version-button"
-                        onClick={() => loadSurveyVersion(version.filename)}
+                        onClick={() => loadSurveyVersion(version.version)}
                       >
                         Загрузить в редактор
                       </button>
@@ -67,20 +67,72 @@ function ChatPage() {
     setIsLoading(true)
 
     try {
-      const response = await axios.post(`${API_URL}/chat/message`, {
-        session_id: sessionId,
-        message: userMessage
+      // ответ приходит потоком NDJSON: благодарность по фрагментам, затем следующий вопрос;
+      // при сбое сети запрос повторяется с тем же turn_id - сервер не запишет ответ дважды
+      const turnId = crypto.randomUUID()
+      const send = () => fetch(`${API_URL}/chat/message/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ session_id: sessionId, message: userMessage, turn_id: turnId })
       })
+      const response = await send().catch(send)
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`)
+      }
 
-      // Добавляем ответ бота
-      setMessages(prev => [...prev, {
-        type: 'bot',
-        text: response.data.message,
-        timestamp: new Date().toISOString()
-      }])
+      // сообщение бота появляется с первым фрагментом и дописывается по мере прихода событий
+      const botId = `${Date.now()}-${Math.random()}`
+      let ackText = ''
+      const setBotText = (text) => {
+        setIsLoading(false)
+        setMessages(prev => prev.some(msg => msg.id === botId)
+          ? prev.map(msg => msg.id === botId ? { ...msg, text } : msg)
+          : [...prev, { id: botId, type: 'bot', text, timestamp: new Date().toISOString() }]
+        )
+      }
 
-      setCurrentQuestion(response.data.current_question)
-      setIsCompleted(response.data.is_completed)
+      const handleEvent = (event) => {
+        switch (event.type) {
+          case 'ack_delta':
+            ackText += event.text
+            setBotText(ackText)
+            break
+          case 'ack':
+            ackText = event.text
+            setBotText(ackText)
+            break
+          case 'question':
+            setBotText(`${ackText}\n\n${event.message}`)
+            setCurrentQuestion(event.current_question)
+            break
+          case 'unclear':
+            setBotText(event.message)
+            setCurrentQuestion(event.current_question)
+            break
+          case 'completed':
+            setBotText(event.message)
+            setCurrentQuestion(null)
+            setIsCompleted(true)
+            break
+          case 'error':
+            // ход не выполнен: сообщение об ошибке и снова доступный ввод, как при ошибке запроса
+            throw new Error(event.detail || 'Turn failed')
+          default:
+            break
+        }
+      }
+
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const lines = buffer.split('\n')
+        buffer = lines.pop()
+        lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)))
+      }
 
     } catch (error) {
       console.error('Error sending message:', error)
@@ -6,12 +6,24 @@ const API_URL = 'http://localhost:8000'
 
 function HomePage() {
   const [isLoading, setIsLoading] = useState(false)
+  const [isWaiting, setIsWaiting] = useState(false)
 
   const startSurvey = async () => {
     setIsLoading(true)
     try {
-      // Создаем новую сессию
-      const response = await axios.post(`${API_URL}/chat/start`)
+      // Создаем новую сессию; при перегрузке сервер просит подождать (503 + Retry-After)
+      let response
+      while (true) {
+        try {
+          response = await axios.post(`${API_URL}/chat/start`)
+          break
+        } catch (error) {
+          if (error.response?.status !== 503) throw error
+          setIsWaiting(true)
+          const retryAfter = Number(error.response.headers['retry-after']) || 5
+          await new Promise(resolve => setTimeout(resolve, retryAfter * 1000))
+        }
+      }
       // Перенаправляем на страницу чата с session_id
       window.location.href = `/chat/${response.data.session_id}`
     } catch (error) {
@@ -19,6 +31,7 @@ function HomePage() {
       alert('Ошибка при запуске опроса. Попробуйте еще раз.')
     } finally {
       setIsLoading(false)
+      setIsWaiting(false)
     }
   }
 
@@ -34,7 +47,7 @@ function HomePage() {
             onClick={startSurvey}
             disabled={isLoading}
           >
-            {isLoading ? 'Загрузка...' : 'Начать опрос'}
+            {isWaiting ? 'Много участников, ждем очереди...' : isLoading ? 'Загрузка...' : 'Начать опрос'}
           </button>
           <button 
             className="admin-toggle-button" 